@@ -1,107 +1,72 @@
-import abc
+import argparse
+import os
+import select
+import selectors
 import socket
+import sys
 import threading
 import time
 import tkinter as tk
+import uuid
 import tkinter.font
 from datetime import datetime
 from random import randint
 from PIL import ImageTk, Image
-from queue import Queue
-from operator import add, sub
+from queue import Queue, Empty
+from collections import deque
 
 import Dialog
+import ai
+import boardview
+import discovery
+import engine
+import lobby
+import protocol
+import render
+import replay
+import session
+import spectate
 from insthelp import resource_path
 from vars import *
 
 
-def _create_circle(self, x, y, r, **kwargs):
-    return self.create_oval(x - r, y - r, x + r, y + r, **kwargs)
+# what the game is waiting for
+PLACING, CHOOSING, YOUR_TURN, WAITING, THEIR_TURN, OVER = range(6)
 
 
-tk.Canvas.create_circle = _create_circle
-
-
-class Hole(object):
-    def __init__(self, mine: bool, coords):
-        self._mine = mine
-        self.coords = coords
-        self.hit = False
-        self.valid = False
-        if self._mine:
-            self.hold_ship = None
-
-
-class Peg:
-    def __init__(self):
-        self.hole = None
-
-
-class ColorPeg(Peg):
-    def __init__(self, color):
-        super().__init__()
-        self.color = color
-
-
-class ShipPeg(Peg):
-    def __init__(self, ship):
-        super().__init__()
-        self.ship = ship
-
-
-class Ship(metaclass=abc.ABCMeta):
-    def __init__(self, length: int):
-        self.length = length
-        self.pegs = []
-        for i in range(length):
-            self.pegs.append(ShipPeg(self))
+class Ship:
+    def __init__(self, board, index: int):
+        self.board = board
+        self.index = index
+        self.length = board.fleet[index]
+        self.cells = []
 
     def is_sunk(self):
-        for peg in self.pegs:
-            if not peg.hole.hit:
-                return False
-        return True
+        return self.board.is_sunk(self.index)
 
 
 class Player:
-    def __init__(self):
-        self.grid_mine = None
-        self.grid_opponent = None
-        x, y = PLAYER_START
-        self.mine = [[Hole(True, (x + SPACE * ii,
-                                  y + SPACE * i))
-                      for i in range(1, BOARD_HEIGHT + 1)]
-                     for ii in range(1, BOARD_WIDTH + 1)]
-        x, y = OPPONENT_START
-        self.opponent = [[Hole(False, (x + SPACE * ii,
-                                       y + SPACE * i))
-                          for i in range(1, BOARD_HEIGHT + 1)] for ii in range(1, BOARD_WIDTH + 1)]
-        self.ships = [Ship(2), Ship(3), Ship(3), Ship(4), Ship(5)]
-
-    # noinspection PyUnresolvedReferences
+    def __init__(self, width=BOARD_WIDTH, height=BOARD_HEIGHT, fleet=FLEET):
+        self.board = engine.Board(width, height, fleet)
+        self.target = engine.Target(width, height, fleet)
+        self.ships = [Ship(self.board, i) for i in range(len(self.board.fleet))]
+
     def place_ship(self, ship, coordinates):
-        ship_peg = (peg for peg in ship.pegs)
-
-        x = coordinates[0][0]
-        y = coordinates[0][1]
-        xe = coordinates[1][0]
-        ye = coordinates[1][1]
-        if x > xe or y > ye:
-            x, xe = xe, x
-            y, ye = ye, y
-        xp = 0
-        yp = 0
-        if x == xe:
-            yp = 1
-        else:
-            xp = 1
-        self.mine[x][y].hold_ship = peg = next(ship_peg)
-        peg.hole = self.mine[x][y]
-        while x != xe or y != ye:
-            x += xp
-            y += yp
-            self.mine[x][y].hold_ship = peg = next(ship_peg)
-            peg.hole = self.mine[x][y]
+        cells = self.board.cells(coordinates[0], coordinates[1])
+        self.board.place(ship.index, cells)
+        ship.cells = cells
+
+    def place_random(self):
+        """Places the ships that have not been placed yet at random."""
+        self.board.place_random()
+        for ship in self.ships:
+            ship.cells = self.board.ship_cells(ship.index)
+
+    def reset(self):
+        self.board.reset()
+        self.target.reset()
+        for ship in self.ships:
+            ship.cells = []
 
 
 class Broadcast(threading.Thread):
@@ -109,22 +74,41 @@ class Broadcast(threading.Thread):
         super().__init__()
         self.running = False
         self.master = master
+        self.schedule = discovery.BeaconSchedule()
+        self.wake = threading.Event()
+        self.hurried = None
 
     def run(self):
         self.running = True
-        s = socket.socket(type=socket.SOCK_DGRAM)
-        s.bind(('', 0))
-        s.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        s, address = discovery.open_sender()
+        encode = discovery.encode_text_beacon if BEACON_LEGACY else discovery.encode_beacon
+        beacon = encode(self.master.name, self.master.uuid, self.master.server.port)
         while self.running:
-            s.sendto(('%s\n%s\n%i' % (self.master.name, self.master.uuid, self.master.server.port)).encode(),
-                     ('<broadcast>', PORT))
-            time.sleep(1)
-        s.sendto(('%s\nCLOSED\n%s' % (self.master.name, self.master.uuid)).encode(), ('<broadcast>', PORT))
+            s.sendto(beacon, address)
+            wait = self.schedule.next()
+            while self.wake.wait(wait) and self.running:
+                # hurried, the next beacon is soon instead
+                self.wake.clear()
+                wait = self.schedule.soon()
+        s.sendto(encode(self.master.name, self.master.uuid, self.master.server.port, closed=True), address)
         s.close()
 
+    def hurry(self):
+        """
+        Beacons quickly again for a while, so that a player that just showed up finds us soon. Only
+        once every BEACON_MAX_INTERVAL, so players joining one after another do not keep the lobby busy.
+        """
+        now = time.monotonic()
+        if self.hurried is not None and now - self.hurried < BEACON_MAX_INTERVAL:
+            return
+        self.hurried = now
+        self.schedule.reset()
+        self.wake.set()
+
     def stop(self):
         if self.is_alive():
             self.running = False
+            self.wake.set()
             self.join()
 
 
@@ -134,24 +118,36 @@ class Client(threading.Thread):
         self.running = False
         self.master = master
         self.player_list = Client.PlayerList(master, callback)
+        self._wake_read, self._wake_write = socket.socketpair()
 
     def run(self):
         self.running = True
-        s = socket.socket(type=socket.SOCK_DGRAM)
-        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        s.bind(('', PORT))
-        s.setblocking(False)
+        s = discovery.open_listener()
+        selector = selectors.DefaultSelector()
+        selector.register(s, selectors.EVENT_READ)
+        selector.register(self._wake_read, selectors.EVENT_READ)
+        players = self.player_list.players
         while self.running:
-            try:
-                data, address = s.recvfrom(512)
-                self.player_list.process(data.decode(), address[0])
-            except BlockingIOError:
-                pass
+            # sleeps until a beacon arrives, stop() is called or the next peer is due to expire
+            for key, _ in selector.select(players.next_expiry()):
+                if key.fileobj is s:
+                    while True:
+                        try:
+                            data, address = s.recvfrom(512)
+                        except BlockingIOError:
+                            break
+                        players.count()
+                        self.player_list.process(data, address[0])
+            self.player_list.expire()
+        selector.close()
         s.close()
+        self._wake_read.close()
+        self._wake_write.close()
 
     def stop(self):
         if self.is_alive():
             self.running = False
+            self._wake_write.send(b'\0')
             if not self.player_list.destroyed:
                 self.player_list.cancel(destroy=False, focus=False)
             self.join()
@@ -164,19 +160,38 @@ class Client(threading.Thread):
             self.bind('<Escape>', self.cancel)
 
         def body(self, master):
-            self.body_frame = master
+            tk.Button(master, text='Play the computer', command=self.select_computer).pack(padx=5, pady=5)
+            self.view = lobby.PeerListView(master, self.select, self.players.stats)
+            self.view.pack()
+            self.status = tk.Label(master)
+            self.status.pack()
+            server = self.master.server
+            self.challenges = lobby.ChallengeListView(master, server.accept, server.decline)
+            self.challenges.pack()
+            server.view = self.challenges
 
         def cancel(self, event=None, destroy=True, focus=True):
+            if self.sock:
+                self.withdraw_challenge()
             super().cancel(event, focus)
             if destroy:
                 self.master.destroy()
             self.destroyed = True
 
         def __init__(self, master, callback):
-            self.body_frame = None
+            self.view = None
+            self.challenges = None
+            self.status = None
             self.player = None
-            self.players = {}
+            self.players = discovery.PeerTable()
+            # the challenge we sent: its socket, what is left to send, the answer so far
             self.sock = None
+            self.request = b''
+            self.reply = b''
+            # when the last of the answer came, to take an old peer's GRANTED once nothing more comes
+            self.replied = None
+            self.deadline = 0
+            self.after_id = None
             self.callback = callback
             self.destroyed = False
             super().__init__(master=master, title='Players', block=False)
@@ -184,79 +199,300 @@ class Client(threading.Thread):
         def validate(self):
             return True
 
-        def process(self, data: str, address):
-            data = data.splitlines()
-            name = data[0]
-            uuid = data[1]
-            port = data[2]
-            if uuid == self.master.uuid:
+        def process(self, data: bytes, address):
+            beacon = discovery.decode_beacon(data)
+            if not beacon:
                 return
-            if uuid == 'CLOSED':
-                uuid = port
-                if uuid in self.players:
-                    self.players[uuid][tk.Button].destroy()
-                    del self.players[uuid]
-            else:
-                if uuid not in self.players:
-                    self.players[uuid] = {'name': name, 'address': (address, int(port))}
-                    button = tk.Button(self.body_frame, text=name, command=lambda: self.select(uuid))
-                    button.pack(padx=5, pady=5)
-                    self.players[uuid][tk.Button] = button
-
-        def select(self, uuid):
-            player = self.players[uuid]
-            if self.master.name == player['name']:
+            name, peer_id, port, closed = beacon
+            if peer_id == self.master.uuid:
+                return
+            if closed:
+                if self.players.remove(peer_id):
+                    self.view.remove(peer_id)
+            elif self.players.seen(peer_id, name, (address, port)):
+                self.view.add(peer_id, name)
+                self.master.broad.hurry()
+
+        def expire(self):
+            for peer_id in self.players.expire():
+                self.view.remove(peer_id)
+
+        def select(self, peer_id):
+            """Challenges a player. The connection is made without blocking, see poll_challenge."""
+            if peer_id not in self.players:
+                return
+            player = self.players[peer_id]
+            if self.master.name == player.name:
                 return
+            self.withdraw_challenge()
             s = socket.socket()
-            s.connect(player['address'])
-            s.sendall(('CONNECT\nname=%s' % self.master.name).encode())
-            message = s.recv(512)
-            if message.decode() == 'GRANTED':
-                self.player = player
-                self.sock = s
-                self.withdraw()
-                self.callback(s, player['name'])
-            else:
-                print('Declined')
+            s.setblocking(False)
+            s.connect_ex(player.address)
+            self.player = player
+            self.sock = s
+            self.request = protocol.connect_request(self.master.name)
+            self.reply = b''
+            self.replied = None
+            self.deadline = time.monotonic() + CHALLENGE_TIMEOUT
+            self.status['text'] = 'Challenging %s...' % player.name
+            self.poll_challenge()
+
+        def poll_challenge(self):
+            """Sends CONNECT once connected and waits for the answer, a little every POLL_INTERVAL."""
+            self.after_id = None
+            s = self.sock
+            player = self.player
+            try:
+                if self.request:
+                    # writable once connected, or once connecting failed
+                    if select.select((), (s,), (), 0)[1]:
+                        error = s.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                        if error:
+                            raise OSError(error, os.strerror(error))
+                        try:
+                            self.request = self.request[s.send(self.request):]
+                        except (BlockingIOError, InterruptedError):
+                            pass
+                else:
+                    try:
+                        data = s.recv(512)
+                    except (BlockingIOError, InterruptedError):
+                        data = None
+                    if data == b'':
+                        # closed without an answer, or the answer was cut short
+                        self.answered(*protocol.split_handshake(self.reply, True))
+                        return
+                    if data:
+                        self.reply += data
+                        self.replied = time.monotonic()
+                        handshake = protocol.split_handshake(self.reply)
+                        if handshake:
+                            self.answered(*handshake)
+                            return
+                    elif self.replied and time.monotonic() > self.replied + HANDSHAKE_GRACE:
+                        # an old peer, its answer has no HANDSHAKE_END
+                        self.answered(*protocol.split_handshake(self.reply, True))
+                        return
+            except OSError as e:
+                self.withdraw_challenge('Can not reach %s: %s' % (player.name, e.strerror or e))
+                return
+            if time.monotonic() > self.deadline:
+                self.withdraw_challenge('%s did not answer.' % player.name)
+                return
+            self.after_id = self.after(POLL_INTERVAL, self.poll_challenge)
+
+        def answered(self, data, rest=b''):
+            """:param rest: what the other side sent right behind GRANTED, the game has to read it first"""
+            player = self.player
+            s = self.sock
+            try:
+                version = protocol.granted_version(data) if data else None
+            except UnicodeDecodeError:
+                version = None
+            if version is None:
+                self.withdraw_challenge('%s declined.' % player.name)
+                return
+            fields = protocol.parse_fields(data)[1]
+            try:
+                settings = protocol.game_settings(fields)
+            except ValueError as e:
+                self.withdraw_challenge('Can not play that game: %s' % e)
+                return
+            s.setblocking(True)
+            # the socket belongs to the game now
+            self.sock = None
+            self.withdraw()
+            # a host names the player it paired us with
+            self.callback(s, fields.get('name', player.name), version, settings, fields.get('session'),
+                          player.address, rest)
+
+        def withdraw_challenge(self, status=''):
+            """Gives up the challenge that is going on, if any."""
+            if self.after_id:
+                self.after_cancel(self.after_id)
+                self.after_id = None
+            if self.sock:
+                self.sock.close()
+            self.sock = None
+            self.player = None
+            if self.status:
+                self.status['text'] = status
+
+        def select_computer(self):
+            self.withdraw()
+            width, height, fleet, salvo, toss = self.master.settings
+            self.callback(ai.ComputerOpponent(self.master.queue, width=width, height=height, fleet=fleet, salvo=salvo),
+                          'Computer')
+
+
+class Challenge(object):
+    """A connection to the Server: it has HANDSHAKE_TIMEOUT seconds to send CONNECT, then CHALLENGE_TIMEOUT to be answered."""
+    __slots__ = ('key', 'sock', 'data', 'details', 'deadline', 'quiet')
+
+    def __init__(self, key, sock):
+        self.key = key
+        self.sock = sock
+        self.data = b''
+        self.details = None
+        self.deadline = time.monotonic() + HANDSHAKE_TIMEOUT
+        # when a CONNECT without protocol.HANDSHAKE_END is taken as it is, see protocol.split_handshake
+        self.quiet = None
+
+    def due(self):
+        return self.deadline if self.quiet is None else min(self.deadline, self.quiet)
 
 
 class Server(threading.Thread):
+    """
+    Takes challenges from other players. Every connection is handled by one selector loop, so a
+    challenger that is slow or says nothing only holds up itself. Challenges are listed in the
+    lobby until the player accepts or declines them from the Tk thread.
+    """
+
     def run(self):
         self.running = True
-        self.sock.listen(0)
+        self.sock.setblocking(False)
+        selector = selectors.DefaultSelector()
+        selector.register(self.sock, selectors.EVENT_READ)
+        selector.register(self._wake_read, selectors.EVENT_READ)
         try:
             while self.running:
+                deadline = min((challenge.due() for challenge in self.pending.values()), default=None)
+                timeout = None if deadline is None else max(0, deadline - time.monotonic())
+                for key, _ in selector.select(timeout):
+                    if key.fileobj is self.sock:
+                        self._accept(selector)
+                    elif key.fileobj is self._wake_read:
+                        self._wake_read.recv(512)
+                    else:
+                        self._read(selector, key.data)
+                self._answer(selector)
+                now = time.monotonic()
+                for challenge in [challenge for challenge in self.pending.values() if challenge.due() <= now]:
+                    if challenge.deadline > now and self._parse(challenge, True):
+                        continue
+                    self._drop(selector, challenge)
+        finally:
+            for challenge in list(self.pending.values()):
+                self._drop(selector, challenge)
+            selector.close()
+            self.sock.close()
+            self._wake_read.close()
+            self._wake_write.close()
+
+    def _accept(self, selector):
+        while True:
+            try:
                 client, address = self.sock.accept()
-                data = client.recv(1024)
-                data = data.decode().splitlines()
-                details = {}
-                first = True
-                for line in data:
-                    if first:
-                        first = False
-                        if line != 'CONNECT':
-                            break
-                        else:
-                            continue
-                    temp = line.split('=')
-                    details[temp[0]] = temp[1]
-                work = True
-                for i in ['name']:
-                    if i not in details:
-                        work = False
-                        break
-                if work:
-                    test = Server.ConfirmConnection(self.master, details)
-                    if test.connect:
-                        client.sendall('GRANTED'.encode())
-                        self.details = details
-                        self.client = client
-                        self.sock.close()
-                        self.running = False
-                        self.callback(client, details['name'])
-                        break
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                # out of file descriptors and the like, the challenger will try again
+                return
+            client.setblocking(False)
+            challenge = Challenge(self.next_key, client)
+            self.next_key += 1
+            self.pending[challenge.key] = challenge
+            selector.register(client, selectors.EVENT_READ, challenge)
+
+    def _read(self, selector, challenge):
+        try:
+            data = challenge.sock.recv(1024)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b''
+        # a challenger only sends CONNECT and then waits, anything else means it gave up
+        if not data or challenge.details is not None:
+            self._drop(selector, challenge)
+            return
+        challenge.data += data
+        if not b'CONNECT'.startswith(challenge.data[:7]) or len(challenge.data) > 1024:
+            self._drop(selector, challenge)
+            return
+        if not self._parse(challenge):
+            # the rest is on the way, or it is all there is from a peer from before HANDSHAKE_END
+            challenge.quiet = time.monotonic() + HANDSHAKE_GRACE
+
+    def _parse(self, challenge, quiet=False):
+        """
+        Lists the challenge once it sent a whole CONNECT.
+        :param quiet: True to take what came as all of it, see protocol.split_handshake
+        :return: False if it did not
+        """
+        challenge.quiet = None
+        handshake = protocol.split_handshake(challenge.data, quiet)
+        if handshake is None:
+            return False
+        try:
+            word, details = protocol.parse_fields(handshake[0])
+        except UnicodeDecodeError:
+            return False
+        if word != 'CONNECT' or 'name' not in details:
+            return False
+        challenge.details = details
+        challenge.deadline = time.monotonic() + CHALLENGE_TIMEOUT
+        if self.view:
+            self.view.add(challenge.key, details['name'])
+        return True
+
+    def _answer(self, selector):
+        while True:
+            try:
+                accept, key = self.answers.get_nowait()
+            except Empty:
+                return
+            challenge = self.pending.get(key)
+            if challenge is None or challenge.details is None:
+                continue
+            if not accept:
+                self._drop(selector, challenge)
+                continue
+            selector.unregister(challenge.sock)
+            del self.pending[key]
+            details = challenge.details
+            version = protocol.choose_version(details)
+            # peers from before the handshake only know the classic game
+            settings = self.master.settings if version != protocol.LEGACY else protocol.CLASSIC
+            client = challenge.sock
+            # LEGACY peers can not resume a game
+            token = uuid.uuid4().hex if version != protocol.LEGACY else None
+            try:
+                client.setblocking(True)
+                client.sendall(protocol.grant(version, settings, session=token))
+            except OSError:
                 client.close()
+                if self.view:
+                    self.view.remove(key)
+                continue
+            self.details = details
+            self.client = client
+            self.running = False
+            # the game is set up on the Tk thread
+            self.master.calls.put((self.callback, (client, details['name'], version, settings, token)))
+            return
+
+    def _drop(self, selector, challenge):
+        """Closes a challenge that was declined, timed out or given up, which declines it on the other side."""
+        selector.unregister(challenge.sock)
+        challenge.sock.close()
+        del self.pending[challenge.key]
+        if challenge.details is not None and self.view:
+            self.view.remove(challenge.key)
+
+    # called from the Tk thread
+    def accept(self, key):
+        self._post(True, key)
+
+    def decline(self, key):
+        self._post(False, key)
+
+    def _post(self, accept, key):
+        self.answers.put((accept, key))
+        try:
+            self._wake_write.send(b'\0')
         except OSError:
+            # the server already stopped
             pass
 
     def __init__(self, master, callback):
@@ -273,31 +509,25 @@ class Server(threading.Thread):
                 binding = False
             except OSError:
                 pass
+        self.sock.listen(LISTEN_BACKLOG)
         self.client = None
         self.details = None
+        # key -> Challenge, for every connection that was not answered yet
+        self.pending = {}
+        self.next_key = 0
+        # (accept, key) from the Tk thread
+        self.answers = Queue()
+        # where the challenges are listed, a lobby.ChallengeListView
+        self.view = None
+        self._wake_read, self._wake_write = socket.socketpair()
         super().__init__()
 
     def stop(self):
         if self.is_alive():
             self.running = False
-            self.sock.close()
+            self._wake_write.send(b'\0')
             self.join()
 
-    class ConfirmConnection(Dialog.Dialog):
-        def validate(self):
-            return True
-
-        def __init__(self, master, player):
-            self.connect = False
-            self.player = player
-            super().__init__(master, 'Connect?')
-
-        def apply(self):
-            self.connect = True
-
-        def body(self, master):
-            tk.Label(master, text='Do you want to accept connection to %s?' % self.player['name']).pack(padx=5, pady=5)
-
 
 class WhoStartsDialog(Dialog.Dialog):
     def __init__(self, master):
@@ -310,23 +540,22 @@ class WhoStartsDialog(Dialog.Dialog):
         self.choice_opponent = None
         self.choice_self = None
         self.decision = None
-        self.approved = False
         self.waiting = False
         self.options = [master.name, master.opponent]
-        super().__init__(master, WHO_STARTS_TITLE, block=True)
+        super().__init__(master, WHO_STARTS_TITLE, block=False)
 
     def apply(self):
         self.decision = self.choice_self
-        self.master.queue.put(None)
         super().cancel()
+        self.master.begin(self.decision)
 
     def ok(self, event=None):
-        if not self.validate():
+        if self.waiting or not self.validate():
             self.initial_focus.focus_set()
             return
-        self.withdraw()
-        self.update_idletasks()
-        self.apply()
+        # the dialog closes once the opponent approves, see process
+        self.sock.send('APPLY', self.choice_self)
+        self.waiting = True
 
     def body(self, master):
         tk.Label(master, text='Who should start first?').grid(row=0, column=0, columnspan=2)
@@ -336,71 +565,106 @@ class WhoStartsDialog(Dialog.Dialog):
         self.label_self.grid(row=2, column=0, columnspan=2)
         tk.Button(master, text=self.name, command=lambda: self.sendto(self.name)).grid(row=3, column=0)
         tk.Button(master, text=self.opponent, command=lambda: self.sendto(self.opponent)).grid(row=3, column=1)
-        threading.Thread(target=self.process_data).start()
 
     def validate(self):
-        if self.choice_self and self.choice_self == self.choice_opponent:
-            self.sock.sendall(('APPLY\n%s' % self.choice_self).encode())
-            self.waiting = True
-            while self.waiting:
-                time.sleep(.2)
-            return self.approved
-        return False
+        return self.choice_self and self.choice_self == self.choice_opponent
 
     def cancel(self, event=None, focus=True):
         super().cancel(event, focus)
         self.master.after(0, self.master.destroy)
 
-    def process_data(self):
-        while True:
-            lines = self.master.queue.get()
-            if not lines:
-                return
-            if len(lines) != 2:
-                raise Exception('Bad Protocol!')
-            if lines[0] == 'CHOOSE':
-                if lines[1] not in self.options:
-                    raise Exception('User opponent chose is not an option!')
-                self.label_opponent['text'] = '%s has chose %s to start first.' % (self.opponent, lines[1])
-                self.choice_opponent = lines[1]
-            elif lines[0] == 'APPLY':
-                if lines[1] == 'APPROVED':
-                    self.approved = True
-                    self.waiting = False
-                elif lines[1] == 'DENIED':
-                    self.approved = False
-                    self.waiting = False
-                elif lines[1] == self.choice_self:
-                    self.sock.sendall('APPLY\nAPPROVED'.encode())
-                    threading.Thread(target=self.apply).start()
-                elif lines[1] in self.options:
-                    self.sock.sendall('APPLY\nDENIED'.encode())
-                else:
-                    raise Exception('Incorrect parameter supplied to APPLY')
+    def process(self, lines):
+        """Handles a CHOOSE or APPLY message from the opponent. Runs on the Tk thread."""
+        if len(lines) != 2:
+            raise Exception('Bad Protocol!')
+        if lines[0] == 'CHOOSE':
+            if lines[1] not in self.options:
+                raise Exception('User opponent chose is not an option!')
+            self.master.renderer.configure(self.label_opponent,
+                                           text='%s has chose %s to start first.' % (self.opponent, lines[1]))
+            self.choice_opponent = lines[1]
+        elif lines[0] == 'APPLY':
+            if lines[1] == 'APPROVED':
+                if self.waiting:
+                    self.apply()
+            elif lines[1] == 'DENIED':
+                self.waiting = False
+            elif lines[1] == self.choice_self:
+                self.sock.send('APPLY', 'APPROVED')
+                self.apply()
+            elif lines[1] in self.options:
+                self.sock.send('APPLY', 'DENIED')
             else:
-                raise Exception('Data did not start with "CHOOSE"!\n%s' % lines)
+                raise Exception('Incorrect parameter supplied to APPLY')
+        else:
+            raise Exception('Data did not start with "CHOOSE"!\n%s' % lines)
 
     def sendto(self, player):
-        self.sock.sendall(('CHOOSE\n%s' % player).encode())
-        self.label_self['text'] = 'You have chose %s to start first.' % player
+        if self.waiting:
+            return
+        self.sock.send('CHOOSE', player)
+        self.master.renderer.configure(self.label_self, text='You have chose %s to start first.' % player)
         self.choice_self = player
 
 
 class GUI(tk.Tk):
-    def __init__(self):
+    def __init__(self, width=BOARD_WIDTH, height=BOARD_HEIGHT, fleet=FLEET, salvo=False, toss=True,
+                 spectate_port=None, replay_path=None):
+        """
+        width, height and fleet are the game this player hosts, a player that connects gets the same.
+        In a salvo game every turn fires one shot per ship still afloat. Who starts is tossed for,
+        or agreed on in WhoStartsDialog without toss. With spectate_port the games are published
+        there for spectators, see spectate, and with replay_path they are recorded there, see replay.
+        """
         super().__init__(None, None, 'Tk', 1, 0, None)
         self.title(BATTLE_SHIP_TITLE)
         self.sock = None
         self.opponent = None
         self.player = None
-        self.grids = None
+        self.settings = (width, height, tuple(fleet), salvo, toss)
+        self.view_mine = None
+        self.view_opponent = None
+        # the canvas windows holding the views when they are BoardViews
+        self.windows = []
         self.thread_listen = None
-        self.turn_yours = False
+        self.reconnect = None
+        # where the opponent listens, for reconnecting
+        self.peer_address = None
+        self.turn_before = None
+        self.computer = False
+        self.state = PLACING
         self.turn_text = None
         self.sunk = 0
         self.opponent_sunk = 0
         self.queue = Queue()
-        self.my_queue = Queue()
+        # (function, args) from the other threads, which must not touch Tk, for poll to call
+        self.calls = Queue()
+        # messages that arrived before the game was ready for them
+        self.inbox = deque()
+        self.starts_dialog = None
+        # the coin toss for who starts, see protocol.CoinToss
+        self.toss = None
+        self.place_index = 0
+        self.place_first = None
+        self.place_valid = []
+        self.rematch_mine = False
+        self.rematch_theirs = False
+        self.shot_at = None
+        # the cells picked for the salvo being aimed, or fired and waiting for RESULTS
+        self.aimed = []
+        self.shot_sent = 0
+        # seconds between sending SHOOT and getting SHOT back, for every shot
+        self.round_trips = []
+        # told about every game: a spectate.Publisher and a replay.Recorder
+        self.observers = []
+        if spectate_port:
+            self.observers.append(spectate.Publisher(spectate_port))
+        if replay_path:
+            try:
+                self.observers.append(replay.Recorder(replay_path))
+            except (OSError, ValueError) as e:
+                # the game goes on without recording, and the file is left as it is
+                print('Can not record the games: %s' % e, file=sys.stderr)
         self.background = ImageTk.PhotoImage(Image.open(resource_path('images/background.png')))
         self.canvas = tk.Canvas(self, width=592, height=783, bd=0, highlightthickness=0)
         self.canvas.pack()
@@ -408,33 +672,20 @@ class GUI(tk.Tk):
         self.resizable(False, False)
         self.font = tk.font.Font(weight='bold')
         self.sunk_text = self.canvas.create_text(SUNK_POS, text='SUNK: 0', fill='white', font=self.font)
-        self.player = Player()
+        self.renderer = render.Renderer(self.canvas)
         canvas = self.canvas
-        xx, yy = OPPONENT_START
-        self.player.grid_opponent = [[canvas.create_circle(xx + SPACE * (x + 1),
-                                                           yy + SPACE * (y + 1), 3, fill='black')
-                                      for y in range(BOARD_HEIGHT)]
-                                     for x in range(BOARD_WIDTH)]
-        xx, yy = PLAYER_START
-        self.player.grid_mine = [[canvas.create_circle(xx + SPACE * (x + 1),
-                                                       yy + SPACE * (y + 1), 3, fill='white', outline='white')
-                                  for y in range(BOARD_HEIGHT)]
-                                 for x in range(BOARD_WIDTH)]
-        for pos, grid, color in zip((OPPONENT_START, PLAYER_START),
-                                    (self.player.grid_opponent, self.player.grid_mine),
-                                    ('black', 'white')):
-            x, y = pos
-            for i in range(1, BOARD_WIDTH + 1):
-                canvas.create_text(x + SPACE * i, y, text=str(i), fill=color, font=self.font)
-            for i, l in zip(range(1, BOARD_HEIGHT + 1), 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'):
-                canvas.create_text(x, y + SPACE * i, text=l, fill=color, font=self.font)
-
-            for i in range(0, BOARD_WIDTH):
-                canvas.create_line(x + SPACE / 2 + SPACE * i, y - SPACE / 2,
-                                   x + SPACE / 2 + SPACE * i, y + SPACE * BOARD_HEIGHT + SPACE / 2, fill=color)
-            for i in range(0, BOARD_HEIGHT):
-                canvas.create_line(x - SPACE / 2, y + SPACE / 2 + SPACE * i,
-                                   x + SPACE / 2 + SPACE * BOARD_WIDTH, y + SPACE / 2 + SPACE * i, fill=color)
+        x, y, x1, y1 = RECTANGLE_POS
+        self.place_rectangle = canvas.create_rectangle(x, y, x1, y1, fill='black', state='hidden')
+        self.place_text = canvas.create_text((x1 - x) / 2 + x, (y1 - y) / 4 + y, font=self.font, fill='white',
+                                             state='hidden')
+        self.auto_button = tk.Button(self, text=AUTO_PLACE_TEXT, command=self.auto_place)
+        self.auto_window = canvas.create_window((x + x1) / 2, y + (y1 - y) * 3 / 4, window=self.auto_button,
+                                                state='hidden')
+        self.opponent_text = canvas.create_text(OPPONENT_NAME, font=self.font, fill='white')
+        self.turn_text = canvas.create_text(TURN_TEXT, font=self.font)
+        self.rematch_button = tk.Button(self, text=REMATCH_TEXT, command=self.ask_rematch)
+        self.rematch_window = canvas.create_window(REMATCH_POS, window=self.rematch_button, state='hidden')
+        self.setup(*self.settings)
 
         self.name, self.uuid = self.get_name()
         if not self.name:
@@ -448,68 +699,246 @@ class GUI(tk.Tk):
         self.server.start()
         self.broad.start()
         self.client.start()
+        for observer in list(self.observers):
+            try:
+                observer.start()
+            except OSError as e:
+                # the game goes on without spectators
+                print('Can not serve spectators: %s' % e, file=sys.stderr)
+                self.observers.remove(observer)
+        self.poll()
         self.mainloop()
-        self.my_queue.put(None)
         self.server.stop()
         self.broad.stop()
         self.client.stop()
+        if self.reconnect:
+            self.reconnect.stop()
         if self.thread_listen:
             self.thread_listen.stop()
+        for observer in self.observers:
+            observer.stop()
 
-    def click_canvas(self, event):
-        if self.turn_yours:
-            dots = self.canvas.find_closest(event.x, event.y)
-            pos = None
-            for dot in dots:
-                for column in self.player.grid_opponent:
-                    if dot in column:
-                        pos = (self.player.grid_opponent.index(column), column.index(dot))
-                        break
-                if pos:
-                    break
-            if not pos:
-                return
-            hole = self.player.opponent[pos[0]][pos[1]]
-            if hole.hit:
-                return
-            hole.hit = True
-            self.sock.sendall(('SHOOT\n%i\n%i' % (pos[0], pos[1])).encode())
-            data = self.queue.get()
-            if len(data) != 2:
-                raise Exception('Bad Protocol!')
-            if data[0] != 'SHOT':
+    def poll(self):
+        """
+        Takes the messages from the opponent off the queue and handles them, and makes the calls the
+        other threads asked for, on the Tk thread.
+        """
+        while True:
+            try:
+                function, args = self.calls.get_nowait()
+            except Empty:
+                break
+            function(*args)
+        while True:
+            try:
+                data = self.queue.get_nowait()
+            except Empty:
+                break
+            if data:
+                self.inbox.append(data)
+        try:
+            while self.inbox and self.handle(self.inbox[0]):
+                self.inbox.popleft()
+        except Exception as e:
+            # handle raises Exception('Bad Protocol!') for a message the game can not go on after
+            self.broken(e)
+        self.after(POLL_INTERVAL, self.poll)
+
+    def handle(self, data):
+        """
+        Passes a message from the opponent on to whatever is waiting for it.
+        :return: False if the message has to wait until the game gets further along
+        """
+        if data[0] in ('COMMIT', 'REVEAL'):
+            # the next game's toss waits until both players asked for the rematch
+            if self.state == OVER or self.toss is None:
+                return False
+            try:
+                if data[0] == 'COMMIT':
+                    self.toss.commit(data[1])
+                else:
+                    self.toss.reveal(data[1])
+            except ValueError:
                 raise Exception('Bad Protocol!')
-            if data[1] not in ('SUNK', 'HIT', 'MISS'):
+            if self.state == CHOOSING:
+                self.reveal()
+            return True
+        if data[0] in ('CHOOSE', 'APPLY'):
+            if self.state == PLACING:
+                return False
+            if self.state == CHOOSING:
+                self.starts_dialog.process(data)
+            # else an answer that crossed our own APPLY after the dialog closed
+            return True
+        if data[0] in ('SHOT', 'RESULTS'):
+            if self.state != WAITING:
                 raise Exception('Bad Protocol!')
-            x, y = hole.coords
-            if data[1] == 'MISS':
-                self.canvas.create_circle(x, y, 8, fill='white')
+            if data[0] == 'SHOT':
+                self.shot(data)
             else:
-                self.canvas.create_circle(x, y, 8, fill='red')
-                if data[1] == 'SUNK':
-                    self.sunk += 1
-                    self.canvas.itemconfig(self.sunk_text, text='Sunk: %i' % self.sunk)
-                    Dialog.Dialog(self, title='Sunk!', text='You sunk a ship!')
-                    if self.sunk == 5:
-                        Dialog.Dialog(self, title='Winner!', text='You won!')
-                        self.turn_yours = False
-                        self.canvas.itemconfig(self.turn_text, text='Winner!', fill='gold')
-                        return
-            self.turn_yours = False
-            self.canvas.itemconfig(self.turn_text, text=TURN_MESSAGE[False], fill=TURN_COLOR[False])
-            threading.Thread(target=self.opponent_turn).start()
+                self.salvo_results(data)
+            return True
+        if data[0] in ('SHOOT', 'SALVO'):
+            if self.state != THEIR_TURN:
+                return False
+            if data[0] == 'SHOOT':
+                self.opponent_turn(data)
+            else:
+                self.opponent_salvo(data)
+            return True
+        if data[0] == 'REMATCH':
+            if self.state != OVER:
+                return False
+            self.rematch_theirs = True
+            if self.rematch_mine:
+                self.new_game()
+            else:
+                self.renderer.configure(self.rematch_button, text='%s wants a rematch!' % self.opponent)
+            return True
+        raise Exception('Bad Protocol!')
+
+    def setup(self, width, height, fleet, salvo=False, toss=True):
+        """
+        Makes the player and the two boards for a game of the given size. The classic size is drawn
+        on the background image, anything else gets scrollable BoardViews.
+        """
+        self.settings = (width, height, tuple(fleet), salvo, toss)
+        self.player = Player(width, height, fleet)
+        for view in (self.view_mine, self.view_opponent):
+            if view:
+                view.destroy()
+        for window in self.windows:
+            self.canvas.delete(window)
+        self.windows = []
+        if (width, height) == (BOARD_WIDTH, BOARD_HEIGHT):
+            self.view_opponent = boardview.GridView(self.canvas, self.renderer, OPPONENT_START, width, height, fleet,
+                                                    'black', self.font, self.click_opponent)
+            self.view_mine = boardview.GridView(self.canvas, self.renderer, PLAYER_START, width, height, fleet,
+                                                'white', self.font, self.click_mine)
+            return
+        size = SPACE * (BOARD_WIDTH + 1)
+        self.view_opponent = boardview.BoardView(self, width, height, size, self.click_opponent)
+        self.view_mine = boardview.BoardView(self, width, height, size, self.click_mine)
+        for start, view in ((OPPONENT_START, self.view_opponent), (PLAYER_START, self.view_mine)):
+            self.windows.append(self.canvas.create_window(start[0] - SPACE / 2, start[1] - SPACE / 2,
+                                                          window=view, anchor='nw'))
+
+    def click_opponent(self, x, y):
+        if self.state != YOUR_TURN:
+            return
+        if self.settings[3]:
+            self.aim(x, y)
+            return
+        if not self.player.target.fire(x, y):
+            return
+        self.shot_at = (x, y)
+        self.shot_sent = time.perf_counter()
+        self.state = WAITING
+        self.sock.send('SHOOT', x, y)
+
+    def shot(self, data):
+        """The opponent answered our SHOOT."""
+        self.round_trips.append(time.perf_counter() - self.shot_sent)
+        if len(data) != 2:
+            raise Exception('Bad Protocol!')
+        if data[1] not in ('SUNK', 'HIT', 'MISS'):
+            raise Exception('Bad Protocol!')
+        pos = self.shot_at
+        self.player.target.record(pos[0], pos[1], engine.RESULT_CODES[data[1]])
+        for observer in self.observers:
+            observer.shots(0, [pos], [engine.RESULT_CODES[data[1]]])
+        if data[1] == 'MISS':
+            self.view_opponent.mark(pos[0], pos[1], boardview.MISS)
+        else:
+            self.view_opponent.mark(pos[0], pos[1], boardview.HIT)
+            if data[1] == 'SUNK':
+                self.sunk += 1
+                self.renderer.itemconfig(self.sunk_text, text='Sunk: %i' % self.sunk)
+                if self.player.target.won:
+                    self.game_over()
+                    self.renderer.itemconfig(self.turn_text, text='Winner!', fill='gold')
+                    Dialog.Dialog(self, title='Winner!', text='You won!', block=False)
+                    return
+                Dialog.Dialog(self, title='Sunk!', text='You sunk a ship!', block=False)
+        self.state = THEIR_TURN
+        self.renderer.itemconfig(self.turn_text, text=TURN_MESSAGE[False], fill=TURN_COLOR[False])
+
+    def salvo_size(self, afloat, shot):
+        """:return: how many shots a player with afloat ships fires, never more than the shot cells leave"""
+        width, height = self.settings[:2]
+        return min(afloat, width * height - shot)
+
+    def aim(self, x, y):
+        """Salvo game: a click picks a cell or drops it again, the salvo is fired once there is one per ship afloat."""
+        target = self.player.target
+        if target.is_hit(x, y):
+            return
+        if (x, y) in self.aimed:
+            self.aimed.remove((x, y))
+            self.view_opponent.highlight([(x, y)], False)
+            return
+        self.aimed.append((x, y))
+        self.view_opponent.highlight([(x, y)])
+        if len(self.aimed) < self.salvo_size(len(self.player.board.fleet) - self.opponent_sunk, target.count):
+            return
+        for cell in self.aimed:
+            target.fire(*cell)
+        self.view_opponent.highlight(self.aimed, False)
+        self.shot_sent = time.perf_counter()
+        self.state = WAITING
+        self.sock.send('SALVO', *[coordinate for cell in self.aimed for coordinate in cell])
+
+    def salvo_results(self, data):
+        """The opponent answered our SALVO, with a result for every shot in the same order."""
+        self.round_trips.append(time.perf_counter() - self.shot_sent)
+        aimed = self.aimed
+        self.aimed = []
+        if len(data) != len(aimed) + 1 or any(result not in engine.RESULT_CODES for result in data[1:]):
+            raise Exception('Bad Protocol!')
+        target = self.player.target
+        for (x, y), result in zip(aimed, data[1:]):
+            target.record(x, y, engine.RESULT_CODES[result])
+            self.view_opponent.mark(x, y, boardview.MISS if result == 'MISS' else boardview.HIT)
+        for observer in self.observers:
+            observer.shots(0, aimed, [engine.RESULT_CODES[result] for result in data[1:]])
+        sunk = data.count('SUNK')
+        if sunk:
+            self.sunk += sunk
+            self.renderer.itemconfig(self.sunk_text, text='Sunk: %i' % self.sunk)
+            if target.won:
+                self.game_over()
+                self.renderer.itemconfig(self.turn_text, text='Winner!', fill='gold')
+                Dialog.Dialog(self, title='Winner!', text='You won!', block=False)
+                return
+            Dialog.Dialog(self, title='Sunk!', text='You sunk a ship!' if sunk == 1 else 'You sunk %i ships!' % sunk,
+                          block=False)
+        self.state = THEIR_TURN
+        self.renderer.itemconfig(self.turn_text, text=TURN_MESSAGE[False], fill=TURN_COLOR[False])
 
-    def callback(self, sock, name):
+    def callback(self, sock, name, version=protocol.LEGACY, settings=None, token=None, address=None, data=b''):
         """
         Method that gets called when a player actually connects
-        :param sock: socket for communication to opponent
+        :param sock: socket for communication to opponent, or an ai.ComputerOpponent
         :param name: The name of the player which connected.
+        :param version: The protocol version agreed on in the handshake.
+        :param settings: (width, height, fleet, salvo, toss) of the game agreed on in the handshake, None for our own
+        :param token: session token from the handshake, None if the game can not be resumed
+        :param address: where to reconnect to if the connection drops, None if we accepted the challenge
+        :param data: what the opponent sent right behind the handshake
         :return: None
         """
-        self.sock = sock
         self.opponent = name
-        self.thread_listen = ListenThread(self, self.sock)
-        self.thread_listen.start()
+        self.computer = isinstance(sock, ai.ComputerOpponent)
+        if self.computer:
+            self.sock = sock
+        elif token:
+            self.sock = session.Session(protocol.Channel(sock, version, data), token)
+        else:
+            self.sock = protocol.Channel(sock, version, data)
+        self.peer_address = address
+        if not self.computer:
+            self.thread_listen = ListenThread(self, self.sock)
+            self.thread_listen.start()
 
         def stop():
             self.server.stop()
@@ -517,134 +946,258 @@ class GUI(tk.Tk):
             self.broad.stop()
 
         self.after(0, stop)
+        if settings and tuple(settings) != self.settings:
+            self.after(0, lambda: self.setup(*settings))
+        self.renderer.itemconfig(self.opponent_text, text=name)
+        self.after(0, self.start_placing)
+
+    def start_placing(self):
+        # canvas windows are always drawn on top, so the opponent's BoardView is hidden while placing
+        for window in self.windows[:1]:
+            self.renderer.itemconfig(window, state='hidden')
+        self.canvas.tag_raise(self.place_rectangle)
+        self.canvas.tag_raise(self.place_text)
+        self.renderer.itemconfig(self.place_rectangle, state='normal')
+        self.renderer.itemconfig(self.place_text, state='normal')
+        self.renderer.itemconfig(self.auto_window, state='normal')
+        self.state = PLACING
+        self.place_index = 0
+        self.place_first = None
+        self.renderer.itemconfig(self.place_text, text='Click the first dot for the %i long ship!' %
+                                                       self.player.ships[0].length)
+        # committing now leaves only the reveal for when both players are done placing
+        if self.settings[4]:
+            self.toss = protocol.CoinToss()
+            self.sock.send('COMMIT', self.toss.commitment)
+
+    def click_mine(self, x, y):
+        """Placing the ships: the first click picks one end of a ship, the second one the other end."""
+        if self.state != PLACING:
+            return
+        renderer = self.renderer
+        ship = self.player.ships[self.place_index]
+        board = self.player.board
+        if self.place_first is None:
+            length = ship.length - 1
+            self.place_valid = []
+            for end in ((x - length, y), (x + length, y), (x, y - length), (x, y + length)):
+                if 0 <= end[0] < board.width and 0 <= end[1] < board.height:
+                    if board.can_place(ship.index, board.cells((x, y), end)):
+                        self.place_valid.append(end)
+            self.view_mine.highlight(self.place_valid)
+            self.place_first = (x, y)
+            renderer.itemconfig(self.place_text, text='Click the second dot for the ship!\n'
+                                                      'Only the red dots are valid.')
+            return
+        if (x, y) not in self.place_valid:
+            return
+        self.view_mine.highlight(self.place_valid, False)
+        self.player.place_ship(ship, (self.place_first, (x, y)))
+        self.view_mine.show_ship(ship.index, ship.cells)
+        self.place_first = None
+        self.place_index += 1
+        if self.place_index < len(self.player.ships):
+            renderer.itemconfig(self.place_text, text='Click the first dot for the %i long ship!' %
+                                                      self.player.ships[self.place_index].length)
+            return
+        self.done_placing()
 
-        def later():
-            canvas = self.canvas
-            canvas.create_text(OPPONENT_NAME, text=self.opponent, font=self.font, fill='white')
-
-            x, y, x1, y1 = RECTANGLE_POS
-            rectangle = canvas.create_rectangle(x, y, x1, y1, fill='black')
-            text = canvas.create_text((x1 - x) / 2 + x, (y1 - y) / 4 + y, font=self.font, fill='white')
-
-            def click(event):
-                dots = canvas.find_closest(event.x, event.y)
-                pos = None
-                for dot in dots:
-                    for row in self.player.grid_mine:
-                        if dot in row:
-                            pos = (self.player.grid_mine.index(row), row.index(dot))
-                            break
-                    if pos:
-                        break
-                if not pos:
-                    return
-                self.my_queue.put(pos)
-
-            for row in self.player.grid_mine:
-                for dot in row:
-                    canvas.tag_bind(dot, '<1>', click)
-
-            for ship in self.player.ships:
-                canvas.itemconfig(text, text='Click the first dot for the %i long ship!' % ship.length)
-                data = self.my_queue.get()
-                if not data:
+    def auto_place(self):
+        """Places the rest of the fleet at random."""
+        if self.state != PLACING:
+            return
+        if self.place_first is not None:
+            self.view_mine.highlight(self.place_valid, False)
+            self.place_first = None
+        self.player.place_random()
+        for ship in self.player.ships[self.place_index:]:
+            self.view_mine.show_ship(ship.index, ship.cells)
+        self.done_placing()
+
+    def done_placing(self):
+        renderer = self.renderer
+        renderer.itemconfig(self.place_text, state='hidden')
+        renderer.itemconfig(self.place_rectangle, state='hidden')
+        renderer.itemconfig(self.auto_window, state='hidden')
+        for window in self.windows[:1]:
+            renderer.itemconfig(window, state='normal')
+        self.start()
+
+    def opponent_turn(self, data):
+        """The opponent fired at us."""
+        if len(data) != 3:
+            raise Exception('Bad Protocol!')
+        try:
+            x = int(data[1])
+            y = int(data[2])
+            result = self.player.board.shoot(x, y)
+        except (ValueError, IndexError):
+            raise Exception('Protocol Error!')
+        for observer in self.observers:
+            observer.shots(1, [(x, y)], [result])
+        if result != engine.MISS:
+            if result == engine.SUNK:
+                self.sock.send('SHOT', 'SUNK')
+                self.opponent_sunk += 1
+                if self.player.board.lost:
+                    self.view_mine.mark(x, y, boardview.HIT)
+                    self.game_over()
+                    self.renderer.itemconfig(self.turn_text, text='Looser!', fill='silver')
+                    Dialog.Dialog(self, title='Lost!', text='You lost!', block=False)
                     return
-                x1, y1 = data
-                canvas.itemconfig(text, text='Click the second dot for the ship!\n'
-                                             'Only the red dots are valid.')
-                mine = self.player.mine
-                length = ship.length - 1
-                valid_dots = []
-                dots = []
-                for x, y in ((x1 - length, y1), (x1 + length, y1), (x1, y1 - length), (x1, y1 + length)):
-                    if 0 <= x < BOARD_WIDTH and 0 <= y < BOARD_HEIGHT:
-                        hole = mine[x][y]
-                        dot = self.player.grid_mine[x][y]
-                        if not hole.hold_ship:
-                            valid_dots.append(dot)
-                            canvas.itemconfig(self.player.grid_mine[x][y], fill='red')
-                while True:
-                    data = self.my_queue.get()
-                    if not data:
-                        return
-                    x2, y2 = data
-                    dot = self.player.grid_mine[x2][y2]
-                    if dot in valid_dots:
-                        break
-                for dot in valid_dots:
-                    canvas.itemconfig(dot, fill='white')
-                self.player.place_ship(ship, ((x1, y1), (x2, y2)))
-                x1, y1 = ship.pegs[0].hole.coords
-                x2, y2 = ship.pegs[-1].hole.coords
-                canvas.create_oval(x1 - SPACE / 3, y1 - SPACE / 3,
-                                   x2 + SPACE / 3, y2 + SPACE / 3, fill='grey', outline='grey')
-                for peg in ship.pegs:
-                    x, y = peg.hole.coords
-                    canvas.create_circle(x, y, 3, fill='black')
-
-            for row in self.player.grid_mine:
-                for dot in row:
-                    canvas.tag_unbind(dot, '<1>')
-
-            canvas.delete(text)
-            canvas.delete(rectangle)
-            self.after(0, self.start)
-
-        threading.Thread(target=later).start()
-
-    def opponent_turn(self):
+            else:
+                self.sock.send('SHOT', 'HIT')
+            self.view_mine.mark(x, y, boardview.HIT)
+        else:
+            self.sock.send('SHOT', 'MISS')
+            self.view_mine.mark(x, y, boardview.MISS)
+        self.state = YOUR_TURN
+        self.renderer.itemconfig(self.turn_text, text=TURN_MESSAGE[True], fill=TURN_COLOR[True])
+
+    def opponent_salvo(self, data):
+        """The opponent fired a salvo at us, resolved all at once by engine.Board.shoot_salvo."""
+        board = self.player.board
+        shots = list(zip(data[1::2], data[2::2]))
+        if len(data) % 2 == 0 or \
+                len(shots) != self.salvo_size(len(board.fleet) - self.sunk, bin(board.shots).count('1')):
+            raise Exception('Bad Protocol!')
         try:
-            data = self.queue.get()
-            if not data:
-                return
-            if len(data) != 3:
-                raise Exception('Bad Protocol!')
-            if data[0] != 'SHOOT':
-                raise Exception('Bad Protocol!')
-            try:
-                x = int(data[1])
-                y = int(data[2])
-                hole = self.player.mine[x][y]
-                hole.hit = True
-                gx, gy = hole.coords
-                if hole.hold_ship:
-                    if hole.hold_ship.ship.is_sunk():
-                        self.sock.sendall('SHOT\nSUNK'.encode())
-                        self.opponent_sunk += 1
-                        if self.opponent_sunk == 5:
-                            self.canvas.itemconfig(self.turn_text, text='Looser!', fill='silver')
-                            Dialog.Dialog(self, title='Lost!', text='You lost!')
-                            return
-                    else:
-                        self.sock.sendall('SHOT\nHIT'.encode())
-                    self.canvas.create_circle(gx, gy, 8, fill='red')
-                else:
-                    self.sock.sendall('SHOT\nMISS'.encode())
-                    self.canvas.create_circle(gx, gy, 8, fill='white')
-                self.turn_yours = True
-                self.canvas.itemconfig(self.turn_text, text=TURN_MESSAGE[True], fill=TURN_COLOR[True])
-            except TypeError:
-                raise Exception('Protocol Error!')
-        except ConnectionAbortedError:
+            results = board.shoot_salvo(shots)
+        except ValueError:
+            raise Exception('Protocol Error!')
+        self.sock.send('RESULTS', *[engine.RESULTS[result] for result in results])
+        for observer in self.observers:
+            observer.shots(1, shots, results)
+        for (x, y), result in zip(shots, results):
+            self.view_mine.mark(x, y, boardview.MISS if result == engine.MISS else boardview.HIT)
+        self.opponent_sunk += results.count(engine.SUNK)
+        if board.lost:
+            self.game_over()
+            self.renderer.itemconfig(self.turn_text, text='Looser!', fill='silver')
+            Dialog.Dialog(self, title='Lost!', text='You lost!', block=False)
             return
+        self.state = YOUR_TURN
+        self.renderer.itemconfig(self.turn_text, text=TURN_MESSAGE[True], fill=TURN_COLOR[True])
 
     def start(self):
         """
-        Starts the game!
+        Starts the game! The game begins once the coin toss is done or both players agreed on who
+        goes first, see begin.
         :return: None
         """
-        canvas = self.canvas
-        starts_dialog = WhoStartsDialog(self)
-        if not starts_dialog.decision:
+        self.state = CHOOSING
+        if self.toss:
+            self.reveal()
+        else:
+            self.starts_dialog = WhoStartsDialog(self)
+
+    def reveal(self):
+        """Reveals our side of the coin toss once we have the other's commitment, and begins if that settles it."""
+        toss = self.toss
+        if toss.theirs is not None and not toss.revealed:
+            toss.revealed = True
+            self.sock.send('REVEAL', toss.nonce)
+        if toss.done:
+            self.toss = None
+            self.begin(self.name if toss.we_start() else self.opponent)
+
+    def begin(self, decision):
+        """
+        Both players agreed on who starts.
+        :param decision: name of the player that starts
+        """
+        self.starts_dialog = None
+        turn_yours = decision == self.name
+        board = self.player.board
+        for observer in self.observers:
+            observer.begin((self.name, self.opponent), board.width, board.height, board.fleet, 0 if turn_yours else 1,
+                           [board.ship_cells(index) for index in range(len(board.fleet))])
+        self.renderer.itemconfig(self.turn_text, text=TURN_MESSAGE[turn_yours], fill=TURN_COLOR[turn_yours])
+        if turn_yours:
+            self.state = YOUR_TURN
+        else:
+            self.state = THEIR_TURN
+            if self.computer:
+                self.sock.fire()
+
+    def broken(self, error):
+        """The opponent broke the protocol: closes the connection and tells the player."""
+        self.inbox.clear()
+        self.state = OVER
+        if self.thread_listen:
+            self.thread_listen.stop()
+            self.thread_listen = None
+        self.renderer.itemconfig(self.turn_text, text=BROKEN_TEXT, fill='red')
+        Dialog.Dialog(self, title='Error', block=False,
+                      text='%s broke the protocol (%s), the game is over.' % (self.opponent, error))
+
+    def game_over(self):
+        self.state = OVER
+        board = self.player.board
+        for observer in self.observers:
+            observer.over(0 if self.player.target.won else 1,
+                          [board.ship_cells(index) for index in range(len(board.fleet))])
+        # peers from before the handshake do not know REMATCH
+        if self.computer or self.sock.version != protocol.LEGACY:
+            self.renderer.configure(self.rematch_button, text=REMATCH_TEXT, state='normal')
+            self.renderer.itemconfig(self.rematch_window, state='normal')
+
+    def ask_rematch(self):
+        if self.state != OVER or self.rematch_mine:
+            return
+        self.rematch_mine = True
+        self.sock.send('REMATCH')
+        if self.rematch_theirs:
+            self.new_game()
+        else:
+            self.renderer.configure(self.rematch_button, text='Waiting for %s...' % self.opponent, state='disabled')
+
+    def new_game(self):
+        """Both players want a rematch: clears the board in place and starts placing the ships again."""
+        self.rematch_mine = self.rematch_theirs = False
+        self.player.reset()
+        self.sunk = 0
+        self.opponent_sunk = 0
+        self.shot_at = None
+        self.aimed = []
+        renderer = self.renderer
+        renderer.itemconfig(self.rematch_window, state='hidden')
+        self.view_mine.clear()
+        self.view_opponent.clear()
+        renderer.itemconfig(self.sunk_text, text='Sunk: 0')
+        renderer.itemconfig(self.turn_text, text='')
+        self.start_placing()
+
+    def lost(self):
+        """The connection of a resumable game dropped: tries to get it back, see session.Reconnect."""
+        self.thread_listen = None
+        self.sock.lost()
+        self.renderer.flush()
+        self.turn_before = (self.canvas.itemcget(self.turn_text, 'text'), self.canvas.itemcget(self.turn_text, 'fill'))
+        self.renderer.itemconfig(self.turn_text, text=RECONNECTING_TEXT, fill='orange')
+        self.reconnect = session.Reconnect(self.sock, self.peer_address, self.server.port,
+                                           lambda ok: self.calls.put((self.resumed, (ok,))))
+        self.reconnect.start()
+
+    def resumed(self, ok):
+        """Called when session.Reconnect is done, on the Tk thread."""
+        if not ok:
+            self.after(0, self.destroy)
             return
-        self.turn_yours = starts_dialog.decision == self.name
-        self.turn_text = canvas.create_text(TURN_TEXT, text=TURN_MESSAGE[self.turn_yours], font=self.font,
-                                            fill=TURN_COLOR[self.turn_yours])
-        for row in self.player.grid_opponent:
-            for dot in row:
-                canvas.tag_bind(dot, '<1>', self.click_canvas)
-        if not self.turn_yours:
-            threading.Thread(target=self.opponent_turn).start()
+        text, fill = self.turn_before
+        self.renderer.itemconfig(self.turn_text, text=text, fill=fill)
+        self.thread_listen = ListenThread(self, self.sock)
+        self.thread_listen.start()
+
+    def round_trip_stats(self):
+        """:return: dict with the count, mean, median and worst SHOOT -> SHOT round trip in milliseconds"""
+        if not self.round_trips:
+            return {'count': 0}
+        times = sorted(self.round_trips)
+        return {'count': len(times),
+                'mean': 1000 * sum(times) / len(times),
+                'median': 1000 * times[len(times) // 2],
+                'max': 1000 * times[-1]}
 
     def get_name(self):
         class Dialog1(Dialog.Dialog):
@@ -672,27 +1225,50 @@ class GUI(tk.Tk):
 
 
 class ListenThread(threading.Thread):
-    def __init__(self, master, sock: socket.socket):
+    def __init__(self, master, sock):
+        """:param sock: protocol.Channel or session.Session"""
         self.running = False
         self.master = master
         self.queue = master.queue
         self.sock = sock
-        sock.setblocking(False)
+        sock.sock.setblocking(False)
+        self._wake_read, self._wake_write = socket.socketpair()
         super().__init__()
 
     def run(self):
         self.running = True
-        while self.running:
-            try:
-                data = self.sock.recv(512).decode().splitlines()
-                if len(data) == 1 and data[0] == 'CLOSED':
-                    self.stop(True)
-                    break
-                self.queue.put(data)
-            except OSError as e:
-                if '10035' not in repr(e):
+        selector = selectors.DefaultSelector()
+        selector.register(self.sock, selectors.EVENT_READ)
+        selector.register(self._wake_read, selectors.EVENT_READ)
+        try:
+            # what came with the handshake is read already, the selector would not see it
+            messages = self.sock.pending()
+            while self.running:
+                for data in messages:
+                    if data[0] == 'CLOSED':
+                        self.stop(True)
+                        return
+                    self.queue.put(data)
+                messages = []
+                for key, _ in selector.select():
+                    if key.fileobj is self.sock:
+                        messages.extend(self.sock.receive())
+        except OSError:
+            # the socket broke or stop() closed it
+            if self.running:
+                if isinstance(self.sock, session.Session):
+                    self.running = False
+                    self.master.calls.put((self.master.lost, ()))
+                else:
                     self.stop(True)
-                    raise Exception('Error!')
+        except ValueError:
+            # the other side broke the protocol
+            if self.running:
+                self.stop(True)
+        finally:
+            selector.close()
+            self._wake_read.close()
+            self._wake_write.close()
         self.running = False
 
     def stop(self, from_self=False):
@@ -700,11 +1276,38 @@ class ListenThread(threading.Thread):
             self.running = False
             self.queue.put(None)
             if not from_self:
-                self.sock.sendall('CLOSED'.encode())
+                try:
+                    self._wake_write.send(b'\0')
+                    self.sock.send('CLOSED')
+                except OSError:
+                    pass
             self.sock.close()
             if from_self:
-                self.master.after(0, self.master.destroy)
+                self.master.calls.put((self.master.after, (0, self.master.destroy)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Play battleship against other players on the network.')
+    parser.add_argument('--board', default='%ix%i' % (BOARD_WIDTH, BOARD_HEIGHT),
+                        help='size of the board when hosting, up to %ix%i' % (MAX_BOARD_SIZE, MAX_BOARD_SIZE))
+    parser.add_argument('--fleet', default=','.join(str(length) for length in FLEET),
+                        help='lengths of the ships when hosting, like 2,3,3,4,5')
+    parser.add_argument('--salvo', action='store_true',
+                        help='when hosting, fire one shot per ship still afloat every turn')
+    parser.add_argument('--ask-who-starts', action='store_true',
+                        help='when hosting, have both players agree on who starts instead of tossing a coin')
+    parser.add_argument('--spectate', type=int, metavar='PORT',
+                        help='let spectators watch the games on PORT, see spectate.py')
+    parser.add_argument('--record', metavar='PATH',
+                        help='record the games to the replay log at PATH, see replay.py; '
+                             'not shared with another running game')
+    args = parser.parse_args()
+    try:
+        settings = protocol.parse_settings(args.board, args.fleet, args.salvo, not args.ask_who_starts)
+    except ValueError as e:
+        parser.error(str(e))
+    GUI(*settings, spectate_port=args.spectate, replay_path=args.record)
 
 
 if __name__ == '__main__':
-    gui = GUI()
+    main()
@@ -0,0 +1,382 @@
+"""
+Computer opponents.
+
+A shooter picks where to fire with next_shot(), or several cells at once for a salvo with next_salvo(),
+and is told what came back with update(); a placer puts
+a fleet on an engine.Board. SHOOTERS and PLACERS hold every strategy by name.
+ProbabilityShooter keeps, for every ship length still afloat, which placements are still
+possible and fires at the cell covered by the most of them. ComputerOpponent wraps a shooter
+and a board so it can stand in for the opponent's socket in the GUI.
+"""
+import random
+
+import numpy as np
+
+import book
+import engine
+import placements
+import protocol
+from vars import *
+
+# how much more a placement counts when it goes through a hit that has not been sunk yet
+HIT_WEIGHT = 50
+
+
+def _windows(values, length, axis):
+    """Sums of every run of length cells along axis (a sliding window count)."""
+    count = values.shape[axis] - length + 1
+    if axis == 0:
+        total = values[:count].copy()
+        for i in range(1, length):
+            total += values[i:i + count]
+    else:
+        total = values[:, :count].copy()
+        for i in range(1, length):
+            total += values[:, i:i + count]
+    return total
+
+
+def _spread(weights, length, axis, out):
+    """Adds the weight of every placement starting at a cell to all of the length cells it covers."""
+    count = weights.shape[axis]
+    for i in range(length):
+        if axis == 0:
+            out[i:i + count] += weights
+        else:
+            out[:, i:i + count] += weights
+
+
+class RandomShooter:
+    """Fires at the cells in a random order."""
+
+    def __init__(self, width=BOARD_WIDTH, height=BOARD_HEIGHT, fleet=FLEET, rng=None):
+        self.width = width
+        self.height = height
+        self.rng = rng or random.Random()
+        self.reset()
+
+    def reset(self):
+        self.cells = [(x, y) for x in range(self.width) for y in range(self.height)]
+        self.rng.shuffle(self.cells)
+
+    def next_shot(self):
+        return self.cells.pop()
+
+    def next_salvo(self, count):
+        return [self.cells.pop() for _ in range(count)]
+
+    def update(self, x, y, result):
+        pass
+
+
+class HuntShooter:
+    """
+    Fires at every other cell in a random order until something gets hit, then at the cells next to
+    the hits until the ship is sunk.
+    """
+
+    def __init__(self, width=BOARD_WIDTH, height=BOARD_HEIGHT, fleet=FLEET, rng=None):
+        self.width = width
+        self.height = height
+        self.rng = rng or random.Random()
+        self.reset()
+
+    def reset(self):
+        self.shot = set()
+        self.hits = []
+        cells = [(x, y) for x in range(self.width) for y in range(self.height)]
+        self.rng.shuffle(cells)
+        # the cells that are popped last are shot first
+        cells.sort(key=lambda cell: (cell[0] + cell[1]) % 2 == 0)
+        self.cells = cells
+
+    def next_shot(self):
+        for x, y in reversed(self.hits):
+            for cell in ((x + 1, y), (x - 1, y), (x, y + 1), (x, y - 1)):
+                if 0 <= cell[0] < self.width and 0 <= cell[1] < self.height and cell not in self.shot:
+                    return cell
+        while True:
+            cell = self.cells.pop()
+            if cell not in self.shot:
+                return cell
+
+    def next_salvo(self, count):
+        cells = []
+        for _ in range(count):
+            cell = self.next_shot()
+            # so that the salvo does not fire at it twice
+            self.shot.add(cell)
+            cells.append(cell)
+        return cells
+
+    def update(self, x, y, result):
+        self.shot.add((x, y))
+        if result == engine.HIT:
+            self.hits.append((x, y))
+        elif result == engine.SUNK:
+            # which hits belonged to the sunk ship is not known, so only forget the ones in line with it
+            self.hits = [(hx, hy) for hx, hy in self.hits if hx != x and hy != y]
+
+
+class ProbabilityShooter:
+    """
+    Fires at the cell with the highest density of possible remaining ship placements.
+    The valid placements for every ship length are updated incrementally as cells get ruled out.
+    """
+
+    def __init__(self, width=BOARD_WIDTH, height=BOARD_HEIGHT, fleet=FLEET, rng=None, cache=None):
+        """
+        :param cache: optional book.PositionCache to remember the best cells of positions seen before
+        """
+        self.width = width
+        self.height = height
+        self.fleet = tuple(fleet)
+        self.rng = rng or random.Random()
+        self.cache = cache
+        self.zobrist = book.get_zobrist(width, height) if cache is not None else None
+        # Zobrist hash of everything the density depends on: the cells ruled out (key MISS), the hits
+        # not put down to a sunk ship yet (key HIT), and which ships are left (key SUNK of the
+        # index of every sunk ship in the sorted fleet)
+        self.hash = 0
+        self.sorted_fleet = sorted(self.fleet)
+        self.shot = np.zeros((width, height), dtype=bool)
+        self.hits = np.zeros((width, height), dtype=np.int64)
+        self.remaining = list(self.fleet)
+        # valid[length] = (placements along x, placements along y), indexed by the first cell
+        self.valid = {length: (np.ones((width - length + 1, height), dtype=bool),
+                               np.ones((width, height - length + 1), dtype=bool))
+                      for length in set(self.fleet)}
+
+    def reset(self):
+        self.hash = 0
+        self.shot[:] = False
+        self.hits[:] = 0
+        self.remaining = list(self.fleet)
+        for across, down in self.valid.values():
+            across[:] = True
+            down[:] = True
+
+    def _block(self, x, y):
+        """Rules out every placement that covers (x, y)."""
+        for length, (across, down) in self.valid.items():
+            across[max(0, x - length + 1):x + 1, y] = False
+            down[x, max(0, y - length + 1):y + 1] = False
+
+    def density(self):
+        """
+        :return: a width x height array with the number of (weighted) placements covering every cell
+        """
+        density = np.zeros((self.width, self.height), dtype=np.int64)
+        hunting = not self.hits.any()
+        for length in set(self.remaining):
+            count = self.remaining.count(length)
+            for axis, valid in enumerate(self.valid[length]):
+                if not valid.any():
+                    continue
+                weights = valid.astype(np.int64)
+                if not hunting:
+                    weights += valid * _windows(self.hits, length, axis) * HIT_WEIGHT
+                if count > 1:
+                    weights *= count
+                _spread(weights, length, axis, density)
+        density[self.shot] = 0
+        return density
+
+    def best_cells(self):
+        """:return: tuple of the cells with the highest density"""
+        density = self.density()
+        best = density.max()
+        if best == 0:
+            return tuple(np.flatnonzero(~self.shot).tolist())
+        return tuple(np.flatnonzero(density == best).tolist())
+
+    def next_shot(self):
+        cells = None
+        if self.cache is not None:
+            cells = self.cache.get(self.hash)
+            if cells is None:
+                cells = self.best_cells()
+                self.cache.put(self.hash, cells)
+        else:
+            cells = self.best_cells()
+        x, y = divmod(cells[self.rng.randrange(len(cells))], self.height)
+        return x, y
+
+    def next_salvo(self, count):
+        """:return: list of count different cells, the one next_shot would pick followed by the densest others"""
+        first = self.next_shot()
+        if count == 1:
+            return [first]
+        density = self.density().ravel()
+        density[self.shot.ravel()] = -1
+        density[first[0] * self.height + first[1]] = -1
+        rest = np.argsort(-density, kind='stable')[:count - 1]
+        return [first] + [divmod(int(cell), self.height) for cell in rest]
+
+    def update(self, x, y, result):
+        """
+        Tells the shooter what came back from a shot.
+        :param result: engine.MISS, engine.HIT or engine.SUNK
+        """
+        self.shot[x, y] = True
+        if self.zobrist is not None:
+            self.hash ^= self.zobrist.key(x * self.height + y, engine.MISS if result == engine.MISS else engine.HIT)
+        if result == engine.MISS:
+            self._block(x, y)
+            return
+        self.hits[x, y] = 1
+        if result == engine.SUNK:
+            self._sink(x, y)
+
+    def _sink(self, x, y):
+        """
+        A ship went down at (x, y). The ship is guessed to be the longest remaining one that
+        fits in the line of unresolved hits through (x, y); those cells are taken off the board.
+        """
+        best = None
+        for dx, dy in ((1, 0), (0, 1)):
+            run = [(x, y)]
+            for sign in (-1, 1):
+                cx, cy = x + dx * sign, y + dy * sign
+                while 0 <= cx < self.width and 0 <= cy < self.height and self.hits[cx, cy]:
+                    run.append((cx, cy))
+                    cx, cy = cx + dx * sign, cy + dy * sign
+            fits = [length for length in self.remaining if length <= len(run)]
+            if fits and (best is None or max(fits) > best[0]):
+                run.sort(key=lambda cell: abs(cell[0] - x) + abs(cell[1] - y))
+                best = (max(fits), run)
+        if best is None:
+            length, cells = min(self.remaining), [(x, y)]
+        else:
+            length, run = best
+            cells = run[:length]
+        self.remaining.remove(length)
+        for cx, cy in cells:
+            self.hits[cx, cy] = 0
+            self._block(cx, cy)
+        if self.zobrist is not None:
+            zobrist = self.zobrist
+            for cx, cy in cells:
+                cell = cx * self.height + cy
+                self.hash ^= zobrist.key(cell, engine.HIT) ^ zobrist.key(cell, engine.MISS)
+            # the first ship of this length gone is the first of them in the sorted fleet, and so on
+            index = self.sorted_fleet.index(length) + self.fleet.count(length) - self.remaining.count(length) - 1
+            self.hash ^= zobrist.key(index, engine.SUNK)
+
+
+SHOOTERS = {'random': RandomShooter, 'hunt': HuntShooter, 'density': ProbabilityShooter}
+
+
+def place_random(board, rng):
+    board.place_random(rng)
+
+
+def place_edges(board, rng):
+    """Keeps the ships along the edges of the board where hunting shooters find them last."""
+    for index, length in enumerate(board.fleet):
+        options = []
+        for i in range(board.width - length + 1):
+            options.append([(i + j, 0) for j in range(length)])
+            options.append([(i + j, board.height - 1) for j in range(length)])
+        for i in range(board.height - length + 1):
+            options.append([(0, i + j) for j in range(length)])
+            options.append([(board.width - 1, i + j) for j in range(length)])
+        options = [cells for cells in options if board.can_place(index, cells)]
+        if options:
+            board.place(index, rng.choice(options))
+    board.place_random(rng)
+
+
+def place_spread(board, rng, tries=20):
+    """Puts every ship where it is furthest away from the ships already placed, out of a few random spots."""
+    size = board.width * board.height
+    index = placements.get(board.width, board.height)
+    for ship, length in enumerate(board.fleet):
+        best = None
+        placed = [divmod(cell, board.height) for cell in range(size) if board.owner[cell]]
+        for _ in range(tries):
+            i = index.pick(length, board.owner, rng)
+            cells = [divmod(int(cell), board.height) for cell in index.cells(length)[i]]
+            distance = min((abs(x - px) + abs(y - py) for x, y in cells for px, py in placed), default=0)
+            if best is None or distance > best[0]:
+                best = (distance, i)
+        board.place_mask(ship, index.mask(length, best[1]))
+
+
+PLACERS = {'random': place_random, 'edges': place_edges, 'spread': place_spread}
+
+
+class ComputerOpponent:
+    """
+    Plays the opponent's side of the protocol locally. It behaves like the socket the GUI
+    sends to and puts the opponent's messages on the GUI's queue, just like ListenThread.
+    """
+
+    def __init__(self, queue, name='Computer', shooter=None, rng=None, width=BOARD_WIDTH, height=BOARD_HEIGHT,
+                 fleet=FLEET, salvo=False):
+        """:param salvo: True to fire one shot per ship still afloat every turn"""
+        self.queue = queue
+        self.salvo = salvo
+        self.name = name
+        self.rng = rng or random.Random()
+        self.board = engine.Board(width, height, fleet)
+        self.board.place_random(self.rng)
+        self.shooter = shooter or ProbabilityShooter(width, height, fleet, rng=self.rng,
+                                                     cache=book.get_cache(width, height, fleet))
+        self.last = None
+        # cells fired at so far, a salvo can not be bigger than what is left
+        self.fired = 0
+        self.toss = None
+
+    def fire(self):
+        """Takes the computer's turn."""
+        if self.salvo:
+            board = self.board
+            count = min(len(board.fleet) - board.sunk, board.width * board.height - self.fired)
+            self.last = self.shooter.next_salvo(count)
+            self.fired += count
+            self.queue.put(['SALVO'] + [coordinate for cell in self.last for coordinate in cell])
+            return
+        self.last = self.shooter.next_shot()
+        self.fired += 1
+        self.queue.put(['SHOOT', self.last[0], self.last[1]])
+
+    def send(self, *message):
+        if message[0] == 'SHOOT':
+            result = self.board.shoot(message[1], message[2])
+            self.queue.put(['SHOT', engine.RESULTS[result]])
+            if not self.board.lost:
+                self.fire()
+        elif message[0] == 'SALVO':
+            results = self.board.shoot_salvo(list(zip(message[1::2], message[2::2])))
+            self.queue.put(['RESULTS'] + [engine.RESULTS[result] for result in results])
+            if not self.board.lost:
+                self.fire()
+        elif message[0] == 'SHOT':
+            self.shooter.update(self.last[0], self.last[1], engine.RESULT_CODES[message[1]])
+        elif message[0] == 'RESULTS':
+            for (x, y), result in zip(self.last, message[1:]):
+                self.shooter.update(x, y, engine.RESULT_CODES[result])
+        elif message[0] == 'CHOOSE':
+            # always agree with whoever the player wants to start
+            self.queue.put(['CHOOSE', message[1]])
+        elif message[0] == 'APPLY':
+            self.queue.put(['APPLY', 'APPROVED'])
+        elif message[0] == 'COMMIT':
+            self.toss = protocol.CoinToss()
+            self.toss.commit(message[1])
+            self.queue.put(['COMMIT', self.toss.commitment])
+        elif message[0] == 'REVEAL':
+            self.toss.reveal(message[1])
+            self.queue.put(['REVEAL', self.toss.nonce])
+        elif message[0] == 'REMATCH':
+            # always up for another game
+            self.board.reset()
+            self.board.place_random(self.rng)
+            self.shooter.reset()
+            self.last = None
+            self.fired = 0
+            self.queue.put(['REMATCH'])
+
+    def close(self):
+        pass
@@ -0,0 +1,317 @@
+"""
+Questions about many games at once: where the shots go, when the first hit comes and how long
+every ship length takes to sink.
+
+Games are kept in a store, a directory of chunks with one .npy file per column, and a manifest:
+    manifest.json   {"version", "width", "height", "fleet", "chunks": [{"name", "games", "shots"}, ...]}
+    <chunk>/games-<column>.npy   a row per game:  start (its first shot), shots, winner, source
+    <chunk>/shots-<column>.npy   a row per shot, in the order of the games and then of the shots:
+                                 game (in the chunk), player, turn (shot number of the player),
+                                 cell (x * height + y), result, ship (its index, 255 for a miss or
+                                 when the ships were not known)
+Adding games writes a new chunk and then the manifest, so a store can always be read. The queries
+memory map one chunk at a time and scan it with NumPy, so a store does not have to fit in memory.
+
+Usage: python analytics.py ingest [--store PATH] (--replay PATH | --simulate N [--strategy hunt])
+       python analytics.py report [--store PATH]
+       python analytics.py --benchmark [N]
+"""
+import argparse
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+import engine
+import replay
+import simulator
+from vars import *
+
+STORE_VERSION = 1
+UNKNOWN = 255
+# where the games came from
+SIMULATED = 0
+RECORDED = 1
+GAME_COLUMNS = {'start': np.uint32, 'shots': np.uint16, 'winner': np.uint8, 'source': np.uint8}
+SHOT_COLUMNS = {'game': np.uint32, 'player': np.uint8, 'turn': np.uint16, 'cell': np.uint16, 'result': np.uint8,
+                'ship': np.uint8}
+
+
+class Store(object):
+    """A store of games of one size, opened or made at path."""
+
+    def __init__(self, path=ANALYTICS_PATH, width=BOARD_WIDTH, height=BOARD_HEIGHT, fleet=FLEET):
+        self.path = path
+        manifest = os.path.join(path, 'manifest.json')
+        if os.path.exists(manifest):
+            with open(manifest) as f:
+                self.manifest = json.load(f)
+            if self.manifest.get('version') != STORE_VERSION:
+                raise ValueError('%s is not a store this version can read!' % path)
+        else:
+            os.makedirs(path, exist_ok=True)
+            self.manifest = {'version': STORE_VERSION, 'width': width, 'height': height, 'fleet': list(fleet),
+                             'chunks': []}
+            self._save()
+        self.width = self.manifest['width']
+        self.height = self.manifest['height']
+        self.fleet = tuple(self.manifest['fleet'])
+
+    def __len__(self):
+        return sum(chunk['games'] for chunk in self.manifest['chunks'])
+
+    @property
+    def shot_count(self):
+        return sum(chunk['shots'] for chunk in self.manifest['chunks'])
+
+    def _save(self):
+        temporary = os.path.join(self.path, 'manifest.json.tmp')
+        with open(temporary, 'w') as f:
+            json.dump(self.manifest, f, indent=1)
+        os.replace(temporary, os.path.join(self.path, 'manifest.json'))
+
+    def append(self, games, shots):
+        """
+        Writes games as a new chunk.
+        :param games: dict of GAME_COLUMNS -> array, shots likewise of SHOT_COLUMNS
+        """
+        count = len(games['winner'])
+        if not count:
+            return
+        name = 'chunk-%06i' % len(self.manifest['chunks'])
+        directory = os.path.join(self.path, name)
+        # left over from an append that never made it into the manifest
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory)
+        for table, columns, values in (('games', GAME_COLUMNS, games), ('shots', SHOT_COLUMNS, shots)):
+            for column, dtype in columns.items():
+                np.save(os.path.join(directory, '%s-%s.npy' % (table, column)), np.asarray(values[column], dtype=dtype))
+        self.manifest['chunks'].append({'name': name, 'games': count, 'shots': len(shots['cell'])})
+        self._save()
+
+    def chunks(self, table, columns):
+        """:return: iterator of a dict of column -> memory mapped array for every chunk of table"""
+        for chunk in self.manifest['chunks']:
+            directory = os.path.join(self.path, chunk['name'])
+            yield {column: np.load(os.path.join(directory, '%s-%s.npy' % (table, column)), mmap_mode='r')
+                   for column in columns}
+
+
+def _games_table(counts, winners, source):
+    counts = np.asarray(counts, dtype=np.int64)
+    start = np.zeros(len(counts), dtype=np.int64)
+    np.cumsum(counts[:-1], out=start[1:])
+    return {'start': start, 'shots': counts, 'winner': winners, 'source': np.full(len(counts), source)}
+
+
+def ingest_simulation(store, games, strategy='hunt', batch=SIMULATION_BATCH, seed=None):
+    """Plays games with simulator.BatchSimulator, batch at a time, and adds every batch as a chunk."""
+    rng = np.random.default_rng(seed)
+    left = games
+    while left:
+        size = min(batch, left)
+        log = []
+        sim = simulator.BatchSimulator(size, simulator.STRATEGIES[strategy], store.width, store.height, store.fleet,
+                                       seed=rng.integers(2 ** 63), log=log)
+        sim.run()
+        game = np.concatenate([entry[1] for entry in log])
+        turn = np.concatenate([np.full(len(entry[1]), entry[0]) for entry in log])
+        cell = np.concatenate([entry[2] for entry in log])
+        ship = np.concatenate([entry[3] for entry in log]).astype(np.int16) - 1
+        result = np.concatenate([entry[4] for entry in log])
+        # game by game, every game in the order of its shots
+        order = np.lexsort((turn, game))
+        ship[ship < 0] = UNKNOWN
+        shots = {'game': game[order], 'player': np.zeros(len(order)), 'turn': turn[order], 'cell': cell[order],
+                 'result': result[order], 'ship': ship[order]}
+        store.append(_games_table(np.bincount(game, minlength=size), np.zeros(size), SIMULATED), shots)
+        left -= size
+
+
+def ingest_replay(store, path, batch=SIMULATION_BATCH):
+    """
+    Adds the games of a replay log that are the size of the store.
+    :return: number of games added, and of games skipped for being another size
+    """
+    log = replay.Replay(path)
+    added = skipped = 0
+    try:
+        columns = {column: [] for column in SHOT_COLUMNS}
+        counts = []
+        winners = []
+        for number in range(len(log)):
+            game = log.game(number)
+            if (game.width, game.height, game.fleet) != (store.width, store.height, store.fleet):
+                skipped += 1
+                continue
+            moves = game.move_array()
+            player = moves[:, 0]
+            cell = moves[:, 1].astype(np.int64) * game.height + moves[:, 2]
+            result = moves[:, 3]
+            turn = np.zeros(len(moves), dtype=np.int64)
+            ship = np.full(len(moves), UNKNOWN, dtype=np.int64)
+            for side in range(2):
+                mine = player == side
+                turn[mine] = np.arange(np.count_nonzero(mine))
+                # the ships it shot at are the other player's
+                ships = game.ships[1 - side]
+                if ships is not None:
+                    owner = np.full(game.width * game.height, UNKNOWN, dtype=np.int64)
+                    for index, cells in enumerate(ships):
+                        owner[[x * game.height + y for x, y in cells]] = index
+                    hits = mine & (result != engine.MISS)
+                    ship[hits] = owner[cell[hits]]
+            columns['game'].append(np.full(len(moves), len(counts)))
+            for name, values in (('player', player), ('turn', turn), ('cell', cell), ('result', result),
+                                 ('ship', ship)):
+                columns[name].append(values)
+            counts.append(len(moves))
+            winners.append(game.winner)
+            if len(counts) == batch:
+                added += _flush_replay(store, columns, counts, winners)
+                columns = {column: [] for column in SHOT_COLUMNS}
+                counts = []
+                winners = []
+        added += _flush_replay(store, columns, counts, winners)
+    finally:
+        log.close()
+    return added, skipped
+
+
+def _flush_replay(store, columns, counts, winners):
+    if not counts:
+        return 0
+    store.append(_games_table(counts, winners, RECORDED),
+                 {name: np.concatenate(values) for name, values in columns.items()})
+    return len(counts)
+
+
+def heatmap(store, player=None, result=None):
+    """
+    :param player: only the shots of this player, result only shots with this result
+    :return: (width, height) array of how often every cell was shot at
+    """
+    counts = np.zeros(store.width * store.height, dtype=np.int64)
+    for chunk in store.chunks('shots', ('player', 'cell', 'result')):
+        keep = np.ones(len(chunk['cell']), dtype=bool)
+        if player is not None:
+            keep &= chunk['player'] == player
+        if result is not None:
+            keep &= chunk['result'] == result
+        counts += np.bincount(chunk['cell'][keep], minlength=len(counts))
+    return counts.reshape(store.width, store.height)
+
+
+def first_hits(store):
+    """:return: array of how many players got their first hit with their first, second, ... shot"""
+    counts = np.zeros(store.width * store.height, dtype=np.int64)
+    for chunk in store.chunks('shots', ('game', 'player', 'turn', 'result')):
+        hits = np.flatnonzero(chunk['result'] != engine.MISS)
+        # the shots are in order, so the first row of every player of every game is its first hit
+        _, first = np.unique(chunk['game'][hits].astype(np.int64) * 2 + chunk['player'][hits], return_index=True)
+        counts += np.bincount(chunk['turn'][hits[first]], minlength=len(counts))
+    return counts
+
+
+def turns_to_sink(store):
+    """
+    For every ship length, how long its ships lasted: the shot number of the player that sank them,
+    and the shots it took from the first hit on a ship to sinking it.
+    :return: dict of length -> {'ships', 'sunk_at' (mean shot number), 'after_first_hit' (mean shots),
+             'distribution' (array of ships sunk at every shot number)}
+    """
+    cells = store.width * store.height
+    ships = len(store.fleet)
+    lengths = np.array(store.fleet)
+    sunk_at = np.zeros((ships, cells), dtype=np.int64)
+    chase = np.zeros(ships, dtype=np.int64)
+    for chunk in store.chunks('shots', ('game', 'player', 'turn', 'result', 'ship')):
+        hits = np.flatnonzero((chunk['result'] != engine.MISS) & (chunk['ship'] != UNKNOWN))
+        ship = chunk['ship'][hits].astype(np.int64)
+        turn = chunk['turn'][hits].astype(np.int64)
+        key = (chunk['game'][hits].astype(np.int64) * 2 + chunk['player'][hits]) * ships + ship
+        # keys come up in the order of the shots, the first is the first hit on that ship
+        keys, first = np.unique(key, return_index=True)
+        sunk = chunk['result'][hits] == engine.SUNK
+        np.add.at(sunk_at, (ship[sunk], turn[sunk]), 1)
+        first_turn = turn[first][np.searchsorted(keys, key[sunk])]
+        chase += np.bincount(ship[sunk], weights=turn[sunk] - first_turn + 1, minlength=ships).astype(np.int64)
+    report = {}
+    for length in sorted(set(store.fleet)):
+        same = lengths == length
+        distribution = sunk_at[same].sum(axis=0)
+        count = int(distribution.sum())
+        report[length] = {'ships': count,
+                          'sunk_at': float((distribution * np.arange(cells)).sum() / count + 1) if count else 0.0,
+                          'after_first_hit': float(chase[same].sum() / count) if count else 0.0,
+                          'distribution': distribution}
+    return report
+
+
+def report(store):
+    print('%i games, %i shots, %ix%i, ships %s' % (len(store), store.shot_count, store.width, store.height,
+                                                  ','.join(str(length) for length in store.fleet)))
+    counts = heatmap(store)
+    peak = counts.max() or 1
+    print('shots per cell, 0-9 of the most shot at cell:')
+    for y in range(store.height):
+        print('  ' + ''.join(str(min(9, 10 * int(counts[x, y]) // peak)) for x in range(store.width)))
+    first = first_hits(store)
+    if first.sum():
+        mean = (first * np.arange(1, len(first) + 1)).sum() / first.sum()
+        print('first hit: mean shot %.2f, %s' % (mean, ', '.join('p%i=%i' % (p, np.searchsorted(
+            np.cumsum(first), first.sum() * p / 100) + 1) for p in (5, 50, 95))))
+    for length, row in turns_to_sink(store).items():
+        print('ships of %i: %i sunk, at shot %.1f on average, %.2f shots after the first hit' %
+              (length, row['ships'], row['sunk_at'], row['after_first_hit']))
+
+
+def benchmark(games=200000, path='analytics-benchmark'):
+    """:return: dict with the games ingested per second and the shots every query scanned per second"""
+    shutil.rmtree(path, ignore_errors=True)
+    store = Store(path)
+    start = time.perf_counter()
+    ingest_simulation(store, games, seed=1)
+    ingested = time.perf_counter() - start
+    result = {'games': games, 'shots': store.shot_count, 'ingest_games_per_second': games / ingested}
+    for name, query in (('heatmap', heatmap), ('first_hits', first_hits), ('turns_to_sink', turns_to_sink)):
+        start = time.perf_counter()
+        query(store)
+        result[name + '_shots_per_second'] = store.shot_count / (time.perf_counter() - start)
+    shutil.rmtree(path)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Store many games and ask questions about them.')
+    parser.add_argument('command', nargs='?', choices=('ingest', 'report'), default='report')
+    parser.add_argument('--store', default=ANALYTICS_PATH)
+    parser.add_argument('--replay', metavar='PATH', help='add the games of a replay log')
+    parser.add_argument('--simulate', type=int, metavar='GAMES', help='add games of a simulated strategy')
+    parser.add_argument('--strategy', choices=sorted(simulator.STRATEGIES), default='hunt')
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--benchmark', type=int, nargs='?', const=200000, metavar='GAMES')
+    args = parser.parse_args()
+    if args.benchmark:
+        print('%(games)i games, %(shots)i shots: %(ingest_games_per_second).0f games/s ingested, '
+              '%(heatmap_shots_per_second).3g shots/s heatmap, %(first_hits_shots_per_second).3g shots/s first hits, '
+              '%(turns_to_sink_shots_per_second).3g shots/s turns to sink' % benchmark(args.benchmark))
+        return
+    store = Store(args.store)
+    if args.command == 'ingest':
+        if args.replay:
+            added, skipped = ingest_replay(store, args.replay)
+            print('%i games added, %i of another size skipped' % (added, skipped))
+        elif args.simulate:
+            ingest_simulation(store, args.simulate, args.strategy, seed=args.seed)
+            print('%i games added' % args.simulate)
+        else:
+            parser.error('ingest needs --replay or --simulate')
+        return
+    report(store)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+Simulates many lobbies beaconing on loopback to measure what discovery costs.
+
+Every simulated lobby has its own UDP socket and BeaconSchedule, like Broadcast does. A receiver
+decodes everything that arrives like Client does and the packets per second, the size of the
+peer table and the CPU time used by both sides are printed at the end.
+
+Usage: python beaconload.py [--senders N] [--seconds S] [--text] [--fixed] [--port PORT]
+"""
+import argparse
+import heapq
+import selectors
+import socket
+import time
+
+import discovery
+from vars import *
+
+
+def run(senders, seconds, port, text=False, fixed=False):
+    """
+    :param senders: number of lobbies to simulate
+    :param text: send the old text beacons instead of binary ones
+    :param fixed: beacon every second like the old Broadcast instead of backing off
+    :return: dict with the figures
+    """
+    encode = discovery.encode_text_beacon if text else discovery.encode_beacon
+    listener = discovery.open_listener(port, group=None)
+    address = ('127.0.0.1', port)
+    lobbies = []
+    for i in range(senders):
+        s = socket.socket(type=socket.SOCK_DGRAM)
+        s.bind(('127.0.0.1', 0))
+        schedule = discovery.BeaconSchedule(1, 1, 0) if fixed else discovery.BeaconSchedule()
+        lobbies.append((s, encode('Player %i' % i, 'load-%i' % i, 2000 + i % 8000), schedule))
+    table = discovery.PeerTable()
+    selector = selectors.DefaultSelector()
+    selector.register(listener, selectors.EVENT_READ)
+    start = time.monotonic()
+    cpu = time.process_time()
+    due = [(start + i / senders, i) for i in range(senders)]
+    heapq.heapify(due)
+    sent = 0
+    received = 0
+    end = start + seconds
+    now = start
+    while now < end:
+        while due and due[0][0] <= now:
+            _, i = heapq.heappop(due)
+            s, beacon, schedule = lobbies[i]
+            s.sendto(beacon, address)
+            sent += 1
+            heapq.heappush(due, (now + schedule.next(), i))
+        for _ in selector.select(max(0.0, min(due[0][0], end) - now)):
+            while True:
+                try:
+                    data, source = listener.recvfrom(512)
+                except BlockingIOError:
+                    break
+                received += 1
+                table.count(now)
+                beacon = discovery.decode_beacon(data)
+                if beacon and not beacon[3]:
+                    table.seen(beacon[1], beacon[0], (source[0], beacon[2]), now)
+        table.expire(now)
+        now = time.monotonic()
+    elapsed = now - start
+    cpu = time.process_time() - cpu
+    for s, _, _ in lobbies:
+        s.close()
+    selector.close()
+    listener.close()
+    return {'senders': senders,
+            'seconds': elapsed,
+            'sent_per_second': sent / elapsed,
+            'received_per_second': received / elapsed,
+            'peers': len(table),
+            'cpu_percent': 100 * cpu / elapsed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulate many lobbies beaconing on loopback.')
+    parser.add_argument('--senders', type=int, default=500)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--text', action='store_true', help='send the old text beacons')
+    parser.add_argument('--fixed', action='store_true', help='beacon every second instead of backing off')
+    args = parser.parse_args()
+    report = run(args.senders, args.seconds, args.port, args.text, args.fixed)
+    print('%i senders for %.1fs' % (report['senders'], report['seconds']))
+    print('sent %.0f packets/s, received %.0f packets/s' % (report['sent_per_second'], report['received_per_second']))
+    print('%i peers in the table, %.1f%% CPU' % (report['peers'], report['cpu_percent']))
+
+
+if __name__ == '__main__':
+    main()
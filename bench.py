@@ -0,0 +1,391 @@
+"""
+Benchmarks of the hot paths of the game, all run the same way so the numbers can be compared
+across commits.
+
+Every case times code the game runs over and over:
+- placing ships and asking whether they sank;
+- answering the opponent's shots;
+- parsing messages like ListenThread and WhoStartsDialog;
+- parsing beacons like PlayerList;
+- working out which cell was clicked;
+- building the boards on the game canvas.
+
+The game window's methods are called on stand-ins for the window. When there is no display,
+the canvas is a StubCanvas that only counts items; run under Xvfb to draw on a real tk.Canvas.
+
+A case first runs BENCH_WARMUP times. It is then called in a loop as many times as take about
+BENCH_TIME seconds, and that loop is timed BENCH_REPEAT times. The results are per operation
+(one ship, one shot, one message, ...) in microseconds: mean, median, stdev, min and max over the
+repetitions.
+
+Usage: python bench.py [--filter TEXT] [--repeat N] [--warmup N] [--json PATH] [--compare OLD.json]
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+import tkinter as tk
+from datetime import datetime
+from types import SimpleNamespace
+
+import numpy as np
+
+import Battleship
+import boardview
+import discovery
+import engine
+import framing
+import protocol
+import render
+from vars import *
+
+# name -> function making the case, see case
+CASES = {}
+
+
+def case(name):
+    """
+    Registers a function that sets a benchmark up. It gets the canvas to draw on and returns
+    (run, operations): run() does operations of whatever is measured.
+    """
+    def register(setup):
+        CASES[name] = setup
+        return setup
+    return register
+
+
+class StubCanvas(object):
+    """Stands in for tk.Canvas without a display: items are numbered and counted, nothing is drawn."""
+
+    def __init__(self):
+        self.items = 0
+
+    def _create(self, *args, **options):
+        self.items += 1
+        return self.items
+
+    create_oval = create_text = create_line = create_rectangle = create_image = create_window = _create
+    create_circle = boardview._create_circle
+
+    def itemconfig(self, item, **options):
+        pass
+
+    def coords(self, item, *coordinates):
+        pass
+
+    def delete(self, *items):
+        pass
+
+    def tag_bind(self, tag, sequence, function):
+        pass
+
+    def after(self, ms, function):
+        return None
+
+    def after_cancel(self, id):
+        pass
+
+
+def make_canvas():
+    """:return: (canvas, 'tk') when there is a display, (StubCanvas, 'stub') otherwise"""
+    try:
+        root = tk.Tk()
+    except tk.TclError:
+        return StubCanvas(), 'stub'
+    root.withdraw()
+    return tk.Canvas(root, width=592, height=783), 'tk'
+
+
+def _ignore(*args, **kwargs):
+    pass
+
+
+def _window(canvas):
+    """:return: a stand-in for the GUI with what setup and opponent_turn use"""
+    renderer = render.Renderer(canvas)
+    return SimpleNamespace(canvas=canvas, renderer=renderer, font=None, settings=None, player=None,
+                           view_mine=None, view_opponent=None, windows=[], click_opponent=_ignore,
+                           click_mine=_ignore, observers=[], sock=SimpleNamespace(send=_ignore),
+                           state=Battleship.THEIR_TURN, turn_text=None, opponent_sunk=0)
+
+
+def _classic_layout():
+    """:return: one ship per row, as the ((x, y), (x, y)) ends Player.place_ship takes"""
+    return [((0, row * 2), (length - 1, row * 2)) for row, length in enumerate(FLEET)]
+
+
+@case('player.place_ship')
+def place_ship(canvas):
+    player = Battleship.Player()
+    layout = _classic_layout()
+
+    def run():
+        player.reset()
+        for ship, coordinates in zip(player.ships, layout):
+            player.place_ship(ship, coordinates)
+    return run, len(FLEET)
+
+
+@case('ship.is_sunk')
+def is_sunk(canvas):
+    player = Battleship.Player()
+    for ship, coordinates in zip(player.ships, _classic_layout()):
+        player.place_ship(ship, coordinates)
+    player.board.shoot(0, 0)
+    player.board.shoot(1, 0)
+    ships = player.ships * 100
+
+    def run():
+        for ship in ships:
+            ship.is_sunk()
+    return run, len(ships)
+
+
+@case('gui.opponent_turn')
+def opponent_turn(canvas):
+    """Every cell shot once in a random order, leaving out the very last hit so the game is not lost."""
+    gui = _window(canvas)
+    Battleship.GUI.setup(gui, BOARD_WIDTH, BOARD_HEIGHT, FLEET)
+    board = gui.player.board
+    board.place_random(random.Random(1))
+    masks = list(board.ships)
+    cells = [(x, y) for x in range(BOARD_WIDTH) for y in range(BOARD_HEIGHT)]
+    random.Random(2).shuffle(cells)
+    last = max(i for i, (x, y) in enumerate(cells) if board.holds_ship(x, y))
+    shots = [['SHOOT', x, y] for x, y in cells[:last] + cells[last + 1:]]
+
+    def run():
+        board.reset()
+        for index, mask in enumerate(masks):
+            board.place_mask(index, mask)
+        for message in shots:
+            Battleship.GUI.opponent_turn(gui, message)
+        # what the Tk thread draws of it
+        gui.renderer.flush()
+    return run, len(shots)
+
+
+def _game_messages():
+    """:return: the messages of a typical game, as they come in"""
+    messages = [['CHOOSE', 'Somebody'], ['APPLY', 'Somebody']]
+    rng = random.Random(3)
+    for x in range(BOARD_WIDTH):
+        for y in range(BOARD_HEIGHT // 2):
+            messages.append(['SHOOT', x, y])
+            messages.append(['SHOT', rng.choice(engine.RESULTS)])
+    return messages + [['REMATCH']]
+
+
+def _receive(version):
+    codec = protocol.CODECS[version]()
+    messages = _game_messages()
+    if version == protocol.LEGACY:
+        stream = b''.join(codec.encode(message) for message in messages)
+
+        def run():
+            codec.messages(stream)
+    else:
+        stream = b''.join(framing.encode_frame(codec.encode(message)) for message in messages)
+        reader = framing.FrameReader()
+
+        def run():
+            # what Channel.receive does with what one recv brought, in ListenThread.run
+            reader.feed(stream)
+            for payload in reader.frames():
+                codec.messages(payload)
+    return run, len(messages)
+
+
+@case('protocol.receive.legacy')
+def receive_legacy(canvas):
+    return _receive(protocol.LEGACY)
+
+
+@case('protocol.receive.text')
+def receive_text(canvas):
+    return _receive(protocol.TEXT)
+
+
+@case('protocol.receive.binary')
+def receive_binary(canvas):
+    return _receive(protocol.BINARY)
+
+
+@case('who_starts.process')
+def who_starts(canvas):
+    """Both players changing their minds: CHOOSE either name, and an APPLY the other side turns down."""
+    dialog = SimpleNamespace(options=['Me', 'Somebody'], opponent='Somebody', choice_self='Me',
+                             choice_opponent=None, waiting=False, label_opponent=None,
+                             master=SimpleNamespace(renderer=SimpleNamespace(configure=_ignore)),
+                             sock=SimpleNamespace(send=_ignore))
+    messages = [['CHOOSE', 'Me'], ['CHOOSE', 'Somebody'], ['APPLY', 'Somebody']] * 100
+
+    def run():
+        for message in messages:
+            Battleship.WhoStartsDialog.process(dialog, message)
+    return run, len(messages)
+
+
+@case('player_list.process')
+def player_list(canvas):
+    """Beacons of 200 lobbies, half of them old text ones, as they keep coming in."""
+    lobby = SimpleNamespace(players=discovery.PeerTable(),
+                            view=SimpleNamespace(add=_ignore, remove=_ignore),
+                            master=SimpleNamespace(uuid='me', broad=SimpleNamespace(hurry=_ignore)))
+    beacons = []
+    for i in range(200):
+        encode = discovery.encode_text_beacon if i % 2 else discovery.encode_beacon
+        beacons.append((encode('Player %i' % i, 'uuid-%i' % i, 20000 + i), '10.0.%i.%i' % divmod(i, 256)))
+
+    def run():
+        for data, address in beacons:
+            Battleship.Client.PlayerList.process(lobby, data, address)
+    return run, len(beacons)
+
+
+def _clicks(left, top, width, height, space):
+    """:return: events at every few pixels over the board and a cell around it"""
+    return [SimpleNamespace(x=x, y=y)
+            for x in range(int(left - space), int(left + space * (width + 1)), 7)
+            for y in range(int(top - space), int(top + space * (height + 1)), 7)]
+
+
+@case('gridview.click')
+def grid_click(canvas):
+    view = SimpleNamespace(left=OPPONENT_START[0] + SPACE / 2, top=OPPONENT_START[1] + SPACE / 2,
+                           width=BOARD_WIDTH, height=BOARD_HEIGHT, command=_ignore)
+    events = _clicks(view.left, view.top, BOARD_WIDTH, BOARD_HEIGHT, SPACE)
+
+    def run():
+        for event in events:
+            boardview.GridView.click(view, event)
+    return run, len(events)
+
+
+@case('boardview.click')
+def board_click(canvas):
+    view = SimpleNamespace(cell=CELL_SIZE, columns=20, rows=20, left=40, top=70, command=_ignore)
+    events = _clicks(0, 0, view.columns, view.rows, CELL_SIZE)
+
+    def run():
+        for event in events:
+            boardview.BoardView.click(view, event)
+    return run, len(events)
+
+
+@case('gui.setup')
+def setup(canvas):
+    """Both classic boards on the game canvas, as GUI.__init__ and every new game make them."""
+    gui = _window(canvas)
+
+    def run():
+        Battleship.GUI.setup(gui, BOARD_WIDTH, BOARD_HEIGHT, FLEET)
+    return run, 1
+
+
+@case('boardview.layout')
+def board_layout(canvas):
+    """The cells of a 200x200 BoardView as big as the classic board, at the smallest zoom."""
+    scrollbar = SimpleNamespace(set=_ignore)
+    size = int(SPACE * (BOARD_WIDTH + 1))
+    view = SimpleNamespace(canvas=canvas, width=200, height=200, cells=bytearray(200 * 200), cell=MIN_CELL_SIZE,
+                           left=0, top=0, columns=0, rows=0, items=[], colors=[], view_width=size,
+                           view_height=size, xscrollbar=scrollbar, yscrollbar=scrollbar,
+                           COLORS=boardview.BoardView.COLORS)
+    view.draw = lambda: boardview.BoardView.draw(view)
+
+    def run():
+        boardview.BoardView.layout(view)
+    return run, 1
+
+
+def measure(run, operations, repeat=BENCH_REPEAT, warmup=BENCH_WARMUP, duration=BENCH_TIME):
+    """
+    :return: dict with the microseconds per operation over repeat repetitions, and how many calls
+             and operations every repetition had
+    """
+    for _ in range(warmup):
+        run()
+    calls = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(calls):
+            run()
+        if time.perf_counter() - start >= duration:
+            break
+        calls *= 2
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(calls):
+            run()
+        samples.append(1e6 * (time.perf_counter() - start) / (calls * operations))
+    return {'mean_us': statistics.mean(samples), 'median_us': statistics.median(samples),
+            'stdev_us': statistics.stdev(samples) if len(samples) > 1 else 0.0,
+            'min_us': min(samples), 'max_us': max(samples),
+            'repeat': repeat, 'calls': calls, 'operations': operations}
+
+
+def environment(canvas):
+    """:return: dict of what the numbers depend on, to tell runs apart"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'commit': commit, 'date': datetime.now().isoformat(timespec='seconds'),
+            'python': sys.version.split()[0], 'numpy': np.__version__, 'platform': platform.platform(),
+            'machine': platform.machine(), 'canvas': canvas}
+
+
+def run(names=None, repeat=BENCH_REPEAT, warmup=BENCH_WARMUP, duration=BENCH_TIME):
+    """
+    :param names: the cases to run, every one if None
+    :return: dict with the environment and the results of measure for every case
+    """
+    canvas, kind = make_canvas()
+    results = {}
+    for name, setup in CASES.items():
+        if names is None or name in names:
+            results[name] = measure(*setup(canvas), repeat=repeat, warmup=warmup, duration=duration)
+    return {'environment': environment(kind), 'results': results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the hot paths of the game.')
+    parser.add_argument('--filter', default='', help='only run the cases whose name contains this')
+    parser.add_argument('--repeat', type=int, default=BENCH_REPEAT)
+    parser.add_argument('--warmup', type=int, default=BENCH_WARMUP)
+    parser.add_argument('--time', type=float, default=BENCH_TIME, help='seconds every repetition takes about')
+    parser.add_argument('--json', metavar='PATH', help='write the results there')
+    parser.add_argument('--compare', metavar='PATH', help='results of an earlier run to compare the medians with')
+    args = parser.parse_args()
+    names = [name for name in CASES if args.filter in name]
+    if not names:
+        parser.error('No case matches %r, the cases are %s' % (args.filter, ', '.join(CASES)))
+    if args.repeat < 1:
+        parser.error('--repeat has to be at least 1')
+    old = {}
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)['results']
+    report = run(names, args.repeat, args.warmup, args.time)
+    print('commit %(commit)s, Python %(python)s, %(canvas)s canvas' % report['environment'])
+    print('%-26s %10s %10s %10s %10s %8s' % ('case', 'median us', 'mean us', 'stdev us', 'min us',
+                                            'vs old' if old else ''))
+    for name, result in report['results'].items():
+        ratio = '%7.2fx' % (result['median_us'] / old[name]['median_us']) if name in old else ''
+        print('%-26s %10.3f %10.3f %10.3f %10.3f %8s' % (name, result['median_us'], result['mean_us'],
+                                                         result['stdev_us'], result['min_us'], ratio))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
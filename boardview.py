@@ -0,0 +1,260 @@
+"""
+The two boards in the game window.
+
+GridView is the classic 10x10 board drawn over the background image. BoardView is for bigger
+boards: it scrolls and zooms, and it only has canvas items for the cells that are visible, so
+a 200x200 board costs as much to draw as a small one. Both views work out which cell was
+clicked with arithmetic and call command(x, y) with it.
+"""
+import tkinter as tk
+
+from vars import *
+
+# what a cell shows
+EMPTY = 0
+SHIP = 1
+MISS = 2
+HIT = 3
+CHOICE = 4
+
+
+def _create_circle(self, x, y, r, **kwargs):
+    return self.create_oval(x - r, y - r, x + r, y + r, **kwargs)
+
+
+tk.Canvas.create_circle = _create_circle
+
+
+def cell_at(left, top, space, x, y, width, height):
+    """
+    :param left: x of the left edge of the first cell, top likewise
+    :param space: size of a cell
+    :return: (column, row) of the cell holding the point (x, y), or None if it is off the board
+    """
+    column = int((x - left) // space)
+    row = int((y - top) // space)
+    if 0 <= column < width and 0 <= row < height:
+        return column, row
+    return None
+
+
+class GridView(object):
+    """The 10x10 board on the game canvas. Every item it needs is made once and shown or hidden later."""
+
+    def __init__(self, canvas, renderer, start, width, height, fleet, color, font, command):
+        self.canvas = canvas
+        self.renderer = renderer
+        self.width = width
+        self.height = height
+        self.color = color
+        self.command = command
+        # every item of this view has the tag, and the ones that change during a game also have tag-game
+        self.tag = 'grid%i%i' % start
+        self.game = self.tag + '-game'
+        dots = self.tag + '-dot'
+        x, y = start
+        self.left = x + SPACE / 2
+        self.top = y + SPACE / 2
+        tags = (self.tag, dots)
+        self.dots = [[canvas.create_circle(x + SPACE * (i + 1), y + SPACE * (j + 1), 3, fill=color, outline=color,
+                                           tags=tags)
+                      for j in range(height)]
+                     for i in range(width)]
+        tags = self.tag
+        for i in range(1, width + 1):
+            canvas.create_text(x + SPACE * i, y, text=str(i), fill=color, font=font, tags=tags)
+        for i, l in zip(range(1, height + 1), 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'):
+            canvas.create_text(x, y + SPACE * i, text=l, fill=color, font=font, tags=tags)
+        for i in range(0, width):
+            canvas.create_line(x + SPACE / 2 + SPACE * i, y - SPACE / 2,
+                               x + SPACE / 2 + SPACE * i, y + SPACE * height + SPACE / 2, fill=color, tags=tags)
+        for i in range(0, height):
+            canvas.create_line(x - SPACE / 2, y + SPACE / 2 + SPACE * i,
+                               x + SPACE / 2 + SPACE * width, y + SPACE / 2 + SPACE * i, fill=color, tags=tags)
+        tags = (self.tag, self.game)
+        self.ships = [canvas.create_oval(0, 0, 0, 0, fill='grey', outline='grey', state='hidden', tags=tags)
+                      for _ in fleet]
+        self.pegs = [[canvas.create_circle(x + SPACE * (i + 1), y + SPACE * (j + 1), 3, fill='black',
+                                           state='hidden', tags=tags)
+                      for j in range(height)]
+                     for i in range(width)]
+        self.markers = [[canvas.create_circle(x + SPACE * (i + 1), y + SPACE * (j + 1), 8, state='hidden', tags=tags)
+                         for j in range(height)]
+                        for i in range(width)]
+        canvas.tag_bind(dots, '<1>', self.click)
+
+    def click(self, event):
+        cell = cell_at(self.left, self.top, SPACE, event.x, event.y, self.width, self.height)
+        if cell:
+            self.command(*cell)
+
+    def mark(self, x, y, state):
+        self.renderer.itemconfig(self.markers[x][y], fill='white' if state == MISS else 'red', state='normal')
+
+    def show_ship(self, index, cells):
+        (x1, y1), (x2, y2) = cells[0], cells[-1]
+        self.renderer.coords(self.ships[index],
+                             self.left + SPACE * (x1 + 1 / 6), self.top + SPACE * (y1 + 1 / 6),
+                             self.left + SPACE * (x2 + 5 / 6), self.top + SPACE * (y2 + 5 / 6))
+        self.renderer.itemconfig(self.ships[index], state='normal')
+        for x, y in cells:
+            self.renderer.itemconfig(self.pegs[x][y], state='normal')
+
+    def highlight(self, cells, on=True):
+        for x, y in cells:
+            self.renderer.itemconfig(self.dots[x][y], fill='red' if on else self.color)
+
+    def clear(self):
+        self.renderer.itemconfig(self.game, state='hidden')
+
+    def destroy(self):
+        self.canvas.delete(self.tag)
+
+
+class BoardView(tk.Frame):
+    """
+    A board of any size up to MAX_BOARD_SIZE, scrolled with the scrollbars or the mouse wheel
+    and zoomed with control and the mouse wheel. The state of every cell is one byte; only the
+    visible cells have a rectangle on the canvas, and scrolling just recolors them.
+    """
+    COLORS = {EMPTY: 'midnight blue', SHIP: 'grey', MISS: 'white', HIT: 'red', CHOICE: 'orange'}
+
+    def __init__(self, master, width, height, size, command, cell=CELL_SIZE):
+        """
+        :param size: width and height of the view in pixels, scrollbars included
+        :param cell: size of a cell in pixels when not zoomed
+        """
+        super().__init__(master)
+        self.width = width
+        self.height = height
+        self.command = command
+        # the state of cell (x, y) is cells[x * height + y], like engine.Board
+        self.cells = bytearray(width * height)
+        self.cell = cell
+        # the first visible column and row
+        self.left = 0
+        self.top = 0
+        self.columns = 0
+        self.rows = 0
+        self.items = []
+        self.colors = []
+        self.canvas = tk.Canvas(self, highlightthickness=0, bg='black')
+        self.xscrollbar = tk.Scrollbar(self, orient=tk.HORIZONTAL, command=self.xview)
+        self.yscrollbar = tk.Scrollbar(self, command=self.yview)
+        self.canvas.grid(row=0, column=0, sticky='nsew')
+        self.yscrollbar.grid(row=0, column=1, sticky='ns')
+        self.xscrollbar.grid(row=1, column=0, sticky='ew')
+        # whole pixels, so that the number of visible columns and rows is an int
+        self.view_width = int(size) - self.yscrollbar.winfo_reqwidth()
+        self.view_height = int(size) - self.xscrollbar.winfo_reqheight()
+        self.canvas.configure(width=self.view_width, height=self.view_height)
+        self.canvas.bind('<1>', self.click)
+        for sequence in ('<MouseWheel>', '<Button-4>', '<Button-5>', '<Shift-MouseWheel>', '<Shift-Button-4>',
+                         '<Shift-Button-5>', '<Control-MouseWheel>', '<Control-Button-4>', '<Control-Button-5>'):
+            self.canvas.bind(sequence, self.wheel)
+        self.layout()
+
+    def layout(self):
+        """Makes one rectangle for every cell that fits in the view at the current zoom."""
+        self.canvas.delete('cell')
+        self.columns = max(1, min(self.width, self.view_width // self.cell))
+        self.rows = max(1, min(self.height, self.view_height // self.cell))
+        outline = 'black' if self.cell >= 8 else ''
+        self.items = [self.canvas.create_rectangle(i * self.cell, j * self.cell,
+                                                   (i + 1) * self.cell, (j + 1) * self.cell,
+                                                   outline=outline, tags='cell')
+                      for i in range(self.columns) for j in range(self.rows)]
+        self.colors = [None] * len(self.items)
+        self.draw()
+
+    def draw(self):
+        self.left = max(0, min(self.left, self.width - self.columns))
+        self.top = max(0, min(self.top, self.height - self.rows))
+        cells = self.cells
+        colors = self.COLORS
+        itemconfig = self.canvas.itemconfig
+        k = 0
+        for i in range(self.columns):
+            start = (self.left + i) * self.height + self.top
+            for state in cells[start:start + self.rows]:
+                color = colors[state]
+                if self.colors[k] != color:
+                    itemconfig(self.items[k], fill=color)
+                    self.colors[k] = color
+                k += 1
+        self.xscrollbar.set(self.left / self.width, (self.left + self.columns) / self.width)
+        self.yscrollbar.set(self.top / self.height, (self.top + self.rows) / self.height)
+
+    def set(self, x, y, state):
+        self.cells[x * self.height + y] = state
+        i = x - self.left
+        j = y - self.top
+        if 0 <= i < self.columns and 0 <= j < self.rows:
+            k = i * self.rows + j
+            color = self.COLORS[state]
+            if self.colors[k] != color:
+                self.canvas.itemconfig(self.items[k], fill=color)
+                self.colors[k] = color
+
+    def mark(self, x, y, state):
+        self.set(x, y, MISS if state == MISS else HIT)
+
+    def show_ship(self, index, cells):
+        for x, y in cells:
+            self.set(x, y, SHIP)
+
+    def highlight(self, cells, on=True):
+        for x, y in cells:
+            self.set(x, y, CHOICE if on else EMPTY)
+
+    def clear(self):
+        self.cells[:] = bytes(len(self.cells))
+        self.draw()
+
+    def click(self, event):
+        cell = cell_at(0, 0, self.cell, event.x, event.y, self.columns, self.rows)
+        if cell:
+            self.command(self.left + cell[0], self.top + cell[1])
+
+    def _scroll(self, position, action, amount, unit, page, extent):
+        """
+        :param page: the visible columns or rows, extent all of them
+        :return: the first visible column or row after a scrollbar command
+        """
+        if action == tk.MOVETO:
+            return int(float(amount) * extent)
+        if unit == tk.PAGES:
+            return position + int(amount) * page
+        return position + int(amount)
+
+    def xview(self, action, amount, unit=None):
+        self.left = self._scroll(self.left, action, amount, unit, self.columns, self.width)
+        self.draw()
+
+    def yview(self, action, amount, unit=None):
+        self.top = self._scroll(self.top, action, amount, unit, self.rows, self.height)
+        self.draw()
+
+    def wheel(self, event):
+        up = event.num == 4 or event.delta > 0
+        if event.state & 0x4:
+            self.zoom(event.x, event.y, 2 if up else .5)
+            return
+        step = -3 if up else 3
+        if event.state & 0x1:
+            self.left += step
+        else:
+            self.top += step
+        self.draw()
+
+    def zoom(self, x, y, factor):
+        """Zooms keeping the cell under the pointer at (x, y) in place."""
+        cell = max(MIN_CELL_SIZE, min(MAX_CELL_SIZE, int(self.cell * factor)))
+        if cell == self.cell:
+            return
+        column = self.left + x // self.cell
+        row = self.top + y // self.cell
+        self.cell = cell
+        self.left = column - x // cell
+        self.top = row - y // cell
+        self.layout()
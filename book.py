@@ -0,0 +1,244 @@
+"""
+Remembering where the computer shoots.
+
+A position is what ai.ProbabilityShooter works its density out of: the cells ruled out, the hits
+not put down to a sunk ship yet, and the ships left. It is hashed the Zobrist way: every
+(cell, result) pair has a random 64 bit key and the hash of a position is the XOR of the keys of
+its cells, a ruled out cell with MISS and a hit with HIT, and of SUNK of the index of every sunk
+ship in the sorted fleet, so it is updated with a few XORs per shot. Two positions with the same
+hash get the same density whatever order the shots came in. PositionCache keeps the best cells of the most
+recently seen positions, and an opening book written by this module can back it from disk.
+
+The book is sorted records, memory mapped when it is opened, so loading it costs nothing up front:
+    magic 'BSBK' | version | width | height | number of ships | seed (8 bytes) | positions (4 bytes)
+    ship lengths (1 byte each)
+    hashes      (positions x 8 bytes, sorted)
+    offsets     (positions + 1 x 4 bytes) into cells
+    cells       (2 bytes each) the best cells of every position
+all little endian.
+
+Usage: python book.py [--games N] [--depth D] [--out PATH] writes an opening book by playing
+games of ai.ProbabilityShooter against random fleets.
+"""
+import argparse
+import mmap
+import os
+import random
+import struct
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from vars import *
+
+BOOK_MAGIC = b'BSBK'
+BOOK_VERSION = 2
+BOOK_HEADER = struct.Struct('<4sBBBBQI')
+ZOBRIST_SEED = 0x42617474_6c65
+
+
+class Zobrist(object):
+    """The random keys for every (cell, result) of a board size. The same seed always gives the same keys."""
+
+    def __init__(self, width=BOARD_WIDTH, height=BOARD_HEIGHT, seed=ZOBRIST_SEED):
+        self.seed = seed
+        rng = random.Random(seed ^ width << 32 ^ height << 48)
+        self.keys = [rng.getrandbits(64) for _ in range(width * height * 3)]
+
+    def key(self, cell, result):
+        return self.keys[cell * 3 + result]
+
+
+class Book(object):
+    """A read only opening book, memory mapped."""
+
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        try:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # an empty file can not be mapped
+            self.file.close()
+            raise ValueError('%s is not an opening book!' % path)
+        self.hashes = self.offsets = self.cells = None
+        try:
+            magic, version, self.width, self.height, ships, self.seed, count = BOOK_HEADER.unpack_from(self.map)
+            if magic != BOOK_MAGIC or version != BOOK_VERSION:
+                raise ValueError
+            offset = BOOK_HEADER.size
+            self.fleet = tuple(self.map[offset:offset + ships])
+            offset += ships
+            # frombuffer raises ValueError if the file ends too soon
+            self.hashes = np.frombuffer(self.map, dtype='<u8', count=count, offset=offset)
+            offset += count * 8
+            self.offsets = np.frombuffer(self.map, dtype='<u4', count=count + 1, offset=offset)
+            offset += (count + 1) * 4
+            self.cells = np.frombuffer(self.map, dtype='<u2', offset=offset)
+            if count and self.offsets[-1] > len(self.cells):
+                raise ValueError
+        except (struct.error, ValueError):
+            self.close()
+            raise ValueError('%s is not an opening book!' % path)
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def get(self, key):
+        """:return: tuple of the best cells of the position, or None if it is not in the book"""
+        i = int(np.searchsorted(self.hashes, np.uint64(key)))
+        if i == len(self.hashes) or self.hashes[i] != key:
+            return None
+        return tuple(self.cells[self.offsets[i]:self.offsets[i + 1]].tolist())
+
+    def close(self):
+        # the arrays point into the map, they have to go first
+        self.hashes = self.offsets = self.cells = None
+        self.map.close()
+        self.file.close()
+
+
+def write_book(path, positions, width=BOARD_WIDTH, height=BOARD_HEIGHT, fleet=FLEET, seed=ZOBRIST_SEED):
+    """
+    :param positions: dict of hash -> best cells
+    """
+    keys = sorted(positions)
+    offsets = [0]
+    cells = []
+    for key in keys:
+        cells.extend(positions[key])
+        offsets.append(len(cells))
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as f:
+        f.write(BOOK_HEADER.pack(BOOK_MAGIC, BOOK_VERSION, width, height, len(fleet), seed, len(keys)))
+        f.write(bytes(fleet))
+        f.write(np.array(keys, dtype='<u8').tobytes())
+        f.write(np.array(offsets, dtype='<u4').tobytes())
+        f.write(np.array(cells, dtype='<u2').tobytes())
+    os.replace(temporary, path)
+
+
+class PositionCache(object):
+    """
+    The best cells of up to capacity positions, the least recently used one is forgotten first.
+    Positions that are not cached are looked up in the book, if there is one.
+    """
+
+    def __init__(self, capacity=BOOK_CACHE_SIZE, book=None):
+        self.capacity = capacity
+        self.book = book
+        self.entries = OrderedDict()
+        self.lookups = 0
+        self.hits = 0
+        self.book_hits = 0
+        self.lookup_time = 0.0
+
+    def get(self, key):
+        """:return: the best cells of the position, or None if they have to be worked out"""
+        start = time.perf_counter()
+        self.lookups += 1
+        cells = self.entries.get(key)
+        if cells is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+        elif self.book is not None:
+            cells = self.book.get(key)
+            if cells is not None:
+                self.book_hits += 1
+                self.put(key, cells)
+        self.lookup_time += time.perf_counter() - start
+        return cells
+
+    def put(self, key, cells):
+        self.entries[key] = cells
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    def stats(self):
+        lookups = self.lookups or 1
+        return {'lookups': self.lookups,
+                'hits': self.hits,
+                'book_hits': self.book_hits,
+                'hit_rate': (self.hits + self.book_hits) / lookups,
+                'lookup_us': 1e6 * self.lookup_time / lookups,
+                'size': len(self.entries),
+                'book_size': len(self.book) if self.book is not None else 0}
+
+
+_zobrists = {}
+_caches = {}
+
+
+def get_zobrist(width=BOARD_WIDTH, height=BOARD_HEIGHT):
+    """:return: the Zobrist keys for a board size, made the first time they are asked for"""
+    zobrist = _zobrists.get((width, height))
+    if zobrist is None:
+        zobrist = _zobrists[width, height] = Zobrist(width, height)
+    return zobrist
+
+
+def get_cache(width=BOARD_WIDTH, height=BOARD_HEIGHT, fleet=FLEET, path=BOOK_PATH):
+    """
+    :return: the PositionCache shared by every computer player of a game size, backed by the book at
+             path if there is one for the same game
+    """
+    fleet = tuple(fleet)
+    cache = _caches.get((width, height, fleet))
+    if cache is None:
+        book = None
+        if path and os.path.exists(path):
+            try:
+                book = Book(path)
+            except (OSError, ValueError):
+                book = None
+            if book is not None and (book.width, book.height, book.fleet, book.seed) != \
+                    (width, height, fleet, ZOBRIST_SEED):
+                book.close()
+                book = None
+        cache = _caches[width, height, fleet] = PositionCache(book=book)
+    return cache
+
+
+def build(games, depth, width=BOARD_WIDTH, height=BOARD_HEIGHT, fleet=FLEET, seed=None):
+    """
+    Plays games of ai.ProbabilityShooter and keeps the positions of the first depth shots of every game.
+    :return: dict of hash -> best cells
+    """
+    import ai
+    import engine
+
+    rng = random.Random(seed)
+    positions = {}
+    cache = PositionCache(capacity=1 << 62)
+    shooter = ai.ProbabilityShooter(width, height, fleet, rng=rng, cache=cache)
+    for _ in range(games):
+        board = engine.Board(width, height, fleet)
+        board.place_random(rng)
+        shooter.reset()
+        for _ in range(depth):
+            if board.lost:
+                break
+            key = shooter.hash
+            x, y = shooter.next_shot()
+            positions[key] = cache.entries[key]
+            shooter.update(x, y, board.shoot(x, y))
+    return positions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write an opening book for the computer player.')
+    parser.add_argument('--games', type=int, default=2000)
+    parser.add_argument('--depth', type=int, default=12, help='number of shots of every game to keep')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--out', default=BOOK_PATH)
+    args = parser.parse_args()
+    start = time.perf_counter()
+    positions = build(args.games, args.depth, seed=args.seed)
+    write_book(args.out, positions)
+    print('%i positions from %i games in %.1fs, %i bytes' % (len(positions), args.games,
+                                                            time.perf_counter() - start, os.path.getsize(args.out)))
+
+
+if __name__ == '__main__':
+    main()
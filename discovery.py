@@ -0,0 +1,210 @@
+"""
+Finding other players on the network.
+
+Every lobby sends a small beacon with its name, uuid and server port. Beacons are binary:
+    magic 'BS' | version | flags | port (2 bytes) | uuid length | uuid | name
+all in network byte order. The old text beacons ('name\\nuuid\\nport' and 'name\\nCLOSED\\nuuid') are
+still understood, so older versions still show up in the list.
+"""
+import random
+import socket
+import struct
+import time
+from collections import OrderedDict
+
+from vars import *
+
+BEACON_MAGIC = b'BS'
+BEACON_VERSION = 1
+BEACON_HEADER = struct.Struct('!2sBBHB')
+FLAG_CLOSED = 1
+
+
+def encode_beacon(name, uuid, port, closed=False):
+    uuid = uuid.encode()
+    return BEACON_HEADER.pack(BEACON_MAGIC, BEACON_VERSION, FLAG_CLOSED if closed else 0, port, len(uuid)) + \
+        uuid + name.encode()[:255]
+
+
+def encode_text_beacon(name, uuid, port, closed=False):
+    if closed:
+        return ('%s\nCLOSED\n%s' % (name, uuid)).encode()
+    return ('%s\n%s\n%i' % (name, uuid, port)).encode()
+
+
+def decode_beacon(data: bytes):
+    """
+    :return: (name, uuid, port, closed) or None if data is not a beacon
+    """
+    if data[:2] == BEACON_MAGIC:
+        if len(data) < BEACON_HEADER.size:
+            return None
+        _, version, flags, port, length = BEACON_HEADER.unpack_from(data)
+        if version != BEACON_VERSION:
+            return None
+        start = BEACON_HEADER.size
+        try:
+            uuid = data[start:start + length].decode()
+            name = data[start + length:].decode(errors='replace')
+        except UnicodeDecodeError:
+            return None
+        return name, uuid, port, bool(flags & FLAG_CLOSED)
+    try:
+        lines = data.decode().splitlines()
+    except UnicodeDecodeError:
+        return None
+    if len(lines) != 3:
+        return None
+    if lines[1] == 'CLOSED':
+        return lines[0], lines[2], 0, True
+    if not lines[2].isdigit():
+        return None
+    return lines[0], lines[1], int(lines[2]), False
+
+
+def open_listener(port=PORT, group=MULTICAST_GROUP):
+    """:return: a non blocking UDP socket receiving the beacons sent to port"""
+    s = socket.socket(type=socket.SOCK_DGRAM)
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    s.bind(('', port))
+    if group:
+        s.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP,
+                     struct.pack('4s4s', socket.inet_aton(group), socket.inet_aton('0.0.0.0')))
+    s.setblocking(False)
+    return s
+
+
+def open_sender(port=PORT, group=MULTICAST_GROUP):
+    """:return: (UDP socket, address) to send beacons to"""
+    s = socket.socket(type=socket.SOCK_DGRAM)
+    s.bind(('', 0))
+    if group:
+        s.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 1)
+        return s, (group, port)
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+    return s, ('<broadcast>', port)
+
+
+class BeaconSchedule(object):
+    """
+    How long to wait before the next beacon. Beacons start every minimum seconds and the wait doubles
+    after every beacon up to maximum seconds while nothing changes. Every wait is jittered so
+    hundreds of lobbies that start together do not stay in step.
+    """
+
+    def __init__(self, minimum=BEACON_MIN_INTERVAL, maximum=BEACON_MAX_INTERVAL, jitter=BEACON_JITTER, rng=None):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.jitter = jitter
+        self.rng = rng or random.Random()
+        self.interval = minimum
+        self.sent = 0
+
+    def reset(self):
+        """Something changed (like a new player showing up), so go back to beaconing quickly."""
+        self.interval = self.minimum
+
+    def next(self):
+        """:return: seconds to wait after the beacon that was just sent"""
+        self.sent += 1
+        wait = self.interval * (1 + self.rng.uniform(-self.jitter, self.jitter))
+        self.interval = min(self.maximum, self.interval * 2)
+        return wait
+
+    def soon(self):
+        """:return: seconds to wait before a beacon that answers a change, so peers do not answer it together"""
+        return self.rng.uniform(0, self.minimum)
+
+
+class Peer(object):
+    __slots__ = ('name', 'address', 'seen')
+
+    def __init__(self, name, address, seen):
+        self.name = name
+        self.address = address
+        self.seen = seen
+
+
+class PeerTable(object):
+    """
+    Every peer that sent a beacon recently. A peer is forgotten when it says it closed or when
+    nothing was heard from it for ttl seconds, so peers that crashed do not stay listed forever.
+    """
+
+    def __init__(self, ttl=PEER_TTL):
+        self.ttl = ttl
+        # oldest beacon first, so expiring only has to look at the front
+        self.peers = OrderedDict()
+        self.packets = 0
+        self.packets_per_second = 0.0
+        self._window = time.monotonic()
+        self._window_packets = 0
+
+    def __contains__(self, uuid):
+        return uuid in self.peers
+
+    def __getitem__(self, uuid):
+        return self.peers[uuid]
+
+    def __len__(self):
+        return len(self.peers)
+
+    def count(self, now=None):
+        """Counts a received packet for the packets per second figure."""
+        now = time.monotonic() if now is None else now
+        self.packets += 1
+        self._window_packets += 1
+        self._roll(now)
+
+    def _roll(self, now):
+        if now - self._window >= 1:
+            self.packets_per_second = self._window_packets / (now - self._window)
+            self._window = now
+            self._window_packets = 0
+
+    def seen(self, uuid, name, address, now=None):
+        """
+        Records a beacon from a peer.
+        :return: True if the peer is new
+        """
+        now = time.monotonic() if now is None else now
+        peer = self.peers.get(uuid)
+        if peer is None:
+            self.peers[uuid] = Peer(name, address, now)
+            return True
+        peer.name = name
+        peer.address = address
+        peer.seen = now
+        self.peers.move_to_end(uuid)
+        return False
+
+    def remove(self, uuid):
+        """:return: the removed peer or None if it was not known"""
+        return self.peers.pop(uuid, None)
+
+    def expire(self, now=None):
+        """
+        Forgets the peers that were not heard from for ttl seconds.
+        :return: list of the uuids that were forgotten
+        """
+        now = time.monotonic() if now is None else now
+        expired = []
+        for uuid, peer in self.peers.items():
+            if now - peer.seen < self.ttl:
+                break
+            expired.append(uuid)
+        for uuid in expired:
+            del self.peers[uuid]
+        return expired
+
+    def next_expiry(self, now=None):
+        """:return: seconds until the next peer expires, or None if there are no peers"""
+        if not self.peers:
+            return None
+        now = time.monotonic() if now is None else now
+        peer = next(iter(self.peers.values()))
+        return max(0.0, peer.seen + self.ttl - now)
+
+    def stats(self, now=None):
+        self._roll(time.monotonic() if now is None else now)
+        return {'peers': len(self.peers), 'packets': self.packets, 'packets_per_second': self.packets_per_second}
@@ -0,0 +1,307 @@
+"""
+Headless game rules for BattleShip.
+
+Nothing in here imports tkinter, so the same rules can be used by the GUI, the
+computer opponents and the simulators. A board is stored as integer bitboards:
+cell (x, y) is bit ``x * height + y``, the same order as ``boardview.BoardView.cells``.
+"""
+import random
+
+import numpy as np
+
+import placements
+from vars import *
+
+MISS = 0
+HIT = 1
+SUNK = 2
+RESULTS = ('MISS', 'HIT', 'SUNK')
+RESULT_CODES = {name: code for code, name in enumerate(RESULTS)}
+
+
+class Board:
+    """
+    One player's own waters: where the ships are and where the opponent has fired.
+    Shots are resolved in O(1) through a cell -> ship lookup table and per ship hit counters.
+    """
+    __slots__ = ('width', 'height', 'fleet', 'owner', 'ships', 'occupied', 'shots', 'remaining', 'sunk', 'placed')
+
+    def __init__(self, width=BOARD_WIDTH, height=BOARD_HEIGHT, fleet=FLEET):
+        self.width = width
+        self.height = height
+        self.fleet = tuple(fleet)
+        # owner[cell] is 0 for water, otherwise the ship index + 1
+        self.owner = bytearray(width * height)
+        self.ships = [0] * len(self.fleet)
+        self.remaining = list(self.fleet)
+        self.occupied = 0
+        self.shots = 0
+        self.sunk = 0
+        self.placed = 0
+
+    def reset(self):
+        """Clears the ships and the shots so the board can be used for a new game."""
+        self.owner[:] = bytes(len(self.owner))
+        for i in range(len(self.fleet)):
+            self.ships[i] = 0
+            self.remaining[i] = self.fleet[i]
+        self.occupied = 0
+        self.shots = 0
+        self.sunk = 0
+        self.placed = 0
+
+    def cell(self, x, y):
+        return x * self.height + y
+
+    def cells(self, start, end):
+        """
+        Returns the cells covered by a straight ship going from start to end (inclusive).
+        :param start: (x, y) of one end of the ship
+        :param end: (x, y) of the other end of the ship
+        :return: list of (x, y)
+        """
+        x, y = start
+        xe, ye = end
+        if x > xe or y > ye:
+            x, xe = xe, x
+            y, ye = ye, y
+        if x == xe:
+            return [(x, i) for i in range(y, ye + 1)]
+        if y == ye:
+            return [(i, y) for i in range(x, xe + 1)]
+        raise ValueError('Ships must be placed in a straight line!')
+
+    def mask(self, cells):
+        mask = 0
+        for x, y in cells:
+            if not (0 <= x < self.width and 0 <= y < self.height):
+                raise ValueError('(%i, %i) is not on the board!' % (x, y))
+            mask |= 1 << (x * self.height + y)
+        return mask
+
+    def can_place(self, index, cells):
+        return len(cells) == self.fleet[index] and not self.mask(cells) & self.occupied
+
+    def place(self, index, cells):
+        """
+        Puts ship number index of the fleet on the given cells.
+        :param index: index of the ship in the fleet
+        :param cells: list of (x, y) the ship covers
+        :return: the bitmask of the ship
+        """
+        if self.ships[index]:
+            raise ValueError('Ship %i has already been placed!' % index)
+        if len(cells) != self.fleet[index]:
+            raise ValueError('Ship %i is %i long, not %i!' % (index, self.fleet[index], len(cells)))
+        mask = self.mask(cells)
+        if mask & self.occupied:
+            raise ValueError('Ships can not overlap!')
+        self.place_mask(index, mask)
+        return mask
+
+    def place_mask(self, index, mask):
+        """Same as place, but for an already checked bitmask."""
+        self.ships[index] = mask
+        self.occupied |= mask
+        self.placed += 1
+        owner = self.owner
+        ship = index + 1
+        while mask:
+            low = mask & -mask
+            owner[low.bit_length() - 1] = ship
+            mask ^= low
+
+    def place_random(self, rng=random):
+        """
+        Places every ship of the fleet that has not been placed yet at a random legal position.
+        :param rng: a random.Random like object
+        """
+        index = placements.get(self.width, self.height)
+        for ship, length in enumerate(self.fleet):
+            if not self.ships[ship]:
+                self.place_mask(ship, index.mask(length, index.pick(length, self.owner, rng)))
+
+    def ship_cells(self, index):
+        """:return: list of (x, y) of ship number index, in order"""
+        mask = self.ships[index]
+        cells = []
+        while mask:
+            low = mask & -mask
+            cells.append(divmod(low.bit_length() - 1, self.height))
+            mask ^= low
+        return cells
+
+    def holds_ship(self, x, y):
+        return self.owner[x * self.height + y] != 0
+
+    def is_hit(self, x, y):
+        return self.shots >> (x * self.height + y) & 1 == 1
+
+    def shoot(self, x, y):
+        """
+        Resolves a shot from the opponent.
+        :return: MISS, HIT or SUNK
+        """
+        if not (0 <= x < self.width and 0 <= y < self.height):
+            raise ValueError('(%i, %i) is not on the board!' % (x, y))
+        cell = x * self.height + y
+        bit = 1 << cell
+        if self.shots & bit:
+            raise ValueError('(%i, %i) has already been shot!' % (x, y))
+        self.shots |= bit
+        ship = self.owner[cell]
+        if not ship:
+            return MISS
+        ship -= 1
+        self.remaining[ship] -= 1
+        if self.remaining[ship]:
+            return HIT
+        self.sunk += 1
+        return SUNK
+
+    def shoot_salvo(self, shots):
+        """
+        Resolves several shots from the opponent at once, as if they had been fired in order: the
+        shot that takes the last cell of a ship is the one that sinks it. Every shot is looked up at
+        once with NumPy instead of one at a time.
+        :param shots: list of (x, y)
+        :return: list of MISS, HIT or SUNK, one for every shot
+        """
+        if not shots:
+            return []
+        xy = np.array(shots, dtype=np.int64).reshape(-1, 2)
+        x = xy[:, 0]
+        y = xy[:, 1]
+        if ((x < 0) | (x >= self.width) | (y < 0) | (y >= self.height)).any():
+            raise ValueError('A salvo can only hit the board!')
+        cells = x * self.height + y
+        size = len(self.owner)
+        fired = np.unpackbits(np.frombuffer(self.shots.to_bytes((size + 7) // 8, 'little'), dtype=np.uint8),
+                              bitorder='little')
+        new = np.zeros_like(fired)
+        new[cells] = 1
+        if fired[cells].any() or new.sum() != len(cells):
+            raise ValueError('A salvo can not shoot the same cell twice!')
+        self.shots |= int.from_bytes(np.packbits(new, bitorder='little').tobytes(), 'little')
+        owners = np.frombuffer(self.owner, dtype=np.uint8)[cells]
+        results = (owners != 0).astype(np.uint8)
+        hits = np.flatnonzero(owners)
+        ships = owners[hits].astype(np.int64) - 1
+        count = len(self.fleet)
+        taken = np.bincount(ships, minlength=count)
+        remaining = np.array(self.remaining) - taken
+        # the last shot of the salvo on every ship that is gone now
+        last = np.full(count, -1)
+        np.maximum.at(last, ships, hits)
+        sunk = np.flatnonzero((remaining == 0) & (taken > 0))
+        results[last[sunk]] = SUNK
+        self.remaining = remaining.tolist()
+        self.sunk += len(sunk)
+        return results.tolist()
+
+    def ship_at(self, x, y):
+        """Returns the index of the ship at (x, y) or None if there is only water."""
+        ship = self.owner[x * self.height + y]
+        return ship - 1 if ship else None
+
+    def is_sunk(self, index):
+        return self.remaining[index] == 0
+
+    @property
+    def ready(self):
+        return self.placed == len(self.fleet)
+
+    @property
+    def lost(self):
+        return self.sunk == len(self.fleet)
+
+
+class Target:
+    """What a player knows about the opponent's waters: where it fired and what came back."""
+    __slots__ = ('width', 'height', 'fleet', 'shots', 'hits', 'sunk', 'count')
+
+    def __init__(self, width=BOARD_WIDTH, height=BOARD_HEIGHT, fleet=FLEET):
+        self.width = width
+        self.height = height
+        self.fleet = tuple(fleet)
+        self.shots = 0
+        self.hits = 0
+        self.sunk = 0
+        self.count = 0
+
+    def reset(self):
+        self.shots = 0
+        self.hits = 0
+        self.sunk = 0
+        self.count = 0
+
+    def is_hit(self, x, y):
+        return self.shots >> (x * self.height + y) & 1 == 1
+
+    def fire(self, x, y):
+        """
+        Marks (x, y) as fired at.
+        :return: False if (x, y) had already been fired at, True otherwise
+        """
+        bit = 1 << (x * self.height + y)
+        if self.shots & bit:
+            return False
+        self.shots |= bit
+        self.count += 1
+        return True
+
+    def record(self, x, y, result):
+        """Stores the opponent's answer to a shot at (x, y)."""
+        if result != MISS:
+            self.hits |= 1 << (x * self.height + y)
+            if result == SUNK:
+                self.sunk += 1
+
+    @property
+    def won(self):
+        return self.sunk == len(self.fleet)
+
+
+class Game:
+    """
+    Two boards and whose turn it is, following the same rules as a game over the network:
+    a player shoots, gets MISS, HIT or SUNK back and the turn goes to the other player.
+    The game is won when every ship of the opponent has been sunk.
+    """
+    __slots__ = ('boards', 'targets', 'turn', 'winner', 'shots')
+
+    def __init__(self, width=BOARD_WIDTH, height=BOARD_HEIGHT, fleet=FLEET):
+        self.boards = (Board(width, height, fleet), Board(width, height, fleet))
+        self.targets = (Target(width, height, fleet), Target(width, height, fleet))
+        self.turn = 0
+        self.winner = None
+        self.shots = [0, 0]
+
+    def reset(self, turn=0):
+        for board in self.boards:
+            board.reset()
+        for target in self.targets:
+            target.reset()
+        self.turn = turn
+        self.winner = None
+        self.shots[0] = self.shots[1] = 0
+
+    def shoot(self, x, y):
+        """
+        The player whose turn it is shoots at (x, y) on the other player's board.
+        :return: MISS, HIT or SUNK
+        """
+        if self.winner is not None:
+            raise ValueError('The game is over!')
+        player = self.turn
+        target = self.targets[player]
+        if not target.fire(x, y):
+            raise ValueError('(%i, %i) has already been shot!' % (x, y))
+        result = self.boards[1 - player].shoot(x, y)
+        target.record(x, y, result)
+        self.shots[player] += 1
+        if result == SUNK and target.won:
+            self.winner = player
+        else:
+            self.turn = 1 - player
+        return result
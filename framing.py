@@ -0,0 +1,116 @@
+"""
+Message framing for the game connection.
+
+TCP is a stream, so one recv can hold half a message or several of them. Every message is
+sent as a 2 byte big endian length followed by that many bytes of payload, and FrameReader
+cuts the stream back into messages.
+"""
+import socket
+import struct
+
+HEADER = struct.Struct('!H')
+MAX_PAYLOAD = 0xffff
+
+
+def encode_frame(payload: bytes):
+    if len(payload) > MAX_PAYLOAD:
+        raise ValueError('A message can not be longer than %i bytes!' % MAX_PAYLOAD)
+    return HEADER.pack(len(payload)) + payload
+
+
+class FrameReader(object):
+    """
+    Receives into one reusable buffer and hands out complete payloads as memoryviews into it.
+    A payload is only valid until the next call to fill().
+    """
+
+    def __init__(self, size=4096):
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        # unread data is buffer[start:end]
+        self.start = 0
+        self.end = 0
+
+    def fill(self, sock):
+        """
+        Reads whatever the socket has.
+        :return: number of bytes read, 0 when the other side closed the connection
+        """
+        unread = self.end - self.start
+        if not unread:
+            self.start = self.end = 0
+        else:
+            needed = HEADER.size
+            if unread >= HEADER.size:
+                needed += HEADER.unpack_from(self.buffer, self.start)[0]
+            if self.start + needed > len(self.buffer) or self.end == len(self.buffer):
+                self._make_room(max(needed, unread + 1))
+        count = sock.recv_into(self.view[self.end:])
+        self.end += count
+        return count
+
+    def feed(self, data):
+        """Adds bytes that were received some other way."""
+        if self.start == self.end:
+            self.start = self.end = 0
+        if len(self.buffer) - self.end < len(data):
+            self._make_room(self.end - self.start + len(data))
+        self.view[self.end:self.end + len(data)] = data
+        self.end += len(data)
+
+    def _make_room(self, size):
+        """Moves the unread data to the front of the buffer, growing it if it can not hold size bytes."""
+        unread = self.end - self.start
+        if size > len(self.buffer):
+            length = len(self.buffer)
+            while size > length:
+                length *= 2
+            buffer = bytearray(length)
+            buffer[:unread] = self.buffer[self.start:self.end]
+            self.buffer = buffer
+            self.view = memoryview(buffer)
+        else:
+            self.buffer[:unread] = self.buffer[self.start:self.end]
+        self.start = 0
+        self.end = unread
+
+    def frames(self):
+        """Yields every complete payload that has been received."""
+        while self.end - self.start >= HEADER.size:
+            length, = HEADER.unpack_from(self.buffer, self.start)
+            begin = self.start + HEADER.size
+            if self.end - begin < length:
+                return
+            self.start = begin + length
+            yield self.view[begin:begin + length]
+
+
+class Connection(object):
+    """A stream socket that sends and receives framed messages."""
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.reader = FrameReader()
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def send(self, payload: bytes):
+        self.sock.sendall(encode_frame(payload))
+
+    def receive(self):
+        """
+        Reads what the socket has and returns the complete messages. Meant to be called when a
+        selector says the socket is readable.
+        :return: list of payloads as memoryviews, valid until the next call
+        """
+        if not self.reader.fill(self.sock):
+            raise ConnectionResetError('The connection was closed.')
+        return list(self.reader.frames())
+
+    def pending(self):
+        """:return: the complete messages that are already buffered, without reading the socket"""
+        return list(self.reader.frames())
+
+    def close(self):
+        self.sock.close()
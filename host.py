@@ -0,0 +1,192 @@
+"""
+A headless host that runs many games at once.
+
+Players connect to the host like to any other player and send CONNECT. The host keeps them
+waiting until another player speaking the same protocol version shows up, then sends both of
+them GRANTED with the name of their opponent and relays the bytes between them until one of them
+leaves. Both players speak the same version, so relaying is copying; the host never decodes a
+message. The host beacons like a player, so it shows up in every lobby on the network.
+
+Usage: python host.py [--name NAME] [--port PORT] [--board WxH] [--fleet 2,3,3,4,5] [--salvo] [--ask-who-starts] [--quiet]
+"""
+import argparse
+import asyncio
+import time
+import uuid
+
+import discovery
+import protocol
+from vars import *
+
+
+class Match(object):
+    __slots__ = ('id', 'version', 'names', 'writers', 'started', 'relayed')
+
+    def __init__(self, id, version, names, writers):
+        self.id = id
+        self.version = version
+        self.names = names
+        self.writers = writers
+        self.started = time.monotonic()
+        self.relayed = 0
+
+
+class Waiting(object):
+    __slots__ = ('name', 'reader', 'writer', 'paired')
+
+    def __init__(self, name, reader, writer, paired):
+        self.name = name
+        self.reader = reader
+        self.writer = writer
+        # future of the Match, set once paired
+        self.paired = paired
+
+
+class Host(object):
+    def __init__(self, name=HOST_NAME, port=HOST_PORT, settings=protocol.CLASSIC):
+        self.name = name
+        self.port = port
+        self.settings = settings
+        self.uuid = str(uuid.uuid4())
+        # protocol version -> the player waiting for an opponent
+        self.waiting = {}
+        self.matches = {}
+        self.next_id = 0
+        self.played = 0
+        self.relayed = 0
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, port=self.port, backlog=HOST_BACKLOG)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def handle(self, reader, writer):
+        try:
+            data, _ = await protocol.read_handshake(reader, HANDSHAKE_TIMEOUT)
+        except (asyncio.TimeoutError, OSError, ValueError):
+            writer.close()
+            return
+        try:
+            word, fields = protocol.parse_fields(data)
+        except UnicodeDecodeError:
+            word = None
+        if word != 'CONNECT' or 'name' not in fields:
+            writer.close()
+            return
+        version = protocol.choose_version(fields)
+        name = fields['name']
+        other = self.waiting.pop(version, None)
+        if other is None:
+            match = await self.wait(version, Waiting(name, reader, writer,
+                                                     asyncio.get_running_loop().create_future()))
+            if match is not None:
+                await self.relay(reader, match.writers[1], match)
+            return
+        match = self.pair(version, other, Waiting(name, reader, writer, None))
+        await self.relay(reader, other.writer, match)
+
+    async def wait(self, version, player):
+        """:return: the Match once another player came, or None if the player left before that"""
+        self.waiting[version] = player
+        # a waiting player has nothing to say, so anything read means it left
+        left = asyncio.ensure_future(player.reader.read(1))
+        await asyncio.wait((left, player.paired), return_when=asyncio.FIRST_COMPLETED)
+        if player.paired.done():
+            # the read has to be over before the relay reads
+            left.cancel()
+            await asyncio.wait((left,))
+            if not left.cancelled() and left.exception() is None and left.result():
+                player.paired.result().writers[1].write(left.result())
+            return player.paired.result()
+        if self.waiting.get(version) is player:
+            del self.waiting[version]
+        player.writer.close()
+        return None
+
+    def pair(self, version, first, second):
+        """Tells both players who they play; each handler then relays what its player sends."""
+        settings = self.settings if version != protocol.LEGACY else protocol.CLASSIC
+        first.writer.write(protocol.grant(version, settings, second.name))
+        second.writer.write(protocol.grant(version, settings, first.name))
+        match = Match(self.next_id, version, (first.name, second.name), (first.writer, second.writer))
+        self.next_id += 1
+        self.matches[match.id] = match
+        first.paired.set_result(match)
+        return match
+
+    async def relay(self, reader, writer, match):
+        try:
+            while True:
+                data = await reader.read(RELAY_BUFFER)
+                if not data:
+                    break
+                writer.write(data)
+                match.relayed += len(data)
+                await writer.drain()
+        except OSError:
+            pass
+        finally:
+            # one player leaving ends the match for both
+            for other in match.writers:
+                other.close()
+            if self.matches.pop(match.id, None) is not None:
+                self.played += 1
+                self.relayed += match.relayed
+
+    async def advertise(self):
+        s, address = discovery.open_sender()
+        encode = discovery.encode_text_beacon if BEACON_LEGACY else discovery.encode_beacon
+        beacon = encode(self.name, self.uuid, self.port)
+        schedule = discovery.BeaconSchedule()
+        try:
+            while True:
+                s.sendto(beacon, address)
+                await asyncio.sleep(schedule.next())
+        finally:
+            s.sendto(encode(self.name, self.uuid, self.port, closed=True), address)
+            s.close()
+
+    def stats(self):
+        return {'matches': len(self.matches),
+                'waiting': len(self.waiting),
+                'played': self.played,
+                'relayed': self.relayed + sum(match.relayed for match in self.matches.values())}
+
+    async def run(self, report=STATS_INTERVAL):
+        await self.start()
+        advertise = asyncio.ensure_future(self.advertise())
+        try:
+            while True:
+                await asyncio.sleep(report or 3600)
+                if report:
+                    print('%(matches)i matches, %(waiting)i waiting, %(played)i played, %(relayed)i bytes relayed'
+                          % self.stats())
+        finally:
+            advertise.cancel()
+            self.server.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Host many games of battleship at once.')
+    parser.add_argument('--name', default=HOST_NAME)
+    parser.add_argument('--port', type=int, default=HOST_PORT)
+    parser.add_argument('--board', default='%ix%i' % (BOARD_WIDTH, BOARD_HEIGHT))
+    parser.add_argument('--fleet', default=','.join(str(length) for length in FLEET))
+    parser.add_argument('--salvo', action='store_true', help='fire one shot per ship still afloat every turn')
+    parser.add_argument('--ask-who-starts', action='store_true',
+                        help='have the players agree on who starts instead of tossing a coin')
+    parser.add_argument('--quiet', action='store_true', help='do not print how many games are going on')
+    args = parser.parse_args()
+    try:
+        settings = protocol.parse_settings(args.board, args.fleet, args.salvo, not args.ask_who_starts)
+    except ValueError as e:
+        parser.error(str(e))
+    host = Host(args.name, args.port, settings)
+    try:
+        asyncio.run(host.run(0 if args.quiet else STATS_INTERVAL))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
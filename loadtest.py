@@ -0,0 +1,412 @@
+"""
+Load testing the network code with bots instead of people.
+
+A bot plays like the game window, message for message, without a window:
+- it places its fleet at random;
+- it tosses for who starts with COMMIT/REVEAL, or agrees on it with CHOOSE/APPLY;
+- it fires with ai.HuntShooter and answers shots with engine.Board;
+- it asks for rematches, and says CLOSED when it leaves.
+
+Half of the bots listen like Server and beacon to the lobby port like Broadcast. The others find
+them from their beacons, the way Client does, and challenge them with CONNECT. With --target every
+bot challenges that address instead, like the players of a host.py, or a peer that is listening.
+
+At the end it reports:
+- how long connecting took;
+- percentiles of the round trip of every shot;
+- messages per second;
+- how many games the bots finished, and what failed.
+
+Usage: python loadtest.py [--bots N] [--games G] [--protocol 0|1|2] [--target HOST:PORT] [--beacon-port PORT]
+                          [--board WxH] [--fleet 2,3,3,4,5] [--salvo] [--ask-who-starts]
+"""
+import argparse
+import asyncio
+import random
+import time
+import uuid
+from collections import Counter, deque
+
+import numpy as np
+
+import ai
+import discovery
+import engine
+import framing
+import protocol
+from vars import *
+
+
+class Stats(object):
+    def __init__(self):
+        # seconds from dialling to GRANTED, and from SHOOT or SALVO to the answer
+        self.connects = []
+        self.round_trips = []
+        self.sent = 0
+        self.received = 0
+        # games finished by a bot, a game between two bots counts twice
+        self.played = 0
+        self.failures = Counter()
+
+    def report(self, elapsed):
+        def percentiles(values):
+            if not values:
+                return {}
+            return {'p%i' % p: 1000 * float(v) for p, v in zip((50, 90, 99, 100),
+                                                                np.percentile(values, (50, 90, 99, 100)))}
+
+        return {'seconds': elapsed, 'played': self.played, 'connects': len(self.connects),
+                'connect_ms': percentiles(self.connects), 'round_trip_ms': percentiles(self.round_trips),
+                'turns': len(self.round_trips), 'messages_per_second': (self.sent + self.received) / elapsed,
+                'failures': dict(self.failures)}
+
+
+class Bot(object):
+    """One player, from GRANTED to CLOSED."""
+
+    def __init__(self, name, stats, games, rng):
+        self.name = name
+        self.stats = stats
+        self.games = games
+        self.rng = rng
+        self.reader = None
+        self.writer = None
+        self.version = None
+        self.codec = None
+        self.frames = framing.FrameReader()
+        # messages that came in but were not asked for yet
+        self.inbox = deque()
+        self.opponent = None
+
+    def send(self, *message):
+        data = self.codec.encode(message)
+        self.writer.write(data if self.version == protocol.LEGACY else framing.encode_frame(data))
+        self.stats.sent += 1
+
+    def feed(self, data):
+        if self.version == protocol.LEGACY:
+            messages = self.codec.messages(data)
+        else:
+            self.frames.feed(data)
+            messages = [message for payload in self.frames.frames() for message in self.codec.messages(payload)]
+        self.stats.received += len(messages)
+        self.inbox.extend(messages)
+
+    async def expect(self, *words):
+        """
+        :return: the next message, which has to be one of words
+        :raise ValueError: if it is another one, ConnectionResetError if the other side left
+        """
+        while not self.inbox:
+            data = await asyncio.wait_for(self.reader.read(RELAY_BUFFER), BOT_TIMEOUT)
+            if not data:
+                raise ConnectionResetError('The connection was closed.')
+            self.feed(data)
+        message = self.inbox.popleft()
+        if message[0] == 'CLOSED':
+            raise ConnectionResetError('%s left.' % self.opponent)
+        if message[0] not in words:
+            raise ValueError('Expected %s, got %r' % ('/'.join(words), message))
+        return message
+
+    async def play(self, reader, writer, version, settings, opponent, rest=b''):
+        """Plays self.games games with the rematches in between, and then leaves."""
+        self.reader = reader
+        self.writer = writer
+        self.version = version
+        self.codec = protocol.CODECS[version]()
+        self.opponent = opponent
+        if rest:
+            self.feed(rest)
+        try:
+            for game in range(self.games):
+                if game:
+                    self.send('REMATCH')
+                    await self.expect('REMATCH')
+                await self.game(*settings)
+                self.stats.played += 1
+            self.send('CLOSED')
+        except asyncio.TimeoutError:
+            self.stats.failures['timeout'] += 1
+        except ConnectionError:
+            self.stats.failures['closed'] += 1
+        except (ValueError, KeyError, IndexError, UnicodeDecodeError):
+            self.stats.failures['protocol'] += 1
+        finally:
+            writer.close()
+
+    async def game(self, width, height, fleet, salvo, toss):
+        board = engine.Board(width, height, fleet)
+        board.place_random(self.rng)
+        target = engine.Target(width, height, fleet)
+        shooter = ai.HuntShooter(width, height, fleet, rng=self.rng)
+        our_turn = await (self.toss() if toss else self.choose())
+        while True:
+            if our_turn:
+                if salvo:
+                    afloat = sum(not board.is_sunk(index) for index in range(len(fleet)))
+                    cells = shooter.next_salvo(min(afloat, width * height - target.count))
+                    for x, y in cells:
+                        target.fire(x, y)
+                    sent = time.perf_counter()
+                    self.send('SALVO', *[coordinate for cell in cells for coordinate in cell])
+                    results = (await self.expect('RESULTS'))[1:]
+                    if len(results) != len(cells):
+                        raise ValueError('%i results for %i shots!' % (len(results), len(cells)))
+                else:
+                    cells = [shooter.next_shot()]
+                    target.fire(*cells[0])
+                    sent = time.perf_counter()
+                    self.send('SHOOT', *cells[0])
+                    results = (await self.expect('SHOT'))[1:2]
+                self.stats.round_trips.append(time.perf_counter() - sent)
+                for (x, y), result in zip(cells, results):
+                    result = engine.RESULT_CODES[result]
+                    shooter.update(x, y, result)
+                    target.record(x, y, result)
+                if target.won:
+                    return
+            else:
+                message = await self.expect('SALVO' if salvo else 'SHOOT')
+                shots = [(int(x), int(y)) for x, y in zip(message[1::2], message[2::2])]
+                results = board.shoot_salvo(shots) if salvo else [board.shoot(*shots[0])]
+                self.send('RESULTS' if salvo else 'SHOT', *[engine.RESULTS[result] for result in results])
+                if board.lost:
+                    return
+            our_turn = not our_turn
+
+    async def toss(self):
+        """:return: True if we start, after COMMIT and REVEAL both ways, see protocol.CoinToss"""
+        toss = protocol.CoinToss()
+        self.send('COMMIT', toss.commitment)
+        toss.commit((await self.expect('COMMIT'))[1])
+        self.send('REVEAL', toss.nonce)
+        toss.revealed = True
+        toss.reveal((await self.expect('REVEAL'))[1])
+        return toss.we_start()
+
+    async def choose(self):
+        """
+        :return: True if we start, after agreeing on it like WhoStartsDialog: both CHOOSE the
+                 name that sorts first of the names they know, and go with the other's choice if it
+                 sorts before theirs (a LEGACY GRANTED from a host does not say who the opponent
+                 is). The player with that name asks for it with APPLY and the other approves
+        """
+        starter = min(self.name, self.opponent)
+        self.send('CHOOSE', starter)
+        while True:
+            choice = (await self.expect('CHOOSE'))[1]
+            if choice == starter:
+                break
+            if choice < starter:
+                starter = choice
+                self.send('CHOOSE', starter)
+                break
+        if self.name == starter:
+            self.send('APPLY', starter)
+            while (await self.expect('APPLY', 'CHOOSE'))[1:] != ['APPROVED']:
+                # DENIED or the other side changed its mind, ask again
+                self.send('APPLY', starter)
+        else:
+            while (await self.expect('APPLY'))[1] != starter:
+                self.send('APPLY', 'DENIED')
+            self.send('APPLY', 'APPROVED')
+        return self.name == starter
+
+
+def connect_request(name, versions):
+    """Like protocol.connect_request; LEGACY alone offers nothing and sends no HANDSHAKE_END, like old peers."""
+    if versions == [protocol.LEGACY]:
+        return ('CONNECT\nname=%s' % name).encode()
+    return protocol.connect_request(name, versions)
+
+
+async def challenge(host, port, name, versions, stats, games, rng):
+    """Connects like Client and plays the games GRANTED settles on."""
+    start = time.perf_counter()
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), HANDSHAKE_TIMEOUT)
+    except (OSError, asyncio.TimeoutError):
+        stats.failures['refused'] += 1
+        return
+    try:
+        writer.write(connect_request(name, versions))
+        # the host of a match keeps us waiting for an opponent
+        if versions == [protocol.LEGACY]:
+            # like old peers, which take the first read as all of GRANTED
+            data = await asyncio.wait_for(reader.read(RELAY_BUFFER), BOT_TIMEOUT)
+            data, rest = protocol.split_handshake(data, True)
+        else:
+            data, rest = await protocol.read_handshake(reader, BOT_TIMEOUT)
+        version = protocol.granted_version(data) if data else None
+    except (OSError, asyncio.TimeoutError, ValueError, UnicodeDecodeError):
+        version = None
+    if version is None:
+        stats.failures['declined'] += 1
+        writer.close()
+        return
+    stats.connects.append(time.perf_counter() - start)
+    _, fields = protocol.parse_fields(data)
+    settings = protocol.game_settings(fields) if version != protocol.LEGACY else protocol.CLASSIC
+    await Bot(name, stats, games, rng).play(reader, writer, version, settings, fields.get('name', 'Opponent'), rest)
+
+
+class Listener(object):
+    """A bot that waits for one challenge like Server, beaconing while it does."""
+
+    def __init__(self, name, stats, games, rng, settings, beacon_port):
+        self.name = name
+        self.uuid = str(uuid.uuid4())
+        self.stats = stats
+        self.games = games
+        self.rng = rng
+        self.settings = settings
+        self.beacon_port = beacon_port
+        self.server = None
+        self.port = None
+        self.done = asyncio.get_running_loop().create_future()
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, '127.0.0.1', 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def beacon(self, sock):
+        schedule = discovery.BeaconSchedule(rng=self.rng)
+        address = ('127.0.0.1', self.beacon_port)
+        try:
+            while not self.done.done():
+                sock.sendto(discovery.encode_beacon(self.name, self.uuid, self.port), address)
+                await asyncio.wait((self.done,), timeout=schedule.next())
+        finally:
+            sock.sendto(discovery.encode_beacon(self.name, self.uuid, self.port, closed=True), address)
+
+    async def handle(self, reader, writer):
+        if self.server.is_serving():
+            # one game at a time, like the game window
+            self.server.close()
+        else:
+            writer.close()
+            return
+        try:
+            data, _ = await protocol.read_handshake(reader, HANDSHAKE_TIMEOUT)
+            word, fields = protocol.parse_fields(data)
+        except (OSError, asyncio.TimeoutError, ValueError):
+            word = None
+        if word != 'CONNECT' or 'name' not in fields:
+            self.stats.failures['handshake'] += 1
+            writer.close()
+            self.done.set_result(None)
+            return
+        version = protocol.choose_version(fields)
+        settings = self.settings if version != protocol.LEGACY else protocol.CLASSIC
+        writer.write(protocol.grant(version, settings))
+        await Bot(self.name, self.stats, self.games, self.rng).play(reader, writer, version, settings, fields['name'])
+        self.done.set_result(None)
+
+
+class Lobby(asyncio.DatagramProtocol):
+    """Takes the beacons in like Client: every lobby that shows up is put on found once."""
+
+    def __init__(self):
+        self.table = discovery.PeerTable()
+        self.found = asyncio.Queue()
+
+    def datagram_received(self, data, address):
+        beacon = discovery.decode_beacon(data)
+        if beacon is None:
+            return
+        name, uuid, port, closed = beacon
+        if closed:
+            self.table.remove(uuid)
+        elif uuid not in self.table:
+            self.table.seen(uuid, name, (address[0], port))
+            self.found.put_nowait(uuid)
+        else:
+            self.table.seen(uuid, name, (address[0], port))
+
+
+async def run(bots=100, games=1, versions=protocol.SUPPORTED, target=None, beacon_port=PORT,
+              settings=(BOARD_WIDTH, BOARD_HEIGHT, FLEET, False, True),
+              seed=None):
+    """
+    Lets bots bots play games games each at the same time.
+    :param target: (host, port) every bot challenges, or None for half of the bots to challenge the other half
+                   (an odd one out sits out)
+    :param settings: (width, height, fleet, salvo, toss) the listening bots grant, a target picks its own
+    :return: Stats.report
+    """
+    stats = Stats()
+    rng = random.Random(seed)
+    versions = list(versions)
+    start = time.perf_counter()
+    if target:
+        await asyncio.gather(*[challenge(target[0], target[1], 'Bot %i' % i, versions, stats, games,
+                                         random.Random(rng.random()))
+                               for i in range(bots)])
+        return stats.report(time.perf_counter() - start)
+    loop = asyncio.get_running_loop()
+    transport, lobby = await loop.create_datagram_endpoint(Lobby, sock=discovery.open_listener(beacon_port, None))
+    sender = discovery.open_sender(beacon_port, None)[0]
+    sender.setblocking(False)
+    listeners = [Listener('Listener %i' % i, stats, games, random.Random(rng.random()), settings, beacon_port)
+                 for i in range(bots // 2)]
+    for listener in listeners:
+        await listener.start()
+    beacons = [asyncio.ensure_future(listener.beacon(sender)) for listener in listeners]
+
+    async def challenger(i):
+        # the next lobby nobody challenged yet
+        peer = lobby.table[await asyncio.wait_for(lobby.found.get(), BOT_TIMEOUT)]
+        await challenge(peer.address[0], peer.address[1], 'Challenger %i' % i, versions, stats, games,
+                        random.Random(rng.random()))
+
+    try:
+        results = await asyncio.gather(*[challenger(i) for i in range(bots // 2)], return_exceptions=True)
+        for result in results:
+            if isinstance(result, asyncio.TimeoutError):
+                stats.failures['not found'] += 1
+        await asyncio.wait([listener.done for listener in listeners], timeout=BOT_TIMEOUT)
+    finally:
+        for listener in listeners:
+            listener.server.close()
+            if not listener.done.done():
+                listener.done.set_result(None)
+        await asyncio.gather(*beacons, return_exceptions=True)
+        transport.close()
+        sender.close()
+    return stats.report(time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the network code with bots.')
+    parser.add_argument('--bots', type=int, default=100, help='number of bots playing at the same time')
+    parser.add_argument('--games', type=int, default=1, help='games every match plays, with rematches in between')
+    parser.add_argument('--protocol', default=','.join(str(version) for version in protocol.SUPPORTED),
+                        help='versions the challengers offer, 0 for LEGACY')
+    parser.add_argument('--target', metavar='HOST:PORT', help='challenge a host.py or a peer instead of each other')
+    parser.add_argument('--beacon-port', type=int, default=PORT)
+    parser.add_argument('--board', default='%ix%i' % (BOARD_WIDTH, BOARD_HEIGHT))
+    parser.add_argument('--fleet', default=','.join(str(length) for length in FLEET))
+    parser.add_argument('--salvo', action='store_true')
+    parser.add_argument('--ask-who-starts', action='store_true')
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+    try:
+        settings = protocol.parse_settings(args.board, args.fleet, args.salvo, not args.ask_who_starts)
+        versions = [int(version) for version in args.protocol.split(',')]
+        target = None
+        if args.target:
+            host, _, port = args.target.rpartition(':')
+            target = (host or '127.0.0.1', int(port))
+    except ValueError as e:
+        parser.error(str(e))
+    report = asyncio.run(run(args.bots, args.games, versions, target, args.beacon_port, settings, args.seed))
+    print('%(played)i games finished in %(seconds).2fs, %(connects)i connected, %(turns)i turns, '
+          '%(messages_per_second).0f messages/s' % report)
+    for name in ('connect_ms', 'round_trip_ms'):
+        print('%s: %s' % (name, ', '.join('%s=%.2f' % item for item in report[name].items())))
+    print('failures: %s' % (', '.join('%s=%i' % item for item in sorted(report['failures'].items())) or 'none'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,211 @@
+"""
+The list of players in the lobby, and of the players who challenged us.
+
+Only the rows that fit in the window exist as canvas items; scrolling just changes their text.
+Updates from the network thread are queued and applied on the Tk thread LOBBY_FPS times a second.
+"""
+import bisect
+import queue
+import tkinter as tk
+
+from vars import *
+
+
+class PeerListView(tk.Frame):
+    def __init__(self, master, command, stats=None, rows=LOBBY_ROWS, row_height=LOBBY_ROW_HEIGHT, width=LOBBY_WIDTH):
+        """
+        :param command: called with the uuid of a player when it gets clicked
+        :param stats: optional function returning a dict with packets_per_second, shown under the list
+        """
+        super().__init__(master)
+        self.command = command
+        self.stats = stats
+        self.rows = rows
+        self.row_height = row_height
+        self.updates = queue.Queue()
+        # every player as (lower case name, uuid, name), sorted
+        self.everyone = []
+        # uuid -> its row in everyone
+        self.known = {}
+        # the players matching the filter, sorted
+        self.matching = []
+        self.query = ''
+        self.top = 0
+        self.after_id = None
+
+        self.filter = tk.StringVar()
+        self.filter.trace_add('write', lambda *args: self.set_query(self.filter.get()))
+        tk.Entry(self, textvariable=self.filter).pack(fill=tk.X, padx=5, pady=5)
+        box = tk.Frame(self)
+        self.canvas = tk.Canvas(box, width=width, height=rows * row_height, highlightthickness=0)
+        self.scrollbar = tk.Scrollbar(box, command=self.yview)
+        self.canvas.pack(side=tk.LEFT)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        box.pack(padx=5, pady=5)
+        self.status = tk.Label(self)
+        self.status.pack()
+        self.items = [self.canvas.create_text(5, row_height * (i + .5), anchor='w') for i in range(rows)]
+        self.canvas.bind('<1>', self.click)
+        for sequence in ('<MouseWheel>', '<Button-4>', '<Button-5>'):
+            self.canvas.bind(sequence, self.wheel)
+        self.flush()
+
+    # called from any thread
+    def add(self, uuid, name):
+        self.updates.put((True, uuid, name))
+
+    def remove(self, uuid):
+        self.updates.put((False, uuid, None))
+
+    # everything below runs on the Tk thread
+    def flush(self):
+        """Applies every queued update at once and redraws if anything changed."""
+        changed = False
+        names = {}
+        while True:
+            try:
+                added, uuid, name = self.updates.get_nowait()
+            except queue.Empty:
+                break
+            changed = True
+            if added:
+                names[uuid] = name
+            else:
+                names.pop(uuid, None)
+                self._discard(uuid)
+        for uuid, name in names.items():
+            self._discard(uuid)
+            row = (name.lower(), uuid, name)
+            self.known[uuid] = row
+            bisect.insort(self.everyone, row)
+            if self.query in row[0]:
+                bisect.insort(self.matching, row)
+        if changed:
+            self.draw()
+        self.show_status()
+        self.after_id = self.after(1000 // LOBBY_FPS, self.flush)
+
+    def _discard(self, uuid):
+        row = self.known.pop(uuid, None)
+        if row is None:
+            return
+        for rows in (self.everyone, self.matching):
+            i = bisect.bisect_left(rows, row)
+            if i < len(rows) and rows[i] == row:
+                del rows[i]
+
+    def set_query(self, query):
+        query = query.lower()
+        # a longer query can only match fewer players, so only the current matches need checking
+        rows = self.matching if query.startswith(self.query) else self.everyone
+        self.matching = [row for row in rows if query in row[0]]
+        self.query = query
+        self.top = 0
+        self.draw()
+
+    def draw(self):
+        self.top = max(0, min(self.top, len(self.matching) - self.rows))
+        for i, item in enumerate(self.items):
+            index = self.top + i
+            self.canvas.itemconfig(item, text=self.matching[index][2] if index < len(self.matching) else '')
+        if self.matching:
+            self.scrollbar.set(self.top / len(self.matching), min(1, (self.top + self.rows) / len(self.matching)))
+        else:
+            self.scrollbar.set(0, 1)
+
+    def show_status(self):
+        text = '%i of %i players' % (len(self.matching), len(self.everyone))
+        if self.stats:
+            text += ', %.0f packets/s' % self.stats()['packets_per_second']
+        if self.status['text'] != text:
+            self.status['text'] = text
+
+    def yview(self, action, amount, unit=None):
+        if action == tk.MOVETO:
+            self.top = int(float(amount) * len(self.matching))
+        elif unit == tk.PAGES:
+            self.top += int(amount) * self.rows
+        else:
+            self.top += int(amount)
+        self.draw()
+
+    def wheel(self, event):
+        if event.num == 4 or event.delta > 0:
+            self.top -= 3
+        else:
+            self.top += 3
+        self.draw()
+
+    def click(self, event):
+        index = self.top + int(event.y // self.row_height)
+        if index < len(self.matching):
+            self.command(self.matching[index][1])
+
+    def destroy(self):
+        if self.after_id:
+            self.after_cancel(self.after_id)
+            self.after_id = None
+        super().destroy()
+
+
+class ChallengeListView(tk.Frame):
+    """The players waiting for an answer to their challenge, oldest first."""
+
+    def __init__(self, master, accept, decline, rows=CHALLENGE_ROWS, width=LOBBY_WIDTH):
+        """
+        :param accept: called with the key of the selected challenge when it gets accepted, decline likewise
+        """
+        super().__init__(master)
+        self.accept = accept
+        self.decline = decline
+        self.updates = queue.Queue()
+        # the keys of the challenges in the order they are listed
+        self.keys = []
+        self.after_id = None
+        tk.Label(self, text='Challenges').pack()
+        self.listbox = tk.Listbox(self, height=rows, width=width // 8, activestyle='none')
+        self.listbox.pack(padx=5)
+        self.listbox.bind('<Double-1>', lambda event: self.answer(self.accept))
+        buttons = tk.Frame(self)
+        tk.Button(buttons, text='Accept', command=lambda: self.answer(self.accept)).pack(side=tk.LEFT, padx=5)
+        tk.Button(buttons, text='Decline', command=lambda: self.answer(self.decline)).pack(side=tk.LEFT, padx=5)
+        buttons.pack(pady=5)
+        self.flush()
+
+    # called from any thread
+    def add(self, key, name):
+        self.updates.put((True, key, name))
+
+    def remove(self, key):
+        self.updates.put((False, key, None))
+
+    # everything below runs on the Tk thread
+    def flush(self):
+        while True:
+            try:
+                added, key, name = self.updates.get_nowait()
+            except queue.Empty:
+                break
+            if added:
+                self.keys.append(key)
+                self.listbox.insert(tk.END, name)
+            elif key in self.keys:
+                i = self.keys.index(key)
+                del self.keys[i]
+                self.listbox.delete(i)
+        self.after_id = self.after(1000 // LOBBY_FPS, self.flush)
+
+    def answer(self, command):
+        selected = self.listbox.curselection()
+        if not selected:
+            return
+        i = selected[0]
+        key = self.keys.pop(i)
+        self.listbox.delete(i)
+        command(key)
+
+    def destroy(self):
+        if self.after_id:
+            self.after_cancel(self.after_id)
+            self.after_id = None
+        super().destroy()
@@ -0,0 +1,169 @@
+"""
+Every legal placement of a ship on an empty board, numbered so they never have to be listed.
+
+For a ship of some length the placements along x come first, numbered like their first cell
+(x * height + y), followed by the ones along y, numbered row by row over a width x (height - length + 1)
+grid. The number of a placement gives its first cell and direction with a divmod, and its bitmask
+is the mask of the ship at cell 0 shifted to that cell. The numbering is the same as the order of
+ai.ProbabilityShooter's valid arrays once flattened.
+
+Usage: python placements.py runs the layouts per second benchmarks.
+"""
+import random
+import time
+
+import numpy as np
+
+from vars import *
+
+# how many random placements are tried before looking at all of them at once
+PROBES = 16
+
+_indexes = {}
+
+
+def get(width=BOARD_WIDTH, height=BOARD_HEIGHT):
+    """:return: the PlacementIndex for a board size, made the first time it is asked for"""
+    index = _indexes.get((width, height))
+    if index is None:
+        index = _indexes[width, height] = PlacementIndex(width, height)
+    return index
+
+
+class PlacementIndex(object):
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        # length -> (mask of a ship along x starting at cell 0, the same along y)
+        self._runs = {}
+        # length -> (n, length) array of the cells of every placement, made when first needed
+        self._cells = {}
+
+    def across(self, length):
+        """:return: number of placements along x"""
+        return max(0, self.width - length + 1) * self.height
+
+    def down(self, length):
+        """:return: number of placements along y, none for ships of length 1 which would be counted twice"""
+        return self.width * max(0, self.height - length + 1) if length > 1 else 0
+
+    def count(self, length):
+        return self.across(length) + self.down(length)
+
+    def origin(self, length, i):
+        """:return: (first cell, step to the next cell) of placement i"""
+        across = self.across(length)
+        if i < across:
+            return i, self.height
+        x, y = divmod(i - across, self.height - length + 1)
+        return x * self.height + y, 1
+
+    def mask(self, length, i):
+        runs = self._runs.get(length)
+        if runs is None:
+            runs = self._runs[length] = (sum(1 << (k * self.height) for k in range(length)), (1 << length) - 1)
+        cell, step = self.origin(length, i)
+        return runs[step == 1] << cell
+
+    def cells(self, length):
+        """:return: (count(length), length) int array with the cells every placement covers"""
+        cells = self._cells.get(length)
+        if cells is None:
+            offsets = np.arange(length)
+            x, y = np.divmod(np.arange(self.across(length)), self.height)
+            across = (x * self.height + y)[:, None] + offsets * self.height
+            x, y = np.divmod(np.arange(self.down(length)), self.height - length + 1)
+            down = (x * self.height + y)[:, None] + offsets
+            cells = self._cells[length] = np.concatenate((across, down)).astype(np.int32)
+        return cells
+
+    def pick(self, length, taken, rng=random):
+        """
+        Picks one placement that does not cover a taken cell, uniformly among all of those.
+        A few random placements are tried first, which almost always works on boards that are
+        not crowded; otherwise every placement is checked at once with NumPy.
+        :param taken: bytearray with a non zero byte for every taken cell, like engine.Board.owner
+        :return: the number of the placement
+        :raise ValueError: if the ship does not fit anywhere
+        """
+        count = self.count(length)
+        for _ in range(PROBES):
+            i = rng.randrange(count)
+            cell, step = self.origin(length, i)
+            for k in range(cell, cell + step * length, step):
+                if taken[k]:
+                    break
+            else:
+                return i
+        free = np.flatnonzero(~np.frombuffer(taken, dtype=np.uint8)[self.cells(length)].any(axis=1))
+        if not free.size:
+            raise ValueError('There is no room left for a %i long ship!' % length)
+        return int(free[rng.randrange(free.size)])
+
+    def sample(self, fleet, rng=random, taken=None):
+        """
+        Places a whole fleet, every ship uniformly among the spots the ships before it left free.
+        :param taken: cells that can not be used, marked in place as ships are placed
+        :return: list of the masks of the ships
+        """
+        taken = bytearray(self.width * self.height) if taken is None else taken
+        masks = []
+        for index, length in enumerate(fleet):
+            i = self.pick(length, taken, rng)
+            cell, step = self.origin(length, i)
+            for k in range(cell, cell + step * length, step):
+                taken[k] = index + 1
+            masks.append(self.mask(length, i))
+        return masks
+
+
+def benchmark(seconds=1.):
+    """
+    Counts the random fleet layouts made per second for a few board sizes: one at a time with the
+    index, 1000 at a time by simulator.place_fleets (which keeps at most 127 ships in an int8), and
+    by the old way of listing every free placement for every ship (too slow for the big board).
+    :return: list of (width, height, number of ships, index, batch or None, listing or None layouts per second)
+    """
+    import simulator
+
+    def rate(make):
+        count = 0
+        end = time.perf_counter() + seconds
+        while time.perf_counter() < end:
+            count += make()
+        return count / seconds
+
+    def listing(width, height, fleet):
+        occupied = 0
+        for length in fleet:
+            options = []
+            for x in range(width):
+                for y in range(height):
+                    if x + length <= width:
+                        mask = sum(1 << ((x + i) * height + y) for i in range(length))
+                        if not mask & occupied:
+                            options.append(mask)
+                    if length > 1 and y + length <= height:
+                        mask = sum(1 << (x * height + y + i) for i in range(length))
+                        if not mask & occupied:
+                            options.append(mask)
+            occupied |= random.choice(options)
+        return 1
+
+    results = []
+    for width, height, fleet in ((BOARD_WIDTH, BOARD_HEIGHT, FLEET), (50, 50, FLEET * 10), (200, 200, FLEET * 40)):
+        index = get(width, height)
+        index.sample(fleet)
+        fast = rate(lambda: len(index.sample(fleet)) and 1)
+        batch = rate(lambda: len(simulator.place_fleets(1000, width, height, fleet))) if len(fleet) < 128 else None
+        slow = rate(lambda: listing(width, height, fleet)) if width * height <= 2500 else None
+        results.append((width, height, len(fleet), fast, batch, slow))
+    return results
+
+
+if __name__ == '__main__':
+    print('%-9s %6s %14s %14s %14s' % ('board', 'ships', 'index/s', 'batch/s', 'listing/s'))
+    for width, height, ships, fast, batch, slow in benchmark():
+        print('%-9s %6i %14.0f %14s %14s' % ('%ix%i' % (width, height), ships, fast,
+                                            '-' if batch is None else '%.0f' % batch,
+                                            '-' if slow is None else '%.0f' % slow))
@@ -0,0 +1,433 @@
+"""
+The messages two players send each other during a game, and how they are put on the wire.
+
+A message is a list: the name of the message followed by its arguments, like ['SHOOT', 3, 4],
+['SHOT', 'HIT'], ['CHOOSE', 'Bob'], ['APPLY', 'APPROVED'], ['REMATCH'] or ['CLOSED']. In a salvo
+game all the shots of a turn go in one ['SALVO', x1, y1, x2, y2, ...] and come back as one
+['RESULTS', 'MISS', 'HIT', ...]; LEGACY peers only play the classic game, so never see those.
+Who starts is tossed for with ['COMMIT', hash] and ['REVEAL', nonce], see CoinToss, unless the
+host asked for the CHOOSE/APPLY dialog.
+
+There are three versions of the wire format, picked during the CONNECT/GRANTED handshake:
+    LEGACY  the text of the message, unframed, for peers from before the handshake said anything about it
+    TEXT    the text of the message, framed by framing.Connection
+    BINARY  an opcode byte and packed arguments, framed by framing.Connection
+
+Usage: python protocol.py runs the encode/decode micro benchmarks.
+"""
+import asyncio
+import hashlib
+import os
+import struct
+import timeit
+
+import engine
+import framing
+from vars import *
+
+LEGACY = 0
+TEXT = 1
+BINARY = 2
+SUPPORTED = (TEXT, BINARY)
+
+# kinds of arguments a message can have
+NOTHING = 0
+COORDINATES = 1
+RESULT = 2
+WORD = 3
+# any number of coordinates, any number of results
+CELLS = 4
+RESULT_LIST = 5
+
+# name -> (opcode, kind of arguments)
+MESSAGES = {'SHOOT': (1, COORDINATES),
+            'SHOT': (2, RESULT),
+            'CHOOSE': (3, WORD),
+            'APPLY': (4, WORD),
+            'CLOSED': (5, NOTHING),
+            'REMATCH': (6, NOTHING),
+            'SALVO': (7, CELLS),
+            'RESULTS': (8, RESULT_LIST),
+            'COMMIT': (9, WORD),
+            'REVEAL': (10, WORD)}
+NAMES = {code: name for name, (code, kind) in MESSAGES.items()}
+# LegacyCodec tells messages apart by these, which is why it has no SALVO or RESULTS
+ARGUMENTS = {NOTHING: 0, COORDINATES: 2, RESULT: 1, WORD: 1}
+_COORDINATES = struct.Struct('!BBB')
+# the end of CONNECT and GRANTED, so a handshake that arrives in pieces is only read once it is whole
+# and the first messages of the game right behind it are not taken for a part of it. Text never
+# holds a NUL byte, and peers from before it keep a NUL in the last field as it is
+HANDSHAKE_END = b'\0'
+# the game peers from before the handshake play
+CLASSIC = (BOARD_WIDTH, BOARD_HEIGHT, FLEET, False, False)
+
+
+class TextCodec(object):
+    version = TEXT
+
+    def encode(self, message):
+        return '\n'.join(str(part) for part in message).encode()
+
+    def decode(self, payload):
+        """:raise ValueError: if the payload is not a message, or has the wrong arguments for its kind"""
+        message = str(payload, 'utf-8').splitlines()
+        if not message or message[0] not in MESSAGES:
+            raise ValueError('Unknown message %r' % message)
+        kind = MESSAGES[message[0]][1]
+        if kind == WORD and len(message) == 1:
+            # an empty word leaves no line of its own
+            message.append('')
+        if kind in ARGUMENTS and len(message) != ARGUMENTS[kind] + 1:
+            raise ValueError('Bad message %r' % message)
+        if kind in (COORDINATES, CELLS):
+            message[1:] = [int(part) for part in message[1:]]
+            if kind == CELLS and len(message) % 2 == 0:
+                raise ValueError('Bad message %r' % message)
+        elif kind in (RESULT, RESULT_LIST) and any(part not in engine.RESULT_CODES for part in message[1:]):
+            raise ValueError('Bad message %r' % message)
+        return message
+
+    def messages(self, payload):
+        return [self.decode(payload)]
+
+
+class LegacyCodec(TextCodec):
+    """
+    The old unframed text protocol. A receive can hold several messages, so they are told apart
+    by how many lines every kind of message has.
+    """
+    version = LEGACY
+
+    def encode(self, message):
+        # old peers ignore the trailing newline, and it keeps messages that arrive together apart
+        return super().encode(message) + b'\n'
+
+    def messages(self, payload):
+        lines = str(payload, 'utf-8').splitlines()
+        messages = []
+        while lines:
+            if lines[0] not in MESSAGES or MESSAGES[lines[0]][1] not in ARGUMENTS:
+                raise ValueError('Unknown message %r' % lines)
+            count = ARGUMENTS[MESSAGES[lines[0]][1]] + 1
+            messages.append(self.decode('\n'.join(lines[:count]).encode()))
+            del lines[:count]
+        return messages
+
+
+class BinaryCodec(object):
+    version = BINARY
+
+    def encode(self, message):
+        code, kind = MESSAGES[message[0]]
+        if kind == COORDINATES:
+            return _COORDINATES.pack(code, message[1], message[2])
+        if kind == RESULT:
+            return bytes((code, engine.RESULT_CODES[message[1]]))
+        if kind == WORD:
+            return bytes((code,)) + message[1].encode()
+        if kind == CELLS:
+            return bytes((code,)) + bytes(message[1:])
+        if kind == RESULT_LIST:
+            return bytes((code,)) + bytes(engine.RESULT_CODES[result] for result in message[1:])
+        return bytes((code,))
+
+    def decode(self, payload):
+        """:raise ValueError: if the payload is not a message, or has the wrong arguments for its kind"""
+        if not payload:
+            raise ValueError('Empty message')
+        name = NAMES.get(payload[0])
+        if name is None:
+            raise ValueError('Unknown opcode %i' % payload[0])
+        kind = MESSAGES[name][1]
+        if kind == COORDINATES:
+            if len(payload) != _COORDINATES.size:
+                raise ValueError('Bad %s of %i bytes' % (name, len(payload)))
+            _, x, y = _COORDINATES.unpack(payload)
+            return [name, x, y]
+        if kind == WORD:
+            return [name, str(payload[1:], 'utf-8')]
+        if kind == CELLS:
+            if len(payload) % 2 == 0:
+                raise ValueError('Bad %s of %i bytes' % (name, len(payload)))
+            return [name] + list(payload[1:])
+        if kind in (RESULT, RESULT_LIST):
+            if (kind == RESULT and len(payload) != 2) or any(code >= len(engine.RESULTS) for code in payload[1:]):
+                raise ValueError('Bad %s %r' % (name, bytes(payload)))
+            return [name] + [engine.RESULTS[code] for code in payload[1:]]
+        if len(payload) != 1:
+            raise ValueError('Bad %s of %i bytes' % (name, len(payload)))
+        return [name]
+
+    def messages(self, payload):
+        return [self.decode(payload)]
+
+
+CODECS = {LEGACY: LegacyCodec, TEXT: TextCodec, BINARY: BinaryCodec}
+
+
+class RawConnection(object):
+    """An unframed stream socket, for LEGACY peers. Every receive is taken as it comes."""
+
+    def __init__(self, sock, data=b''):
+        self.sock = sock
+        self.data = data
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def send(self, payload: bytes):
+        self.sock.sendall(payload)
+
+    def receive(self):
+        data = self.sock.recv(4096)
+        if not data:
+            raise ConnectionResetError('The connection was closed.')
+        return [data]
+
+    def pending(self):
+        """:return: what came in before the connection was made, as if it was received"""
+        data, self.data = self.data, b''
+        return [data] if data else []
+
+    def close(self):
+        self.sock.close()
+
+
+class Channel(object):
+    """Sends and receives messages over a socket in the version agreed on in the handshake."""
+
+    def __init__(self, sock, version, data=b''):
+        """:param data: what came in right behind the handshake, see pending()"""
+        self.version = version
+        self.codec = CODECS[version]()
+        if version == LEGACY:
+            self.connection = RawConnection(sock, data)
+        else:
+            self.connection = framing.Connection(sock)
+            self.connection.reader.feed(data)
+        self.sock = sock
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def send(self, *message):
+        self.connection.send(self.codec.encode(message))
+
+    def receive(self):
+        """:return: list of the messages that came in, for when a selector says the socket is readable"""
+        messages = []
+        for payload in self.connection.receive():
+            messages.extend(self.codec.messages(payload))
+        return messages
+
+    def pending(self):
+        """:return: list of the messages that came in with the handshake, to be read before waiting on the socket"""
+        messages = []
+        for payload in self.connection.pending():
+            messages.extend(self.codec.messages(payload))
+        return messages
+
+    def close(self):
+        self.connection.close()
+
+
+class CoinToss(object):
+    """
+    Tosses for who starts so that neither player can cheat. Both pick a random nonce and send
+    COMMIT with its hash; a player sends REVEAL with the nonce only once it has the other's COMMIT,
+    so neither can pick a nonce after seeing the other's. The coin is the low bit of the hash of
+    both nonces, and the player with the lower hash starts on 0.
+    """
+
+    def __init__(self):
+        self.nonce = os.urandom(16).hex()
+        self.commitment = hashlib.sha256(self.nonce.encode()).hexdigest()
+        self.theirs = None
+        self.their_nonce = None
+        self.revealed = False
+
+    def commit(self, commitment):
+        """:raise ValueError: if the other side already committed"""
+        if self.theirs is not None:
+            raise ValueError('Committed twice!')
+        self.theirs = commitment
+
+    def reveal(self, nonce):
+        """:raise ValueError: if the nonce does not match what the other side committed to"""
+        if self.theirs is None or self.their_nonce is not None or \
+                hashlib.sha256(nonce.encode()).hexdigest() != self.theirs:
+            raise ValueError('The coin toss was cheated!')
+        self.their_nonce = nonce
+
+    @property
+    def done(self):
+        return self.revealed and self.their_nonce is not None
+
+    def we_start(self):
+        ours, theirs = (self.nonce, self.their_nonce) if self.commitment < self.theirs else \
+            (self.their_nonce, self.nonce)
+        coin = hashlib.sha256((ours + theirs).encode()).digest()[-1] & 1
+        return (coin == 0) == (self.commitment < self.theirs)
+
+
+# the CONNECT/GRANTED handshake, which is always unframed text ending with HANDSHAKE_END
+def split_handshake(data: bytes, quiet=False):
+    """
+    :param quiet: True once nothing more came for HANDSHAKE_GRACE seconds, to take the handshake of a
+                  peer from before HANDSHAKE_END as it is
+    :return: (handshake, the bytes that came behind it), or None while more of the handshake is on the way
+    """
+    end = data.find(HANDSHAKE_END)
+    if end >= 0:
+        return data[:end], data[end + 1:]
+    # the old GRANTED is the word alone, and the first LEGACY messages can be right behind it; the new
+    # one goes on with a newline, so anything else behind the word tells them apart without waiting
+    if data.startswith(b'GRANTED') and not data.startswith(b'GRANTED\n') and (quiet or len(data) > 7):
+        return data[:7], data[7:]
+    if not quiet:
+        return None
+    return data, b''
+
+
+async def read_handshake(reader, timeout, limit=1024):
+    """
+    Reads CONNECT or GRANTED from an asyncio.StreamReader, see split_handshake.
+    :param timeout: seconds to wait for the first bytes
+    :return: (handshake, the bytes that came behind it), (b'', b'') if the connection was closed first
+    :raise asyncio.TimeoutError: if nothing came in time, ValueError if the handshake is longer than limit
+    """
+    data = b''
+    while True:
+        try:
+            more = await asyncio.wait_for(reader.read(limit), HANDSHAKE_GRACE if data else timeout)
+        except asyncio.TimeoutError:
+            if not data:
+                raise
+            return split_handshake(data, True)
+        if not more:
+            return split_handshake(data, True)
+        data += more
+        handshake = split_handshake(data)
+        if handshake is not None:
+            return handshake
+        if len(data) > limit:
+            raise ValueError('That is not a handshake!')
+
+
+def parse_fields(data: bytes):
+    """
+    Splits 'WORD\\nkey=value\\nkey=value' up.
+    :return: (WORD, dict of the fields)
+    """
+    lines = data.decode().splitlines()
+    if not lines:
+        return None, {}
+    fields = {}
+    for line in lines[1:]:
+        key, _, value = line.partition('=')
+        fields[key] = value
+    return lines[0], fields
+
+
+def connect_request(name, versions=SUPPORTED):
+    return ('CONNECT\nname=%s\nprotocol=%s' % (name, ','.join(str(version) for version in versions))).encode() + \
+        HANDSHAKE_END
+
+
+def choose_version(fields):
+    """:return: the best version both sides speak, LEGACY when the other side did not say"""
+    try:
+        offered = {int(version) for version in fields['protocol'].split(',')}
+    except (KeyError, ValueError):
+        return LEGACY
+    common = offered.intersection(SUPPORTED)
+    return max(common) if common else LEGACY
+
+
+def grant(version, settings=None, name=None, session=None):
+    """
+    :param settings: (width, height, fleet, salvo, toss) of the game, left out for LEGACY peers which only play the classic one
+    :param name: name of the opponent when it is not the one who answers, like a game on host.py
+    :param session: token to resume the game with after the connection dropped, see session.py
+    """
+    if version == LEGACY:
+        # old peers only take the word alone, they have no HANDSHAKE_END
+        return 'GRANTED'.encode()
+    text = 'GRANTED\nprotocol=%i' % version
+    if settings:
+        width, height, fleet, salvo, toss = settings
+        text += '\nboard=%ix%i\nfleet=%s' % (width, height, ','.join(str(length) for length in fleet))
+        if salvo:
+            text += '\nsalvo=1'
+        if toss:
+            text += '\ntoss=1'
+    if name:
+        text += '\nname=%s' % name
+    if session:
+        text += '\nsession=%s' % session
+    return text.encode() + HANDSHAKE_END
+
+
+def granted_version(data: bytes):
+    """:return: the version the other side picked, or None if the connection was declined"""
+    word, fields = parse_fields(data)
+    if word != 'GRANTED':
+        return None
+    return choose_version(fields)
+
+
+def parse_settings(board, fleet, salvo=False, toss=True):
+    """
+    :param board: 'WIDTHxHEIGHT'
+    :param fleet: the ship lengths, like '2,3,3,4,5'
+    :param salvo: True to fire one shot per ship still afloat every turn
+    :param toss: True to toss for who starts, False to have both players agree on it in a dialog
+    :return: (width, height, fleet, salvo, toss)
+    :raise ValueError: if the board or fleet can not be played
+    """
+    width, _, height = board.lower().partition('x')
+    width = int(width)
+    height = int(height)
+    fleet = tuple(int(length) for length in fleet.split(','))
+    if not (0 < width <= MAX_BOARD_SIZE and 0 < height <= MAX_BOARD_SIZE):
+        raise ValueError('A board can be at most %ix%i!' % (MAX_BOARD_SIZE, MAX_BOARD_SIZE))
+    if not 0 < len(fleet) <= MAX_FLEET:
+        raise ValueError('A fleet has 1 to %i ships!' % MAX_FLEET)
+    if min(fleet) < 1 or max(fleet) > max(width, height) or sum(fleet) > width * height:
+        raise ValueError('The fleet does not fit on the board!')
+    return width, height, fleet, bool(salvo), bool(toss)
+
+
+def game_settings(fields):
+    """:return: (width, height, fleet, salvo, toss) the host picked, the classic game if it did not say"""
+    if 'board' not in fields:
+        return CLASSIC
+    return parse_settings(fields['board'], fields.get('fleet', ','.join(str(length) for length in FLEET)),
+                          fields.get('salvo') == '1', fields.get('toss') == '1')
+
+
+def benchmark(number=100000):
+    """
+    Times encoding and decoding a few typical messages in every version.
+    :return: list of (version, message, size in bytes, encode ns, decode ns)
+    """
+    results = []
+    for version, codec in sorted(CODECS.items()):
+        codec = codec()
+        for message in (['SHOOT', 3, 7], ['SHOT', 'SUNK'], ['CHOOSE', 'Somebody'], ['CLOSED'],
+                        ['SALVO', 3, 7, 4, 7, 5, 7, 6, 7, 7, 7], ['RESULTS', 'HIT', 'MISS', 'MISS', 'HIT', 'SUNK']):
+            if version == LEGACY and message[0] in ('SALVO', 'RESULTS'):
+                continue
+            payload = codec.encode(message)
+            size = len(payload) + (0 if version == LEGACY else framing.HEADER.size)
+            encode = min(timeit.repeat(lambda: codec.encode(message), number=number, repeat=3)) / number
+            decode = min(timeit.repeat(lambda: codec.messages(payload), number=number, repeat=3)) / number
+            results.append((version, message, size, encode * 1e9, decode * 1e9))
+    return results
+
+
+if __name__ == '__main__':
+    print('%-8s %-44s %5s %10s %10s' % ('version', 'message', 'bytes', 'encode ns', 'decode ns'))
+    for version, message, size, encode, decode in benchmark():
+        print('%-8s %-44s %5i %10.0f %10.0f' % ({LEGACY: 'legacy', TEXT: 'text', BINARY: 'binary'}[version],
+                                                message, size, encode, decode))
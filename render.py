@@ -0,0 +1,131 @@
+"""
+Batched drawing on the game canvas.
+
+Game and network code post draw commands from any thread. The Tk thread applies them once a
+frame, RENDER_FPS times a second, and several changes to the same item are made as one. A tag can
+stand for any item, so changes to a tag keep their place among the changes to items.
+"""
+import queue
+import time
+
+from vars import *
+
+CREATE = 0
+CONFIG = 1
+CONFIGURE = 2
+COORDS = 3
+DELETE = 4
+
+
+class Renderer(object):
+    def __init__(self, canvas, fps=RENDER_FPS):
+        self.canvas = canvas
+        self.interval = max(1, 1000 // fps)
+        self.commands = queue.Queue()
+        # frames that had something to draw
+        self.frames = 0
+        # commands posted, and the ones left after coalescing that were actually applied
+        self.posted = 0
+        self.applied = 0
+        self.most_per_frame = 0
+        self.frame_time = 0.0
+        self.longest_frame = 0.0
+        self.after_id = self.canvas.after(self.interval, self.frame)
+
+    # called from any thread
+    def create(self, kind, *args, **options):
+        """Queues canvas.create_<kind>(*args, **options), like create('circle', x, y, 8, fill='red')."""
+        self.commands.put((CREATE, kind, args, options))
+
+    def itemconfig(self, item, **options):
+        self.commands.put((CONFIG, item, None, options))
+
+    def configure(self, widget, **options):
+        """Queues widget.configure(**options) for any other widget, like the labels of a dialog."""
+        self.commands.put((CONFIGURE, widget, None, options))
+
+    def coords(self, item, *coordinates):
+        self.commands.put((COORDS, item, coordinates, None))
+
+    def delete(self, item):
+        self.commands.put((DELETE, item, None, None))
+
+    # everything below runs on the Tk thread
+    def frame(self):
+        self.flush()
+        self.after_id = self.canvas.after(self.interval, self.frame)
+
+    def flush(self):
+        """Applies everything that was posted since the last frame."""
+        start = time.perf_counter()
+        creates = []
+        # runs of (tag, item -> merged options): changes to items are merged, a change to a tag starts
+        # a run of its own so it is made after the changes posted before it and before the ones after
+        configs = [(False, {})]
+        widgets = {}
+        moved = {}
+        deleted = []
+        count = 0
+        while True:
+            try:
+                command, target, args, options = self.commands.get_nowait()
+            except queue.Empty:
+                break
+            count += 1
+            if command == CREATE:
+                creates.append((target, args, options))
+            elif command == CONFIG:
+                tag = isinstance(target, str)
+                if configs[-1][0] != tag or (tag and target not in configs[-1][1]):
+                    configs.append((tag, {}))
+                configs[-1][1].setdefault(target, {}).update(options)
+            elif command == CONFIGURE:
+                widgets.setdefault(target, {}).update(options)
+            elif command == COORDS:
+                moved[target] = args
+            else:
+                deleted.append(target)
+        if not count:
+            return 0
+        canvas = self.canvas
+        for kind, args, options in creates:
+            getattr(canvas, 'create_' + kind)(*args, **options)
+        for item in deleted:
+            for _, run in configs:
+                run.pop(item, None)
+            moved.pop(item, None)
+        for item, coordinates in moved.items():
+            canvas.coords(item, *coordinates)
+        for _, run in configs:
+            for item, options in run.items():
+                canvas.itemconfig(item, **options)
+        for widget, options in widgets.items():
+            if widget.winfo_exists():
+                widget.configure(**options)
+        for item in deleted:
+            canvas.delete(item)
+        applied = len(creates) + len(moved) + sum(len(run) for _, run in configs) + len(widgets) + len(deleted)
+        elapsed = time.perf_counter() - start
+        self.frames += 1
+        self.posted += count
+        self.applied += applied
+        self.most_per_frame = max(self.most_per_frame, applied)
+        self.frame_time += elapsed
+        self.longest_frame = max(self.longest_frame, elapsed)
+        return applied
+
+    def stats(self):
+        """:return: dict with the draw commands per frame and the frame times in milliseconds"""
+        frames = self.frames or 1
+        return {'frames': self.frames,
+                'posted': self.posted,
+                'applied': self.applied,
+                'commands_per_frame': self.applied / frames,
+                'most_per_frame': self.most_per_frame,
+                'frame_ms': 1000 * self.frame_time / frames,
+                'longest_frame_ms': 1000 * self.longest_frame}
+
+    def stop(self):
+        if self.after_id:
+            self.canvas.after_cancel(self.after_id)
+            self.after_id = None
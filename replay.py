@@ -0,0 +1,684 @@
+"""
+Recording games and playing them back.
+
+With Battleship.py --record PATH every game, against a player or the computer, is appended to the
+replay log at PATH by a Recorder, which writes from a thread of its own so a turn never waits for
+the disk. Only one game may write to a log at a time. The log is:
+    magic 'BSRP' | version | 3 bytes padding
+followed by the games, each of them:
+    magic 'GAME' | width | height | number of ships | who starts | keyframe interval | length of the names (2 bytes)
+    ship lengths (1 byte each), both names separated by a newline
+    for both players 1 and x, y of every cell of every ship if its ships are known, else 0
+    moves, 4 bytes each: player, x, y, result
+    after every interval moves a keyframe of the game so far: for both players the shots it fired
+        and the hits among them, one bit per cell each, and the number of ships it sunk (1 byte)
+    end: 255 | winner, or 255 if the game was abandoned | 2 bytes padding
+all little endian. Where a move is follows from where its game starts, so the viewer gets to any
+move of any game at once, and the boards at any move are a keyframe and less than interval moves
+away.
+
+The index, at the path of the log with .idx appended, has a record of every game that ended. It is
+made again from the log when it is missing or behind, and a game cut short by a crash is ended as
+abandoned the next time the log is written to.
+
+Usage: python replay.py [PATH] shows the games in PATH.
+       python replay.py --simulate N [PATH] records N games between computer players.
+       python replay.py --benchmark [N] measures recording and seeking N games.
+"""
+import argparse
+import mmap
+import os
+import random
+import struct
+import threading
+import time
+import tkinter as tk
+import tkinter.font
+from queue import Queue
+
+import numpy as np
+from PIL import ImageTk, Image
+
+import ai
+import boardview
+import engine
+import render
+from insthelp import resource_path
+from vars import *
+
+REPLAY_MAGIC = b'BSRP'
+INDEX_MAGIC = b'BSRI'
+GAME_MAGIC = b'GAME'
+REPLAY_VERSION = 1
+FILE_HEADER = struct.Struct('<4sB3x')
+GAME_HEADER = struct.Struct('<4sBBBBBH')
+MOVE = struct.Struct('<BBBB')
+# the player of the end record, and its winner when nobody won
+END = 255
+ABANDONED = 255
+INDEX = np.dtype([('offset', '<u8'), ('start', '<u8'), ('moves', '<u4'), ('winner', 'u1'), ('interval', 'u1'),
+                  ('width', 'u1'), ('height', 'u1')])
+
+
+def keyframe_size(width, height):
+    return 2 * (2 * ((width * height + 7) // 8) + 1)
+
+
+def move_offset(start, move, interval, keyframe):
+    """:return: where move number move of a game whose moves start at start is"""
+    return start + MOVE.size * move + (move // interval) * keyframe
+
+
+def _unpack_cells(data, offset, fleet):
+    """
+    :return: list of the cells of every ship, and the offset after them
+    :raise ValueError: if data ends before the last ship
+    """
+    if offset + 2 * sum(fleet) > len(data):
+        raise ValueError('The ships are cut short!')
+    ships = []
+    for length in fleet:
+        cells = data[offset:offset + 2 * length]
+        ships.append([(cells[i], cells[i + 1]) for i in range(0, 2 * length, 2)])
+        offset += 2 * length
+    return ships, offset
+
+
+def read_game_header(data, offset):
+    """
+    :return: dict of the game whose header is at offset, start being where its moves are
+    :raise ValueError: if there is no game header at offset
+    """
+    if len(data) - offset < GAME_HEADER.size:
+        raise ValueError('No game at %i!' % offset)
+    magic, width, height, count, first, interval, length = GAME_HEADER.unpack_from(data, offset)
+    if magic != GAME_MAGIC or not interval:
+        raise ValueError('No game at %i!' % offset)
+    offset += GAME_HEADER.size
+    if offset + count + length > len(data):
+        raise ValueError('No game at %i!' % offset)
+    fleet = tuple(data[offset:offset + count])
+    offset += count
+    names = bytes(data[offset:offset + length]).decode('utf-8', 'replace').split('\n', 1)
+    offset += length
+    ships = []
+    for _ in range(2):
+        if offset >= len(data):
+            raise ValueError('No game at %i!' % offset)
+        known = data[offset]
+        offset += 1
+        if known:
+            cells, offset = _unpack_cells(data, offset, fleet)
+            ships.append(cells)
+        else:
+            ships.append(None)
+    return {'width': width, 'height': height, 'fleet': fleet, 'first': first, 'interval': interval,
+            'names': names, 'ships': ships, 'start': offset}
+
+
+def scan(data, offset=FILE_HEADER.size):
+    """
+    Walks the games of a log from offset on.
+    :return: list of index records (offset, start, moves, winner, interval, width, height) of the games
+             that ended, and the offset and header of the game after them if it did not end, or (offset, None)
+    """
+    records = []
+    while offset < len(data):
+        try:
+            game = read_game_header(data, offset)
+        except ValueError:
+            return records, (offset, None)
+        interval = game['interval']
+        keyframe = keyframe_size(game['width'], game['height'])
+        move = 0
+        while True:
+            at = move_offset(game['start'], move, interval, keyframe)
+            if at + MOVE.size > len(data):
+                return records, (offset, game)
+            if data[at] == END:
+                break
+            move += 1
+        records.append((offset, game['start'], move, data[at + 1], interval, game['width'], game['height']))
+        offset = at + MOVE.size
+    return records, (offset, None)
+
+
+def _write_index(path, records):
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as f:
+        f.write(FILE_HEADER.pack(INDEX_MAGIC, REPLAY_VERSION))
+        f.write(np.array(records, dtype=INDEX).tobytes())
+    os.replace(temporary, path)
+
+
+def _game_end(record):
+    return move_offset(int(record['start']), int(record['moves']), int(record['interval']),
+                       keyframe_size(int(record['width']), int(record['height']))) + MOVE.size
+
+
+def load_index(path, data):
+    """
+    :param data: the log at path
+    :return: the index of the log as an INDEX array, made again if the index file is missing or behind
+    """
+    index = None
+    try:
+        with open(path + '.idx', 'rb') as f:
+            header = f.read(FILE_HEADER.size)
+            if header == FILE_HEADER.pack(INDEX_MAGIC, REPLAY_VERSION):
+                index = np.fromfile(f, dtype=INDEX)
+    except OSError:
+        pass
+    end = _game_end(index[-1]) if index is not None and len(index) else FILE_HEADER.size
+    if index is not None and end == len(data):
+        return index
+    if index is None or end > len(data):
+        index, end = np.zeros(0, dtype=INDEX), FILE_HEADER.size
+    records, _ = scan(data, end)
+    return np.concatenate((index, np.array(records, dtype=INDEX)))
+
+
+class ReplayWriter(object):
+    """Appends games to a log. The games are told about like to a spectate.Publisher."""
+
+    def __init__(self, path=REPLAY_PATH, interval=KEYFRAME_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self.file = open(path, 'r+b' if os.path.exists(path) else 'w+b')
+        size = self.file.seek(0, os.SEEK_END)
+        if size < FILE_HEADER.size:
+            self.file.seek(0)
+            self.file.truncate()
+            self.file.write(FILE_HEADER.pack(REPLAY_MAGIC, REPLAY_VERSION))
+            _write_index(path + '.idx', [])
+        else:
+            self.file.seek(0)
+            if self.file.read(FILE_HEADER.size) != FILE_HEADER.pack(REPLAY_MAGIC, REPLAY_VERSION):
+                self.file.close()
+                raise ValueError('%s is not a replay log!' % path)
+            try:
+                self._repair(size)
+            except ValueError:
+                self.file.close()
+                raise
+        self.index = open(path + '.idx', 'ab')
+        self.game = None
+        self.moves = 0
+        # the game so far for both players: shots fired, hits among them, ships sunk
+        self.shots = [0, 0]
+        self.hits = [0, 0]
+        self.sunk = [0, 0]
+        self.start = 0
+        self.offset = 0
+
+    def _repair(self, size):
+        """Brings the index up to date with the log and ends a game that was cut short as abandoned."""
+        with mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            index = load_index(self.path, data)
+            end = _game_end(index[-1]) if len(index) else FILE_HEADER.size
+            _, (offset, game) = scan(data, end)
+        if end < size:
+            if game is None:
+                # not even the header of the last game made it
+                self.file.truncate(offset)
+            else:
+                keyframe = keyframe_size(game['width'], game['height'])
+                moves = 0
+                while move_offset(game['start'], moves + 1, game['interval'], keyframe) <= size:
+                    moves += 1
+                self.file.truncate(move_offset(game['start'], moves, game['interval'], keyframe))
+                self.file.seek(0, os.SEEK_END)
+                self.file.write(MOVE.pack(END, ABANDONED, 0, 0))
+                index = np.concatenate((index, np.array([(offset, game['start'], moves, ABANDONED, game['interval'],
+                                                          game['width'], game['height'])], dtype=INDEX)))
+        _write_index(self.path + '.idx', index)
+        self.file.seek(0, os.SEEK_END)
+
+    def begin(self, names, width, height, fleet, first, ships=None, their_ships=None):
+        """
+        :param first: the player who starts, 0 or 1
+        :param ships: list of the cells of every ship of player 0 if they are known, their_ships of player 1
+        """
+        if self.game is not None:
+            self.over(ABANDONED)
+        names = '\n'.join(names).encode()
+        header = bytearray(GAME_HEADER.pack(GAME_MAGIC, width, height, len(fleet), first, self.interval, len(names)))
+        header += bytes(fleet) + names
+        for cells in (ships, their_ships):
+            if cells is None:
+                header.append(0)
+            else:
+                header.append(1)
+                header.extend(value for ship in cells for cell in ship for value in cell)
+        self.offset = self.file.tell()
+        self.file.write(header)
+        self.start = self.offset + len(header)
+        self.game = (width, height)
+        self.moves = 0
+        self.shots = [0, 0]
+        self.hits = [0, 0]
+        self.sunk = [0, 0]
+
+    def move(self, player, x, y, result):
+        if self.game is None:
+            return
+        self.file.write(MOVE.pack(player, x, y, result))
+        bit = 1 << x * self.game[1] + y
+        self.shots[player] |= bit
+        if result != engine.MISS:
+            self.hits[player] |= bit
+            if result == engine.SUNK:
+                self.sunk[player] += 1
+        self.moves += 1
+        if self.moves % self.interval == 0:
+            size = (self.game[0] * self.game[1] + 7) // 8
+            for player in range(2):
+                self.file.write(self.shots[player].to_bytes(size, 'little') +
+                                self.hits[player].to_bytes(size, 'little') + bytes((self.sunk[player],)))
+
+    def shots_fired(self, player, shots, results):
+        for (x, y), result in zip(shots, results):
+            self.move(player, x, y, result)
+
+    def over(self, winner, ships=None):
+        """:param ships: ignored, the ships are in the header if they were known"""
+        if self.game is None:
+            return
+        self.file.write(MOVE.pack(END, winner, 0, 0))
+        width, height = self.game
+        self.index.write(np.array([(self.offset, self.start, self.moves, winner, self.interval, width, height)],
+                                  dtype=INDEX).tobytes())
+        self.game = None
+        self.flush()
+
+    def flush(self):
+        self.file.flush()
+        self.index.flush()
+
+    def close(self):
+        if self.game is not None:
+            self.over(ABANDONED)
+        self.file.close()
+        self.index.close()
+
+
+class Recorder(threading.Thread):
+    """
+    Records games with a ReplayWriter on a thread of its own. The methods can be called from any
+    thread and only queue what happened.
+    """
+
+    def __init__(self, path=REPLAY_PATH):
+        super().__init__()
+        self.writer = ReplayWriter(path)
+        self.queue = Queue()
+
+    def begin(self, names, width, height, fleet, first, ships=None):
+        self.queue.put((self.writer.begin, (names, width, height, fleet, first, ships)))
+
+    def shots(self, player, shots, results):
+        self.queue.put((self.writer.shots_fired, (player, list(shots), list(results))))
+
+    def over(self, winner, ships=None):
+        self.queue.put((self.writer.over, (winner,)))
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            function, args = item
+            function(*args)
+            # what is written is on disk before the recorder waits again
+            if self.queue.empty():
+                self.writer.flush()
+        self.writer.close()
+
+    def stop(self):
+        if self.is_alive():
+            self.queue.put(None)
+            self.join()
+
+
+class Replay(object):
+    """A replay log, memory mapped, read only."""
+
+    def __init__(self, path=REPLAY_PATH):
+        self.file = open(path, 'rb')
+        try:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self.file.close()
+            raise ValueError('%s is not a replay log!' % path)
+        if self.map[:FILE_HEADER.size] != FILE_HEADER.pack(REPLAY_MAGIC, REPLAY_VERSION):
+            self.close()
+            raise ValueError('%s is not a replay log!' % path)
+        self.index = load_index(path, self.map)
+        self.bytes = np.frombuffer(self.map, dtype=np.uint8)
+
+    def __len__(self):
+        return len(self.index)
+
+    def game(self, number):
+        return ReplayGame(self, number)
+
+    def close(self):
+        # the array points into the map, it has to go first
+        self.bytes = None
+        self.map.close()
+        self.file.close()
+
+
+class ReplayGame(object):
+    """One game of a Replay; moves and boards at any move are found without reading the moves before them."""
+
+    def __init__(self, replay, number):
+        self.replay = replay
+        self.number = number
+        record = replay.index[number]
+        self.moves = int(record['moves'])
+        self.winner = int(record['winner'])
+        header = read_game_header(replay.map, int(record['offset']))
+        self.width = header['width']
+        self.height = header['height']
+        self.fleet = header['fleet']
+        self.first = header['first']
+        self.names = header['names']
+        self.ships = header['ships']
+        self.start = header['start']
+        self.interval = header['interval']
+        self.keyframe = keyframe_size(self.width, self.height)
+
+    def move(self, number):
+        """:return: (player, x, y, result) of move number number"""
+        return MOVE.unpack_from(self.replay.map, move_offset(self.start, number, self.interval, self.keyframe))
+
+    def move_array(self):
+        """:return: (moves, 4) uint8 array of player, x, y, result of every move"""
+        moves = np.arange(self.moves)
+        offsets = self.start + MOVE.size * moves + (moves // self.interval) * self.keyframe
+        return self.replay.bytes[offsets[:, None] + np.arange(MOVE.size)]
+
+    def state(self, number):
+        """
+        :return: the boards after the first number moves: for both players a list of the shots it
+                 fired and the hits among them as bit masks, and the number of ships it sunk
+        """
+        data = self.replay.map
+        keyframes = number // self.interval
+        state = [[0, 0, 0], [0, 0, 0]]
+        if keyframes:
+            size = (self.width * self.height + 7) // 8
+            offset = move_offset(self.start, keyframes * self.interval, self.interval, self.keyframe) - self.keyframe
+            for player in range(2):
+                state[player] = [int.from_bytes(data[offset:offset + size], 'little'),
+                                 int.from_bytes(data[offset + size:offset + 2 * size], 'little'),
+                                 data[offset + 2 * size]]
+                offset += 2 * size + 1
+        for move in range(keyframes * self.interval, number):
+            player, x, y, result = self.move(move)
+            bit = 1 << x * self.height + y
+            state[player][0] |= bit
+            if result != engine.MISS:
+                state[player][1] |= bit
+                if result == engine.SUNK:
+                    state[player][2] += 1
+        return state
+
+    def turn(self, number):
+        """:return: the player whose move is next after number moves, or None once the game is over"""
+        if number >= self.moves:
+            return None
+        return self.move(number)[0]
+
+
+def record_games(path, games, first='density:random', second='hunt:edges', seed=None):
+    """Plays games between two computer players, like tournament.play, and records them."""
+    writer = ReplayWriter(path)
+    rng = random.Random(seed)
+    try:
+        for number in range(games):
+            game = engine.Game()
+            # they take turns to start
+            entries = (first, second) if number % 2 == 0 else (second, first)
+            shooters = []
+            for board, entry in zip(game.boards, entries):
+                shooter, placer = entry.split(':')
+                ai.PLACERS[placer](board, rng)
+                shooters.append(ai.SHOOTERS[shooter](rng=rng))
+            boards = [[board.ship_cells(index) for index in range(len(board.fleet))] for board in game.boards]
+            writer.begin(entries, BOARD_WIDTH, BOARD_HEIGHT, FLEET, 0, boards[0], boards[1])
+            while game.winner is None:
+                player = game.turn
+                x, y = shooters[player].next_shot()
+                result = game.shoot(x, y)
+                shooters[player].update(x, y, result)
+                writer.move(player, x, y, result)
+            writer.over(game.winner)
+    finally:
+        writer.close()
+
+
+class ReplayViewer(tk.Tk):
+    """
+    Shows the games of a replay on the boards of the game window. Play goes on into the next
+    game, speed moves at a time, so a whole archive can be fast forwarded through.
+    """
+
+    def __init__(self, replay, path):
+        super().__init__()
+        self.title('%s - %s' % (BATTLE_SHIP_TITLE, path))
+        self.replay = replay
+        self.game = None
+        self.shown = 0
+        self.size = None
+        self.playing = False
+        self.view_mine = None
+        self.view_opponent = None
+        self.windows = []
+        self.background = ImageTk.PhotoImage(Image.open(resource_path('images/background.png')))
+        self.canvas = tk.Canvas(self, width=592, height=783, bd=0, highlightthickness=0)
+        self.canvas.pack()
+        self.canvas.create_image((0, 0), image=self.background, anchor='nw')
+        self.resizable(False, False)
+        self.font = tk.font.Font(weight='bold')
+        self.renderer = render.Renderer(self.canvas)
+        self.opponent_text = self.canvas.create_text(OPPONENT_NAME, font=self.font, fill='white')
+        self.player_text = self.canvas.create_text(PLAYER_NAME, font=self.font, fill='white')
+        self.turn_text = self.canvas.create_text(TURN_TEXT, font=self.font)
+        controls = tk.Frame(self)
+        controls.pack(fill='x')
+        self.number = tk.Spinbox(controls, from_=1, to=len(replay), width=6, command=self.pick)
+        self.number.bind('<Return>', self.pick)
+        self.number.pack(side='left')
+        for text, command in (('|<', lambda: self.load(self.game.number - 1)), ('<', lambda: self.seek(self.shown - 1)),
+                              ('>', lambda: self.seek(self.shown + 1)),
+                              ('>|', lambda: self.load(self.game.number + 1))):
+            tk.Button(controls, text=text, command=command).pack(side='left')
+        self.play_button = tk.Button(controls, text='Play', command=self.toggle)
+        self.play_button.pack(side='left')
+        self.speed = tk.Scale(controls, from_=1, to=REPLAY_MAX_SPEED, orient='horizontal', label='Moves per frame')
+        self.speed.pack(side='left')
+        self.position = tk.Scale(controls, from_=0, to=0, orient='horizontal', showvalue=False,
+                                 command=lambda value: self.seek(int(float(value))))
+        self.position.pack(side='left', fill='x', expand=True)
+        self.load(0)
+        self.mainloop()
+
+    def pick(self, event=None):
+        try:
+            self.load(int(self.number.get()) - 1)
+        except ValueError:
+            pass
+
+    def load(self, number):
+        if not 0 <= number < len(self.replay):
+            self.playing = False
+            return
+        game = self.game = self.replay.game(number)
+        self.number.delete(0, 'end')
+        self.number.insert(0, str(number + 1))
+        self.setup(game.width, game.height, game.fleet)
+        self.renderer.itemconfig(self.player_text, text=game.names[0])
+        self.renderer.itemconfig(self.opponent_text, text=game.names[-1])
+        self.position.configure(to=game.moves)
+        self.shown = -1
+        self.seek(0)
+
+    def setup(self, width, height, fleet):
+        """Makes the views like GUI.setup, unless the board is the same size as the last one."""
+        if self.size == (width, height, fleet):
+            return
+        self.size = (width, height, fleet)
+        for view in (self.view_mine, self.view_opponent):
+            if view:
+                view.destroy()
+        for window in self.windows:
+            self.canvas.delete(window)
+        self.windows = []
+        if (width, height) == (BOARD_WIDTH, BOARD_HEIGHT):
+            self.view_opponent = boardview.GridView(self.canvas, self.renderer, OPPONENT_START, width, height,
+                                                    fleet, 'black', self.font, lambda x, y: None)
+            self.view_mine = boardview.GridView(self.canvas, self.renderer, PLAYER_START, width, height, fleet,
+                                                'white', self.font, lambda x, y: None)
+            return
+        size = SPACE * (BOARD_WIDTH + 1)
+        self.view_opponent = boardview.BoardView(self, width, height, size, lambda x, y: None)
+        self.view_mine = boardview.BoardView(self, width, height, size, lambda x, y: None)
+        for start, view in ((OPPONENT_START, self.view_opponent), (PLAYER_START, self.view_mine)):
+            self.windows.append(self.canvas.create_window(start[0] - SPACE / 2, start[1] - SPACE / 2,
+                                                          window=view, anchor='nw'))
+
+    def seek(self, number):
+        """Shows the boards after number moves: the next move is drawn on, anything else from game.state."""
+        game = self.game
+        number = max(0, min(number, game.moves))
+        # player 0 shoots at the top board, player 1 at the bottom one
+        views = (self.view_opponent, self.view_mine)
+        if number == self.shown + 1 and number:
+            player, x, y, result = game.move(number - 1)
+            views[player].mark(x, y, boardview.MISS if result == engine.MISS else boardview.HIT)
+        elif number != self.shown:
+            for view in views:
+                view.clear()
+            # the ships of player 0 are on the bottom board
+            for ships, view in zip(game.ships, reversed(views)):
+                for index, cells in enumerate(ships or ()):
+                    view.show_ship(index, cells)
+            for (shots, hits, _), view in zip(game.state(number), views):
+                while shots:
+                    low = shots & -shots
+                    x, y = divmod(low.bit_length() - 1, game.height)
+                    view.mark(x, y, boardview.HIT if hits & low else boardview.MISS)
+                    shots ^= low
+        self.shown = number
+        if int(self.position.get()) != number:
+            self.position.set(number)
+        turn = game.turn(number)
+        if turn is not None:
+            text, fill = "%s's turn" % game.names[turn], TURN_COLOR[turn == 0]
+        elif game.winner == ABANDONED:
+            text, fill = 'Abandoned', 'silver'
+        else:
+            text, fill = '%s won!' % game.names[game.winner], 'gold'
+        self.renderer.itemconfig(self.turn_text, text=text, fill=fill)
+
+    def toggle(self):
+        self.playing = not self.playing
+        self.play_button.configure(text='Pause' if self.playing else 'Play')
+        if self.playing:
+            self.after(1000 // REPLAY_FPS, self.tick)
+
+    def tick(self):
+        if not self.playing:
+            return
+        if self.shown >= self.game.moves:
+            self.load(self.game.number + 1)
+        else:
+            target = min(self.shown + self.speed.get(), self.game.moves)
+            while self.shown < target:
+                self.seek(self.shown + 1)
+        if self.playing:
+            self.after(1000 // REPLAY_FPS, self.tick)
+        else:
+            self.play_button.configure(text='Play')
+
+
+def view(path):
+    replay = Replay(path)
+    if not len(replay):
+        print('There are no games in %s.' % path)
+        return
+    ReplayViewer(replay, path)
+    replay.close()
+
+
+def benchmark(games=2000, path='replay-benchmark.bsr', seeks=20000):
+    """
+    Records games between computer players, then records them again with a Recorder to time what
+    a turn pays for it, and seeks to random moves of random games.
+    :return: dict with the time a Recorder call and writing took per move, how long opening the log
+             took, and the time the boards at a random move took, in microseconds
+    """
+    copy = path + '.copy'
+    for name in (path, path + '.idx', copy, copy + '.idx'):
+        if os.path.exists(name):
+            os.remove(name)
+    record_games(path, games, seed=1)
+    start = time.perf_counter()
+    replay = Replay(path)
+    opened = time.perf_counter() - start
+    moves = int(replay.index['moves'].sum())
+    recorder = Recorder(copy)
+    recorder.start()
+    called = 0.0
+    start = time.perf_counter()
+    for number in range(len(replay)):
+        game = replay.game(number)
+        began = time.perf_counter()
+        recorder.begin(game.names, game.width, game.height, game.fleet, game.first, game.ships[0])
+        for player, x, y, result in game.move_array().tolist():
+            recorder.shots(player, [(x, y)], [result])
+        recorder.over(game.winner)
+        called += time.perf_counter() - began
+    recorder.stop()
+    written = time.perf_counter() - start
+    rng = random.Random(2)
+    start = time.perf_counter()
+    for _ in range(seeks):
+        game = replay.game(rng.randrange(len(replay)))
+        game.state(rng.randrange(game.moves + 1))
+    seeked = time.perf_counter() - start
+    size = os.path.getsize(path)
+    replay.close()
+    os.remove(path + '.idx')
+    start = time.perf_counter()
+    replay = Replay(path)
+    rebuilt = time.perf_counter() - start
+    replay.close()
+    for name in (path, copy, copy + '.idx'):
+        os.remove(name)
+    return {'games': games, 'moves': moves, 'bytes': size, 'call_us': 1e6 * called / moves,
+            'write_us': 1e6 * written / moves, 'open_ms': 1000 * opened, 'rebuild_ms': 1000 * rebuilt,
+            'seek_us': 1e6 * seeked / seeks}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Watch recorded games of battleship.')
+    parser.add_argument('path', nargs='?', default=REPLAY_PATH)
+    parser.add_argument('--simulate', type=int, metavar='GAMES', help='record games between computer players to path')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--benchmark', type=int, nargs='?', const=2000, metavar='GAMES')
+    args = parser.parse_args()
+    if args.benchmark:
+        print('%(games)i games, %(moves)i moves, %(bytes)i bytes: %(call_us).1fus per move for the player, '
+              '%(write_us).1fus per move recorded, opened in %(open_ms).1fms (%(rebuild_ms).1fms without the '
+              'index), %(seek_us).1fus per seek' % benchmark(args.benchmark))
+    elif args.simulate:
+        record_games(args.path, args.simulate, seed=args.seed)
+    else:
+        view(args.path)
+
+
+if __name__ == '__main__':
+    main()
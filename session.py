@@ -0,0 +1,245 @@
+"""
+Picking a game up again after the connection dropped.
+
+Both players count the messages they send and receive, and keep every message they sent in a log
+with its number. TCP delivers in order, so the numbers never go on the wire with the messages.
+After reconnecting, each side says how many messages it got and is sent only the ones it missed:
+    RESUME\\nsession=<token>\\nreceived=<count>     from the player who challenged, redialling
+    RESUMED\\nreceived=<count>                    from the player who accepted, listening again
+both framed by framing, followed by the missed messages. The token comes with GRANTED; LEGACY
+peers and games on host.py get none and can not be resumed.
+
+The log does not keep what the other side surely has. An answer is only sent once the message it
+answers came, like SHOT to SHOOT or REVEAL to COMMIT, so it shows the other side got that message
+and, TCP keeping the order, every one before it.
+"""
+import socket
+import threading
+import time
+from collections import deque
+
+import framing
+import protocol
+from vars import *
+
+# message -> the message of ours it shows the other side got
+ANSWERS = {'SHOT': 'SHOOT', 'RESULTS': 'SALVO', 'SHOOT': 'SHOT', 'SALVO': 'RESULTS', 'REVEAL': 'COMMIT'}
+
+
+def keepalive(sock):
+    """Makes a dead connection fail within seconds instead of hanging, where the platform allows it."""
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    for option, value in (('TCP_KEEPIDLE', KEEPALIVE_IDLE), ('TCP_KEEPINTVL', KEEPALIVE_INTERVAL),
+                          ('TCP_KEEPCNT', KEEPALIVE_COUNT)):
+        if hasattr(socket, option):
+            sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, option), value)
+
+
+class Session(object):
+    """A protocol.Channel that can be swapped for a new one without losing a message."""
+
+    def __init__(self, channel, token):
+        self.channel = channel
+        self.token = token
+        self.version = channel.version
+        self.sent = 0
+        self.received = 0
+        # (number, message) of every message the other side may not have yet
+        self.log = deque()
+        self.connected = True
+        self.lock = threading.Lock()
+        keepalive(channel.sock)
+
+    @property
+    def sock(self):
+        return self.channel.sock
+
+    def fileno(self):
+        return self.channel.fileno()
+
+    def send(self, *message):
+        """Sends a message, or keeps it for after reconnecting if the connection is down."""
+        with self.lock:
+            self.sent += 1
+            self.log.append((self.sent, message))
+            if self.connected:
+                try:
+                    self.channel.send(*message)
+                except OSError:
+                    # ends the connection for the listener too, which has the game reconnect; the
+                    # message is in the log, and a frame cut short goes with the old connection
+                    self.connected = False
+                    try:
+                        self.channel.sock.shutdown(socket.SHUT_RDWR)
+                    except OSError:
+                        pass
+
+    def receive(self):
+        return self._count(self.channel.receive())
+
+    def pending(self):
+        return self._count(self.channel.pending())
+
+    def _count(self, messages):
+        self.received += len(messages)
+        with self.lock:
+            for message in messages:
+                self._answered(ANSWERS.get(message[0]))
+        return messages
+
+    def _answered(self, word):
+        """Forgets the last message word we sent and everything before it, the other side has them."""
+        log = self.log
+        for i in range(len(log) - 1, -1, -1):
+            if log[i][1][0] == word:
+                for _ in range(i + 1):
+                    log.popleft()
+                return
+
+    def close(self):
+        self.channel.close()
+
+    def lost(self):
+        with self.lock:
+            self.connected = False
+        self.channel.close()
+
+    def resume(self, channel, received):
+        """
+        Carries on over a new channel, sending the messages the other side missed.
+        :param received: how many messages the other side got
+        :return: the number of messages sent again
+        :raise ValueError: if the other side got messages that were never sent, or says it missed
+                           messages it already answered
+        """
+        with self.lock:
+            if received > self.sent:
+                raise ValueError('The other side got %i messages of %i!' % (received, self.sent))
+            if received < (self.log[0][0] if self.log else self.sent + 1) - 1:
+                raise ValueError('The other side missed messages it answered!')
+            # everything up to received is confirmed now
+            while self.log and self.log[0][0] <= received:
+                self.log.popleft()
+            keepalive(channel.sock)
+            for _, message in self.log:
+                channel.send(*message)
+            self.channel = channel
+            self.connected = True
+            return len(self.log)
+
+
+def _read_frame(sock, reader, limit=1024):
+    """
+    :return: the first framed payload, the rest stays in reader
+    :raise ValueError: if the payload would be longer than limit, like when the other side sent CONNECT
+    """
+    while True:
+        for payload in reader.frames():
+            return bytes(payload)
+        if reader.end - reader.start >= framing.HEADER.size and \
+                framing.HEADER.unpack_from(reader.buffer, reader.start)[0] > limit:
+            raise ValueError('That is not a handshake!')
+        if not reader.fill(sock):
+            raise ConnectionResetError('The connection was closed.')
+
+
+class Reconnect(threading.Thread):
+    """
+    Tries to get the connection of a Session back for RESUME_TIMEOUT seconds, by redialling address
+    or, without one, by listening on port again. callback(True) is called once the game can go on,
+    callback(False) if it can not.
+    """
+
+    def __init__(self, session, address, port, callback):
+        super().__init__()
+        self.session = session
+        self.address = address
+        self.port = port
+        self.callback = callback
+        self.running = False
+        self.listener = None
+
+    def run(self):
+        self.running = True
+        deadline = time.monotonic() + RESUME_TIMEOUT
+        try:
+            sock, reader, received = self.dial(deadline) if self.address else self.listen(deadline)
+        except (OSError, ValueError, KeyError, UnicodeDecodeError):
+            sock = None
+        if sock is None:
+            if self.running:
+                self.callback(False)
+            return
+        sock.settimeout(None)
+        # whatever came right behind the handshake is already in reader
+        channel = protocol.Channel(sock, self.session.version, reader.view[reader.start:reader.end])
+        try:
+            self.session.resume(channel, received)
+        except (OSError, ValueError):
+            sock.close()
+            self.callback(False)
+            return
+        self.callback(True)
+
+    def dial(self, deadline):
+        session = self.session
+        while self.running and time.monotonic() < deadline:
+            try:
+                sock = socket.create_connection(self.address, timeout=RECONNECT_INTERVAL)
+            except OSError:
+                time.sleep(RECONNECT_INTERVAL)
+                continue
+            try:
+                sock.settimeout(HANDSHAKE_TIMEOUT)
+                sock.sendall(framing.encode_frame(('RESUME\nsession=%s\nreceived=%i' %
+                                                   (session.token, session.received)).encode()))
+                reader = framing.FrameReader()
+                word, fields = protocol.parse_fields(_read_frame(sock, reader))
+            except OSError:
+                sock.close()
+                time.sleep(RECONNECT_INTERVAL)
+                continue
+            if word != 'RESUMED':
+                sock.close()
+                raise ValueError('The other side does not know this game any more.')
+            return sock, reader, int(fields['received'])
+        return None, None, 0
+
+    def listen(self, deadline):
+        session = self.session
+        self.listener = socket.socket()
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            self.listener.bind(('', self.port))
+            self.listener.listen(LISTEN_BACKLOG)
+            while self.running and time.monotonic() < deadline:
+                # a little at a time, so that stop() does not wait long
+                self.listener.settimeout(max(.01, min(RECONNECT_INTERVAL, deadline - time.monotonic())))
+                try:
+                    sock, _ = self.listener.accept()
+                except socket.timeout:
+                    continue
+                try:
+                    sock.settimeout(HANDSHAKE_TIMEOUT)
+                    reader = framing.FrameReader()
+                    word, fields = protocol.parse_fields(_read_frame(sock, reader))
+                    # anyone else, like a new challenger, is turned away
+                    if word != 'RESUME' or fields.get('session') != session.token:
+                        sock.close()
+                        continue
+                    received = int(fields['received'])
+                    sock.sendall(framing.encode_frame(('RESUMED\nreceived=%i' % session.received).encode()))
+                except (OSError, ValueError, KeyError, UnicodeDecodeError):
+                    sock.close()
+                    continue
+                return sock, reader, received
+            return None, None, 0
+        finally:
+            self.listener.close()
+
+    def stop(self):
+        if self.is_alive():
+            self.running = False
+            if self.listener:
+                self.listener.close()
+            self.join()
@@ -0,0 +1,236 @@
+"""
+Plays many games of one shooting strategy at once to measure how many shots it needs to win.
+
+The state of N games is kept as a few NumPy arrays (struct of arrays) and every step fires one
+shot in every unfinished game at the same time:
+    boards     (N, width, height) int8, 0 for water or the index of the ship + 1
+    shots      (N, width, height) bool, cells that have been fired at
+    remaining  (N, ships) int8, cells of every ship that have not been hit yet
+    open_hits  (N, width, height) bool, hits on ships that are still afloat
+
+Usage: python simulator.py [-n GAMES] [--strategy random|parity|hunt] [--seed SEED]
+"""
+import argparse
+import time
+
+import numpy as np
+
+import engine
+import placements
+from vars import *
+
+
+def place_fleets(n, width=BOARD_WIDTH, height=BOARD_HEIGHT, fleet=FLEET, rng=None):
+    """
+    Places a random fleet on n boards at once, picking placements from the placements index.
+    :return: (n, width, height) int8 array with 0 for water and the ship index + 1 for ships
+    """
+    rng = rng or np.random.default_rng()
+    boards = np.zeros((n, width, height), dtype=np.int8)
+    flat = boards.reshape(n, -1)
+    index = placements.get(width, height)
+    for ship, length in enumerate(fleet):
+        cells = index.cells(length)
+        todo = np.arange(n)
+        while todo.size:
+            cover = cells[rng.integers(0, len(cells), todo.size)]
+            free = ~flat[todo[:, None], cover].any(axis=1)
+            placed = todo[free]
+            flat[placed[:, None], cover[free]] = ship + 1
+            todo = todo[~free]
+    return boards
+
+
+def shoot_random(sim, rng):
+    """Any cell that has not been fired at yet."""
+    return sim.next_free(parity=False)
+
+
+def shoot_parity(sim, rng):
+    """Like shoot_random, but every other cell first, since no ship is shorter than 2."""
+    return sim.next_free(parity=True)
+
+
+def shoot_hunt(sim, rng):
+    """
+    Parity hunting, but cells next to a hit on a ship that is still afloat come first.
+    A player knows which of its hits are on sunk ships from the SUNK answers, so this is fair.
+    """
+    cells = sim.next_free(parity=True)
+    rows = np.flatnonzero(sim.open_hits.reshape(sim.n, -1).any(axis=1))
+    if rows.size:
+        hits = sim.open_hits[rows]
+        near = np.zeros_like(hits)
+        near[:, 1:] |= hits[:, :-1]
+        near[:, :-1] |= hits[:, 1:]
+        near[:, :, 1:] |= hits[:, :, :-1]
+        near[:, :, :-1] |= hits[:, :, 1:]
+        near &= ~sim.shots[rows]
+        scores = sim.priority[rows]
+        scores += near.reshape(rows.size, -1)
+        cells[rows] = scores.argmax(axis=1)
+    return cells
+
+
+STRATEGIES = {'random': shoot_random, 'parity': shoot_parity, 'hunt': shoot_hunt}
+
+
+class BatchSimulator:
+    """
+    Finished games are dropped from the arrays in bulk once a quarter of them are over, so the
+    strategies can work on whole arrays without having to skip finished games.
+    """
+
+    def __init__(self, n, strategy=shoot_hunt, width=BOARD_WIDTH, height=BOARD_HEIGHT, fleet=FLEET, seed=None,
+                 log=None):
+        """
+        :param n: number of games to play at the same time
+        :param strategy: function(simulator, rng) returning a flat cell index for every game still being played
+        :param log: list that gets (shot number, games, cells, ship + 1 or 0, results) of every step if given,
+                    for the games that were not over before it
+        """
+        self.n = n
+        self.width = width
+        self.height = height
+        self.fleet = tuple(fleet)
+        self.strategy = strategy
+        self.rng = np.random.default_rng(seed)
+        self.boards = place_fleets(n, width, height, fleet, self.rng)
+        self.shots = np.zeros((n, width, height), dtype=bool)
+        self.open_hits = np.zeros((n, width, height), dtype=bool)
+        self.remaining = np.tile(np.array(self.fleet, dtype=np.int8), (n, 1))
+        self.shot_count = 0
+        # index into results of every game that is still being played
+        self.games = np.arange(n)
+        self.finished = np.zeros(n, dtype=bool)
+        self.live = n
+        self.results = np.zeros(n, dtype=np.int32)
+        self.parity = ((np.add.outer(np.arange(width), np.arange(height)) % 2) == 0).reshape(-1).astype(np.float32)
+        # a random order of the cells for every game, used to break ties between equally good cells
+        self.priority = self.rng.random((n, width * height), dtype=np.float32)
+        # parity -> (cells of every game sorted by priority, how far every game got through them)
+        self.orders = {}
+        self.log = log
+
+    def step(self):
+        """
+        Fires one shot in every game that is not over yet.
+        :return: number of games still going
+        """
+        if not self.live:
+            return 0
+        rows = np.arange(self.n)
+        cells = self.strategy(self, self.rng)
+        x, y = np.divmod(cells, self.height)
+        self.shots[rows, x, y] = True
+        self.shot_count += 1
+        ship = self.boards[rows, x, y]
+        hit = np.flatnonzero(ship)
+        if self.log is not None:
+            live = ~self.finished
+            results = (ship != 0).astype(np.uint8)
+            # a ship is sunk by the hit on its last cell
+            results[hit[self.remaining[hit, ship[hit].astype(np.intp) - 1] == 1]] = engine.SUNK
+            self.log.append((self.shot_count - 1, self.games[live], cells[live], ship[live], results[live]))
+        if not hit.size:
+            return self.live
+        ship = ship[hit].astype(np.intp) - 1
+        self.remaining[hit, ship] -= 1
+        self.open_hits[hit, x[hit], y[hit]] = True
+        sunk = self.remaining[hit, ship] == 0
+        if sunk.any():
+            rows = hit[sunk]
+            self.open_hits[rows] &= self.boards[rows] != (ship[sunk] + 1)[:, None, None]
+            done = rows[~self.remaining[rows].any(axis=1)]
+            if done.size:
+                self.results[self.games[done]] = self.shot_count
+                self.finished[done] = True
+                self.live -= done.size
+                # finished games keep harmlessly shooting at empty water until enough of them pile up
+                if self.live * 4 <= self.n * 3:
+                    self._drop(self.finished)
+        return self.live
+
+    def _drop(self, done):
+        keep = ~done
+        for name in ('boards', 'shots', 'open_hits', 'remaining', 'games', 'priority', 'finished'):
+            setattr(self, name, getattr(self, name)[keep])
+        for parity, (order, cursor) in self.orders.items():
+            self.orders[parity] = (order[keep], cursor[keep])
+        self.n = len(self.games)
+
+    def next_free(self, parity):
+        """
+        Walks every game's random order of the cells (every other cell first when parity is set)
+        up to the first cell that has not been fired at yet.
+        :return: a flat cell index for every game still being played
+        """
+        if parity not in self.orders:
+            scores = self.priority + self.parity if parity else self.priority
+            self.orders[parity] = (np.argsort(-scores, axis=1).astype(np.int16), np.zeros(self.n, dtype=np.intp))
+        order, cursor = self.orders[parity]
+        shots = self.shots.reshape(self.n, -1)
+        rows = np.arange(self.n)
+        cells = order[rows, cursor].astype(np.intp)
+        taken = rows[shots[rows, cells]]
+        while taken.size:
+            cursor[taken] += 1
+            cells[taken] = order[taken, cursor[taken]]
+            taken = taken[shots[taken, cells[taken]]]
+        return cells
+
+    def run(self):
+        """
+        Plays every game to the end.
+        :return: the number of shots every game took
+        """
+        while self.step():
+            pass
+        return self.results
+
+
+def simulate(games, strategy='hunt', batch=100000, seed=None):
+    """
+    Plays games games in batches of batch games.
+    :return: dict with games_per_second, mean_shots and the shot count distribution
+    """
+    rng = np.random.default_rng(seed)
+    counts = []
+    start = time.perf_counter()
+    left = games
+    while left:
+        size = min(batch, left)
+        sim = BatchSimulator(size, STRATEGIES[strategy], seed=rng.integers(2 ** 63))
+        counts.append(sim.run())
+        left -= size
+    elapsed = time.perf_counter() - start
+    counts = np.concatenate(counts)
+    return {'games': games,
+            'strategy': strategy,
+            'seconds': elapsed,
+            'games_per_second': games / elapsed,
+            'mean_shots': float(counts.mean()),
+            'percentiles': {p: int(v) for p, v in zip((5, 25, 50, 75, 95), np.percentile(counts, (5, 25, 50, 75, 95)))},
+            'distribution': np.bincount(counts, minlength=BOARD_WIDTH * BOARD_HEIGHT + 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulate many games of one shooting strategy.')
+    parser.add_argument('-n', '--games', type=int, default=100000)
+    parser.add_argument('--strategy', choices=sorted(STRATEGIES), default='hunt')
+    parser.add_argument('--batch', type=int, default=100000)
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+    report = simulate(args.games, args.strategy, args.batch, args.seed)
+    print('%i games of %s in %.2fs: %.0f games/s' % (report['games'], report['strategy'], report['seconds'],
+                                                    report['games_per_second']))
+    print('mean shots to win: %.2f' % report['mean_shots'])
+    print('percentiles: %s' % ', '.join('p%i=%i' % item for item in report['percentiles'].items()))
+    distribution = report['distribution']
+    peak = distribution.max()
+    for shots in np.flatnonzero(distribution):
+        print('%4i %8i %s' % (shots, distribution[shots], '#' * int(50 * distribution[shots] / peak)))
+
+
+if __name__ == '__main__':
+    main()
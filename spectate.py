@@ -0,0 +1,338 @@
+"""
+Watching a game.
+
+A player started with --spectate PORT publishes its game to anyone who connects to that port:
+every shot and what it hit, whose turn it is, and the publisher's ships once the game is over.
+A spectator that joins late first gets a snapshot of the game so far, a few frames however long
+the game has been going. The players only queue events, which an asyncio loop running in its own
+thread takes SPECTATE_FPS times a second and fans out, so publishing never wakes the loop. What a spectator's socket does not take right away waits in a buffer
+of its own, and a spectator more than SPECTATOR_BUFFER bytes behind is disconnected, so a slow
+spectator holds up nobody else.
+
+Frames are framed by framing and start with a byte saying what they are; player 0 is the publisher:
+    G  a game begins: width, height, number of ships, who starts, the ship lengths, then both names
+       separated by a newline
+    S  shots: player, count (2 bytes), then x, y, result of every shot in order
+    T  turn: player
+    O  game over: winner, number of ships, then for every ship of the publisher its length and
+       the x, y of its cells
+A snapshot is G, an S with every shot of each player so far, then T or O.
+
+Usage: python spectate.py HOST PORT prints a game as it is played.
+       python spectate.py --benchmark [N] measures the fan out to N local spectators.
+"""
+import argparse
+import asyncio
+import socket
+import struct
+import threading
+import time
+from collections import deque
+
+import engine
+import framing
+from vars import *
+
+GAME = b'G'
+SHOTS = b'S'
+TURN = b'T'
+OVER = b'O'
+_GAME = struct.Struct('!cBBBB')
+_SHOTS = struct.Struct('!cBH')
+
+
+def decode(payload):
+    """:return: the frame as a tuple starting with its kind, like (SHOTS, player, [(x, y, result), ...])"""
+    payload = bytes(payload)
+    kind = payload[:1]
+    if kind == GAME:
+        _, width, height, count, first = _GAME.unpack_from(payload)
+        fleet = tuple(payload[_GAME.size:_GAME.size + count])
+        names = payload[_GAME.size + count:].decode().split('\n', 1)
+        return GAME, width, height, fleet, first, names
+    if kind == SHOTS:
+        _, player, count = _SHOTS.unpack_from(payload)
+        body = payload[_SHOTS.size:]
+        return SHOTS, player, [tuple(body[i:i + 3]) for i in range(0, 3 * count, 3)]
+    if kind == TURN:
+        return TURN, payload[1]
+    if kind == OVER:
+        winner, count = payload[1], payload[2]
+        ships = []
+        offset = 3
+        for _ in range(count):
+            length = payload[offset]
+            cells = payload[offset + 1:offset + 1 + 2 * length]
+            ships.append([(cells[i], cells[i + 1]) for i in range(0, len(cells), 2)])
+            offset += 1 + 2 * length
+        return OVER, winner, ships
+    raise ValueError('Unknown frame %r' % kind)
+
+
+class Publisher(object):
+    """Serves the game to spectators. The methods that publish can be called from any thread and never wait."""
+
+    def __init__(self, port=SPECTATE_PORT, buffer=SPECTATOR_BUFFER, host=None, fps=SPECTATE_FPS):
+        self.host = host
+        self.port = port
+        self.buffer = buffer
+        self.interval = 1 / fps
+        # (function, args) the players published, for the loop to call on its next frame
+        self.events = deque()
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.started = threading.Event()
+        self.server = None
+        # what went wrong starting the server, for start() to raise
+        self.error = None
+        # the writers of the spectators
+        self.subscribers = set()
+        # the game so far, for the snapshot: the G frame, x, y, result of the shots of both players,
+        # and the last T or O frame
+        self.game = None
+        self.fired = [bytearray(), bytearray()]
+        self.state = None
+        self.pending = []
+        self.joined = 0
+        self.dropped = 0
+        self.writes = 0
+
+    def start(self):
+        """
+        Starts serving, and returns once spectators can connect.
+        :raise OSError: if the port can not be listened on
+        """
+        self.thread.start()
+        self.started.wait()
+        if self.error:
+            raise self.error
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.server = self.loop.run_until_complete(asyncio.start_server(self._serve, self.host, self.port,
+                                                                              backlog=HOST_BACKLOG))
+        except Exception as e:
+            self.error = e
+            self.loop.close()
+            self.started.set()
+            return
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.loop.call_soon(self._frame)
+        self.started.set()
+        self.loop.run_forever()
+        self.server.close()
+        for writer in list(self.subscribers):
+            writer.transport.abort()
+        self.loop.run_until_complete(asyncio.gather(*asyncio.all_tasks(self.loop), return_exceptions=True))
+        self.loop.close()
+
+    def stop(self):
+        if self.thread.is_alive():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+
+    # called from any thread
+    def begin(self, names, width, height, fleet, first, ships=None):
+        """
+        :param first: the player who starts
+        :param ships: the ships of the publisher, not shown to spectators before the game is over
+        """
+        frame = _GAME.pack(GAME, width, height, len(fleet), first) + bytes(fleet) + '\n'.join(names).encode()
+        self.events.append((self._begin, (frame, first)))
+
+    def shots(self, player, shots, results):
+        """
+        :param shots: list of (x, y) the player fired at, results what came back for every one of them
+        """
+        cells = bytes(value for (x, y), result in zip(shots, results) for value in (x, y, result))
+        self.events.append((self._shots, (player, cells)))
+
+    def over(self, winner, ships):
+        """:param ships: list of the cells of every ship of the publisher, as engine.Board.ship_cells gives them"""
+        frame = bytearray((OVER[0], winner, len(ships)))
+        for cells in ships:
+            frame.append(len(cells))
+            frame.extend(value for cell in cells for value in cell)
+        self.events.append((self._over, (bytes(frame),)))
+
+    # everything below runs on the loop
+    def _frame(self):
+        events = self.events
+        while events:
+            function, args = events.popleft()
+            function(*args)
+        self.loop.call_later(self.interval, self._frame)
+
+    def _begin(self, frame, first):
+        self.game = frame
+        self.fired = [bytearray(), bytearray()]
+        self.state = TURN + bytes((first,))
+        self._publish(framing.encode_frame(frame) + framing.encode_frame(self.state))
+
+    def _shots(self, player, cells):
+        if self.game is None:
+            return
+        self.fired[player] += cells
+        self.state = TURN + bytes((1 - player,))
+        self._publish(framing.encode_frame(_SHOTS.pack(SHOTS, player, len(cells) // 3) + cells) +
+                      framing.encode_frame(self.state))
+
+    def _over(self, frame):
+        if self.game is None:
+            return
+        self.state = frame
+        self._publish(framing.encode_frame(frame))
+
+    def snapshot(self):
+        """:return: the frames that bring a spectator up to date"""
+        if self.game is None:
+            return b''
+        frames = [self.game]
+        for player, cells in enumerate(self.fired):
+            frames.append(_SHOTS.pack(SHOTS, player, len(cells) // 3) + cells)
+        frames.append(self.state)
+        return b''.join(framing.encode_frame(frame) for frame in frames)
+
+    def _publish(self, data):
+        # everything published in one pass of the loop goes out as one write
+        if not self.pending:
+            self.loop.call_soon(self._flush)
+        self.pending.append(data)
+
+    def _flush(self):
+        if not self.pending:
+            # _serve flushed it already
+            return
+        data = b''.join(self.pending)
+        self.pending.clear()
+        self.writes += 1
+        for writer in list(self.subscribers):
+            writer.write(data)
+            # what the socket would not take waits in the transport, up to buffer bytes of it
+            if writer.transport.get_write_buffer_size() > self.buffer:
+                # too slow to keep up, it can join again and catch up with a snapshot
+                self._drop(writer)
+
+    def _drop(self, writer):
+        if writer in self.subscribers:
+            self.subscribers.discard(writer)
+            self.dropped += 1
+            # abort, so that what is still buffered for it does not have to be sent first
+            writer.transport.abort()
+
+    async def _serve(self, reader, writer):
+        # the snapshot holds what is still pending, the others have to get it before the spectator joins them
+        if self.pending:
+            self._flush()
+        snapshot = self.snapshot()
+        if snapshot:
+            writer.write(snapshot)
+        self.subscribers.add(writer)
+        self.joined += 1
+        try:
+            # a spectator has nothing to say, reading only tells when it leaves
+            while await reader.read(1024):
+                pass
+        except OSError:
+            pass
+        finally:
+            self.subscribers.discard(writer)
+            writer.close()
+
+    def stats(self):
+        return {'spectators': len(self.subscribers), 'joined': self.joined, 'dropped': self.dropped,
+                'writes': self.writes}
+
+
+def watch(host, port):
+    """Prints the game published at host:port until the connection closes."""
+    s = socket.create_connection((host, port))
+    connection = framing.Connection(s)
+    names = ['?', '?']
+    try:
+        while True:
+            for payload in connection.receive():
+                frame = decode(payload)
+                if frame[0] == GAME:
+                    _, width, height, fleet, first, names = frame
+                    print('%s against %s on %ix%i with ships %s' % (names[0], names[1], width, height,
+                                                                      ','.join(str(length) for length in fleet)))
+                elif frame[0] == SHOTS:
+                    for x, y, result in frame[2]:
+                        print('%s fires at %s%i: %s' % (names[frame[1]], 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'[y % 26], x + 1,
+                                                       engine.RESULTS[result]))
+                elif frame[0] == TURN:
+                    print("%s's turn" % names[frame[1]])
+                else:
+                    print('%s wins! The ships of %s were at %s' % (names[frame[1]], names[0], frame[2]))
+    except ConnectionError:
+        pass
+    finally:
+        s.close()
+
+
+def benchmark(spectators=200, events=500, slow=1):
+    """
+    Publishes shots one at a time to local spectators, slow of which never read, and waits until every
+    reading spectator got each of them.
+    :return: dict with the time publishing took the player in microseconds, the median and worst time
+             until every spectator had a shot in milliseconds, and how many spectators were dropped
+    """
+    publisher = Publisher(port=0, host='127.0.0.1')
+    publisher.start()
+    sockets = []
+    for i in range(spectators + slow):
+        s = socket.socket()
+        if i >= spectators:
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        s.connect(('127.0.0.1', publisher.port))
+        sockets.append(s)
+    while publisher.joined < len(sockets):
+        time.sleep(.001)
+    publisher.begin(('Alice', 'Bob'), BOARD_WIDTH, BOARD_HEIGHT, FLEET, 0)
+    readers = [framing.FrameReader() for _ in range(spectators)]
+    for s, reader in zip(sockets, readers):
+        while sum(1 for _ in reader.frames()) < 2 and reader.fill(s):
+            pass
+    published = 0.0
+    delivered = []
+    for i in range(events):
+        cell = i % (BOARD_WIDTH * BOARD_HEIGHT)
+        start = time.perf_counter()
+        publisher.shots(i % 2, [divmod(cell, BOARD_HEIGHT)], [engine.MISS])
+        published += time.perf_counter() - start
+        # a shot and a turn
+        for s, reader in zip(sockets, readers):
+            count = 0
+            while count < 2:
+                count += sum(1 for _ in reader.frames())
+                if count < 2 and not reader.fill(s):
+                    break
+        delivered.append(time.perf_counter() - start)
+    stats = publisher.stats()
+    publisher.stop()
+    for s in sockets:
+        s.close()
+    delivered.sort()
+    return {'spectators': spectators, 'events': events, 'publish_us': 1e6 * published / events,
+            'median_ms': 1000 * delivered[len(delivered) // 2], 'worst_ms': 1000 * delivered[-1],
+            'dropped': stats['dropped']}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Watch a game of battleship.')
+    parser.add_argument('host', nargs='?', default='127.0.0.1')
+    parser.add_argument('port', nargs='?', type=int, default=SPECTATE_PORT)
+    parser.add_argument('--benchmark', type=int, nargs='?', const=200, metavar='SPECTATORS')
+    args = parser.parse_args()
+    if args.benchmark:
+        print('%(spectators)i spectators, %(events)i shots: %(publish_us).1fus per shot for the player, every '
+              'spectator had it after %(median_ms).2fms (worst %(worst_ms).2fms), %(dropped)i dropped'
+              % benchmark(args.benchmark))
+        return
+    watch(args.host, args.port)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+"""
+Plays computer strategies against each other on every core and rates them.
+
+Every entry is a shooter and a placer from ai.SHOOTERS and ai.PLACERS written as shooter:placer.
+Every pair of entries plays --games games, taking turns to start. Games are played with engine.Game,
+which follows the same rules as a game over the network (SHOOT, SHOT MISS/HIT/SUNK, the turn
+passes after every shot and the game is won once all 5 ships are sunk).
+
+Results are saved in a SQLite file as they come in, so a run that gets killed can be started again
+with the same arguments and it will only play the games that are missing.
+
+Usage: python tournament.py [--entries density:random hunt:edges ...] [--games N] [--db FILE]
+"""
+import argparse
+import itertools
+import os
+import random
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import ai
+import engine
+
+ELO_START = 1500
+ELO_K = 16
+CHUNK = 50
+
+
+def play(first, second, seed):
+    """
+    Plays one game.
+    :param first: shooter:placer of the player who starts
+    :param second: shooter:placer of the other player
+    :return: (winner 0 or 1, shots fired by first, shots fired by second)
+    """
+    rng = random.Random(seed)
+    game = engine.Game()
+    shooters = []
+    for board, entry in zip(game.boards, (first, second)):
+        shooter, placer = entry.split(':')
+        ai.PLACERS[placer](board, rng)
+        shooters.append(ai.SHOOTERS[shooter](rng=rng))
+    while game.winner is None:
+        shooter = shooters[game.turn]
+        x, y = shooter.next_shot()
+        shooter.update(x, y, game.shoot(x, y))
+    return game.winner, game.shots[0], game.shots[1]
+
+
+def play_chunk(matches):
+    """Runs in a worker process. matches is a list of (id, first, second, seed)."""
+    return [(match_id, first, second, seed) + play(first, second, seed) for match_id, first, second, seed in matches]
+
+
+def schedule(entries, games, seed):
+    """Every game of the tournament as (id, first, second, seed), in a fixed order."""
+    match_id = 0
+    for a, b in itertools.combinations(entries, 2):
+        for game in range(games):
+            first, second = (a, b) if game % 2 == 0 else (b, a)
+            yield match_id, first, second, seed << 32 | match_id
+            match_id += 1
+
+
+def open_db(path):
+    db = sqlite3.connect(path)
+    db.execute('CREATE TABLE IF NOT EXISTS matches (id INTEGER PRIMARY KEY, first TEXT, second TEXT, seed INTEGER,'
+               ' winner INTEGER, shots_first INTEGER, shots_second INTEGER)')
+    db.execute('CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT)')
+    return db
+
+
+def run(entries, games, path, workers=None, seed=0):
+    """
+    Plays every game that is not in the database yet.
+    :return: (number of games played now, seconds it took)
+    """
+    entries = sorted(entries)
+    db = open_db(path)
+    settings = repr((entries, games, seed))
+    stored = db.execute("SELECT value FROM settings WHERE key = 'tournament'").fetchone()
+    if stored and stored[0] != settings:
+        raise ValueError('%s holds a different tournament, use another --db' % path)
+    with db:
+        db.execute("INSERT OR REPLACE INTO settings VALUES ('tournament', ?)", (settings,))
+    done = {row[0] for row in db.execute('SELECT id FROM matches')}
+    todo = [match for match in schedule(entries, games, seed) if match[0] not in done]
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        futures = [pool.submit(play_chunk, todo[i:i + CHUNK]) for i in range(0, len(todo), CHUNK)]
+        for future in as_completed(futures):
+            # one transaction per chunk
+            with db:
+                db.executemany('INSERT INTO matches VALUES (?, ?, ?, ?, ?, ?, ?)', future.result())
+    elapsed = time.perf_counter() - start
+    db.close()
+    return len(todo), elapsed
+
+
+def ratings(path):
+    """
+    Elo ratings from every game in the database, taken in the order they were scheduled.
+    :return: dict of entry -> {'elo', 'games', 'wins', 'shots'} where shots is the mean shots to win
+    """
+    db = open_db(path)
+    table = {}
+    for first, second, winner, shots_first, shots_second in db.execute(
+            'SELECT first, second, winner, shots_first, shots_second FROM matches ORDER BY id'):
+        for entry in (first, second):
+            table.setdefault(entry, {'elo': ELO_START, 'games': 0, 'wins': 0, 'shots': 0})
+        a, b = table[first], table[second]
+        expected = 1 / (1 + 10 ** ((b['elo'] - a['elo']) / 400))
+        score = 1 if winner == 0 else 0
+        a['elo'] += ELO_K * (score - expected)
+        b['elo'] -= ELO_K * (score - expected)
+        a['games'] += 1
+        b['games'] += 1
+        winning = a if winner == 0 else b
+        winning['wins'] += 1
+        winning['shots'] += shots_first if winner == 0 else shots_second
+    db.close()
+    for row in table.values():
+        row['shots'] = row['shots'] / row['wins'] if row['wins'] else 0
+    return table
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Play computer strategies against each other.')
+    parser.add_argument('--entries', nargs='+', default=['%s:random' % shooter for shooter in sorted(ai.SHOOTERS)],
+                        help='shooter:placer, shooters: %s, placers: %s' % (', '.join(sorted(ai.SHOOTERS)),
+                                                                           ', '.join(sorted(ai.PLACERS))))
+    parser.add_argument('--games', type=int, default=100, help='games for every pair of entries')
+    parser.add_argument('--db', default='tournament.sqlite')
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    for entry in args.entries:
+        shooter, _, placer = entry.partition(':')
+        if shooter not in ai.SHOOTERS or placer not in ai.PLACERS:
+            parser.error('unknown entry %s' % entry)
+    played, elapsed = run(args.entries, args.games, args.db, args.workers, args.seed)
+    if played:
+        print('played %i games in %.2fs: %.0f games/s' % (played, elapsed, played / elapsed))
+    else:
+        print('every game was already played')
+    table = ratings(args.db)
+    print('%-20s %7s %7s %7s %10s' % ('entry', 'elo', 'games', 'wins', 'shots/win'))
+    for entry, row in sorted(table.items(), key=lambda item: -item[1]['elo']):
+        print('%-20s %7.0f %7i %7i %10.2f' % (entry, row['elo'], row['games'], row['wins'], row['shots']))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,76 @@
 WHO_STARTS_TITLE = 'Who Starts?'
 BOARD_WIDTH = 10
 BOARD_HEIGHT = 10
+FLEET = (2, 3, 3, 4, 5)
+# coordinates are sent as one byte each
+MAX_BOARD_SIZE = 255
+# ship numbers are kept in one byte per cell by engine.Board
+MAX_FLEET = 255
+# pixels per cell on boards bigger than BOARD_WIDTH x BOARD_HEIGHT, and how far they zoom
+CELL_SIZE = 12
+MIN_CELL_SIZE = 6
+MAX_CELL_SIZE = 48
+# the computer player's opening book, see book.py, and how many positions it keeps in memory
+BOOK_PATH = 'book.bin'
+BOOK_CACHE_SIZE = 100000
+# where games are recorded, see replay.py, and the moves between its keyframes
+REPLAY_PATH = 'replays.bsr'
+KEYFRAME_INTERVAL = 16
+REPLAY_FPS = 30
+REPLAY_MAX_SPEED = 100
+# where analytics.py keeps games, and how many games go in one chunk of it
+ANALYTICS_PATH = 'games.store'
+SIMULATION_BATCH = 100000
+# bench.py: runs of every case before timing it, repetitions, and about how many seconds one takes
+BENCH_WARMUP = 3
+BENCH_REPEAT = 7
+BENCH_TIME = .05
 BATTLE_SHIP_TITLE = 'BattleShip'
+# milliseconds between checks for messages from the opponent
+POLL_INTERVAL = 10
+# how often the game canvas is redrawn
+RENDER_FPS = 60
 PORT = 12345
+BEACON_MIN_INTERVAL = .25
+BEACON_MAX_INTERVAL = 4
+BEACON_JITTER = .2
+# send the old text beacons instead of binary ones, for lobbies on older versions
+BEACON_LEGACY = False
+# set to a group like '239.255.66.83' to find players by multicast instead of broadcast
+MULTICAST_GROUP = None
+PEER_TTL = 3 * BEACON_MAX_INTERVAL
+HOST_PORT = 12346
+HOST_NAME = 'Battleship host'
+HOST_BACKLOG = 1024
+# seconds a new connection has to send CONNECT
+HANDSHAKE_TIMEOUT = 10
+# seconds without more of a handshake that lacks protocol.HANDSHAKE_END before it is taken as it is
+HANDSHAKE_GRACE = .5
+# seconds a challenge waits for an answer, on either side
+CHALLENGE_TIMEOUT = 60
+LISTEN_BACKLOG = 64
+# seconds a dropped game is given to reconnect, and between tries
+RESUME_TIMEOUT = 60
+RECONNECT_INTERVAL = 1
+KEEPALIVE_IDLE = 5
+KEEPALIVE_INTERVAL = 2
+KEEPALIVE_COUNT = 3
+RECONNECTING_TEXT = 'Reconnecting...'
+BROKEN_TEXT = 'Connection closed'
+RELAY_BUFFER = 65536
+STATS_INTERVAL = 10
+# seconds a bot of loadtest.py waits for any message before it gives up
+BOT_TIMEOUT = 30
+SPECTATE_PORT = 12347
+# bytes a spectator may fall behind before it is dropped
+SPECTATOR_BUFFER = 65536
+# how often the spectators are sent what the players published
+SPECTATE_FPS = 30
+LOBBY_FPS = 20
+LOBBY_ROWS = 12
+LOBBY_ROW_HEIGHT = 24
+LOBBY_WIDTH = 240
+CHALLENGE_ROWS = 4
 NAME_TITLE = 'Name?'
 NAME_QUESTION = 'What is your name?'
 PEG_SIZE = 20
@@ -14,5 +82,8 @@ PLAYER_NAME = (50, 430)
 TURN_MESSAGE = {True: 'Your Turn', False: 'Their Turn'}
 TURN_COLOR = {True: 'Green2', False: 'firebrick1'}
 TURN_TEXT = (540, 80)
+REMATCH_POS = (540, 130)
+REMATCH_TEXT = 'Rematch'
+AUTO_PLACE_TEXT = 'Place the rest at random'
 SUNK_POS = (55, 240)
 RECTANGLE_POS = (122, 85, 469, 323)